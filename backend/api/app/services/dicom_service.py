@@ -172,29 +172,30 @@ class DicomService:
     ) -> Image.Image:
         """Convert NIfTI file to PIL Image for model inference"""
         try:
-            # Load NIfTI file
-            nifti_img = nib.load(nifti_path)
-            data = nifti_img.get_fdata()
+            # Load NIfTI header; voxels are read per slice through the array proxy
+            nifti_img = nib.load(nifti_path, mmap='r')
+            shape = nifti_img.shape
             
             # Handle different dimensionalities
-            if len(data.shape) == 3:
+            if len(shape) == 3:
                 # 3D volume - extract middle slice or specified slice
                 if slice_idx is None:
-                    slice_idx = data.shape[2] // 2
-                elif slice_idx >= data.shape[2]:
-                    slice_idx = data.shape[2] - 1
-                slice_data = data[:, :, slice_idx]
-            elif len(data.shape) == 2:
+                    slice_idx = shape[2] // 2
+                elif slice_idx >= shape[2]:
+                    slice_idx = shape[2] - 1
+                slice_data = nifti_img.dataobj[:, :, slice_idx]
+            elif len(shape) == 2:
                 # 2D image
-                slice_data = data
-            elif len(data.shape) == 4:
+                slice_data = nifti_img.dataobj[:, :]
+            elif len(shape) == 4:
                 # 4D volume (e.g., fMRI) - take middle slice of middle volume
                 if slice_idx is None:
-                    slice_idx = data.shape[2] // 2
-                volume_idx = data.shape[3] // 2
-                slice_data = data[:, :, slice_idx, volume_idx]
+                    slice_idx = shape[2] // 2
+                volume_idx = shape[3] // 2
+                slice_data = nifti_img.dataobj[:, :, slice_idx, volume_idx]
             else:
-                raise ValueError(f"Unsupported data shape: {data.shape}")
+                raise ValueError(f"Unsupported data shape: {shape}")
+            slice_data = np.asarray(slice_data, dtype=np.float64)
             
             # Normalize to 0-255 range
             if slice_data.max() > slice_data.min():
@@ -221,25 +222,28 @@ class DicomService:
     def validate_nifti_file(self, nifti_path: str) -> Tuple[bool, Dict[str, Any]]:
         """Validate NIfTI file and extract metadata"""
         try:
-            nifti_img = nib.load(nifti_path)
-            data = nifti_img.get_fdata()
+            nifti_img = nib.load(nifti_path, mmap='r')
+            shape = nifti_img.shape
             header = nifti_img.header
             
             metadata = {
-                "shape": data.shape,
-                "data_type": str(data.dtype),
+                "shape": shape,
+                "data_type": "float64",  # The dtype get_fdata() returns
                 "voxel_size": header.get_zooms() if hasattr(header, 'get_zooms') else None,
                 "orientation": nib.orientations.io_orientation(nifti_img.affine),
                 "file_size_mb": os.path.getsize(nifti_path) / (1024 * 1024)
             }
             
             # Basic validation
-            if len(data.shape) < 2 or len(data.shape) > 4:
-                return False, {"error": f"Invalid dimensions: {data.shape}"}
+            if len(shape) < 2 or len(shape) > 4:
+                return False, {"error": f"Invalid dimensions: {shape}"}
             
-            if data.size == 0:
+            if int(np.prod(shape)) == 0:
                 return False, {"error": "Empty data array"}
             
+            # Reading the last voxel fails on a truncated file without loading the volume
+            nifti_img.dataobj[tuple(-1 for _ in shape)]
+            
             return True, metadata
             
         except Exception as e:
@@ -248,21 +252,21 @@ class DicomService:
     def get_nifti_slices_info(self, nifti_path: str) -> Dict[str, Any]:
         """Get information about slices in NIfTI file"""
         try:
-            nifti_img = nib.load(nifti_path)
-            data = nifti_img.get_fdata()
+            nifti_img = nib.load(nifti_path, mmap='r')
+            shape = nifti_img.shape
             
             info = {
-                "total_slices": data.shape[2] if len(data.shape) >= 3 else 1,
-                "recommended_slice": data.shape[2] // 2 if len(data.shape) >= 3 else 0,
-                "slice_range": [0, data.shape[2] - 1] if len(data.shape) >= 3 else [0, 0],
-                "dimensions": data.shape,
+                "total_slices": shape[2] if len(shape) >= 3 else 1,
+                "recommended_slice": shape[2] // 2 if len(shape) >= 3 else 0,
+                "slice_range": [0, shape[2] - 1] if len(shape) >= 3 else [0, 0],
+                "dimensions": shape,
                 "non_zero_slices": []
             }
             
-            # Find slices with actual data
-            if len(data.shape) >= 3:
-                for i in range(data.shape[2]):
-                    slice_data = data[:, :, i]
+            # Find slices with actual data, reading one slice at a time
+            if len(shape) >= 3:
+                for i in range(shape[2]):
+                    slice_data = np.asarray(nifti_img.dataobj[:, :, i], dtype=np.float64)
                     if np.sum(slice_data) > 0:
                         info["non_zero_slices"].append(i)
             
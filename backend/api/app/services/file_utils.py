@@ -398,12 +398,13 @@ class FileUtilsService:
                 # Validate NIfTI files
                 try:
                     import nibabel as nib
-                    nii = nib.load(str(file_path))
-                    data = nii.get_fdata()
+                    nii = nib.load(str(file_path), mmap='r')
+                    # Reading the last voxel fails on a truncated file without loading the volume
+                    nii.dataobj[tuple(-1 for _ in nii.shape)]
                     metadata.update({
-                        "nifti_shape": data.shape,
-                        "nifti_data_type": str(data.dtype),
-                        "nifti_dimensions": len(data.shape)
+                        "nifti_shape": nii.shape,
+                        "nifti_data_type": "float64",  # The dtype get_fdata() returns
+                        "nifti_dimensions": len(nii.shape)
                     })
                 except Exception as e:
                     errors.append(f"Invalid NIfTI file: {str(e)}")
@@ -457,13 +458,12 @@ class FileUtilsService:
         """Get NIfTI-specific metadata"""
         try:
             import nibabel as nib
-            nii = nib.load(str(file_path))
-            data = nii.get_fdata()
+            nii = nib.load(str(file_path), mmap='r')
             header = nii.header
             
             return {
-                "nifti_shape": data.shape,
-                "nifti_data_type": str(data.dtype),
+                "nifti_shape": nii.shape,
+                "nifti_data_type": "float64",  # The dtype get_fdata() returns
                 "nifti_voxel_size": header.get_zooms() if hasattr(header, 'get_zooms') else None,
                 "nifti_orientation": str(nii.affine.shape)
             }
@@ -26,8 +26,13 @@ from models.medical import Patient, Study, DicomFile, VLMAnalysis, Segmentation,
 from models.feedback import UserFeedback
 from models.medical_report import MedicalReport, ReportChatMessage
 from models.fall_detection import Camera, FallEvent
+from models.activity import ActivityEvent
+from models.video_consultation import VideoConsultation
+from models.job import Job
+from models.dashboard import DashboardStatsVersion
 from routes.radiology_reports import reports_bp
 from routes.fall_detection import fall_bp
+from services.dashboard_stats import get_user_dashboard_stats
 
 # Load environment variables from .env file
 load_dotenv()
@@ -101,6 +106,8 @@ from routes.evidence_routes import evidence_bp
 from routes.wearable_routes import wearable_bp
 from routes.video_consultation import video_consultation_bp
 from routes.feedback import feedback_bp
+from routes.jobs import jobs_bp
+from services.job_queue import start_job_queue
 
 # Register blueprints
 app.register_blueprint(reports_bp, url_prefix='/api/reports')
@@ -117,11 +124,15 @@ app.register_blueprint(evidence_bp, url_prefix='/api/evidence')
 app.register_blueprint(wearable_bp, url_prefix='/api/wearable')
 app.register_blueprint(video_consultation_bp, url_prefix='/api/video-consultation')
 app.register_blueprint(feedback_bp, url_prefix='/api')
+app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
 
 # Create tables
 with app.app_context():
     db.create_all()
 
+# Fail jobs left unfinished by a previous run, and keep this process's jobs' heartbeats current
+start_job_queue(app)
+
 # Authentication Routes
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -220,6 +231,17 @@ def get_health_records():
 
 @app.route('/api/health-records', methods=['POST'])
 def create_health_record():
+    # The token is only used to record activity; a stale or malformed one must not block saving
+    from flask_jwt_extended import verify_jwt_in_request
+    user_id = None
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+        if identity:
+            user_id = int(identity)
+    except Exception as e:
+        print(f"DEBUG: JWT optional check in create_health_record: {str(e)}")
+    
     data = request.get_json()
     record = HealthRecord(
         type=data['type'],
@@ -229,6 +251,12 @@ def create_health_record():
         content=data.get('content')
     )
     db.session.add(record)
+    if user_id:
+        db.session.flush()
+        ActivityEvent.record(
+            user_id, 'health_record', f'{record.type} Record' if record.type else 'Health Record',
+            record.title, source_id=record.id
+        )
     db.session.commit()
     return jsonify(record.to_dict()), 201
 
@@ -273,39 +301,8 @@ def get_dashboard_stats():
     if not user:
         return jsonify({'message': 'User not found'}), 404
     
-    # Import MedicalReport model
-    from models.medical_report import MedicalReport
-    from services.doctor_notes_vector_store import DoctorNotesVectorStore
-    
-    # Count user's medical reports (uploaded PDFs)
-    medical_reports_count = MedicalReport.query.filter_by(user_id=user_id).count()
-    
-    # Count active medications from doctor notes
-    active_medications_count = 0
-    try:
-        vector_store = DoctorNotesVectorStore()
-        all_notes = vector_store.get_all_notes()
-        
-        # Filter by user and extract medications
-        user_notes = [note for note in all_notes if note.get('user_id') == user_id and not note.get('deleted', False)]
-        unique_medications = set()
-        
-        for note in user_notes:
-            patient_context = note.get('patient_context', {})
-            medications = patient_context.get('medications', [])
-            if isinstance(medications, list):
-                unique_medications.update(medications)
-        
-        active_medications_count = len(unique_medications)
-    except Exception as e:
-        print(f"DEBUG: Error counting medications from notes: {str(e)}")
-        # Fallback to 0 if error
-    
-    # Get recent symptom checks for this user
-    recent_symptom_checks = SymptomCheck.query.filter_by(user_id=user_id).order_by(SymptomCheck.created_at.desc()).limit(5).all()
-    
-    # Get latest medical report
-    latest_report = MedicalReport.query.filter_by(user_id=user_id).order_by(MedicalReport.uploaded_at.desc()).first()
+    # Report/symptom-check counters in one aggregate query, cached per user
+    stats = get_user_dashboard_stats(user_id)
     
     return jsonify({
         'user': {
@@ -315,19 +312,20 @@ def get_dashboard_stats():
             'last_name': user.last_name,
             'full_name': user.full_name
         },
-        'stats': {
-            'health_records_count': medical_reports_count,  # Count of uploaded medical reports
-            'active_medications_count': active_medications_count,  # Count from doctor notes
-            'symptom_checks_count': len(recent_symptom_checks),
-            'latest_health_record': latest_report.to_dict() if latest_report else None
-        }
+        'stats': stats
     }), 200
 
 @app.route('/api/dashboard/recent-activity', methods=['GET'])
 def get_recent_activity():
-    """Get recent activity for the logged-in user"""
+    """
+    Get recent activity for the logged-in user, newest first.
+    
+    Query params: limit (default 5, max 50) and before, the next_cursor of
+    the previous page.
+    """
     # Manual JWT verification
     from flask_jwt_extended import verify_jwt_in_request
+    from sqlalchemy import and_, or_
     
     try:
         verify_jwt_in_request()
@@ -339,143 +337,33 @@ def get_recent_activity():
     if not user_id:
         return jsonify({'message': 'Authentication required', 'error': 'No user ID in token'}), 401
     
-    activities = []
-    
-    # Import MedicalReport model
-    from models.medical_report import MedicalReport
-    
-    # Get recent symptom checks
-    symptom_checks = SymptomCheck.query.filter_by(user_id=user_id).order_by(SymptomCheck.created_at.desc()).limit(3).all()
-    for check in symptom_checks:
-        activities.append({
-            'type': 'symptom',
-            'title': 'Symptom Check',
-            'desc': check.description[:50] + '...' if len(check.description) > 50 else check.description,
-            'time': check.created_at.isoformat() + 'Z' if check.created_at else datetime.now(datetime.UTC).isoformat(),
-            'icon': 'MessageCircle',
-            'color': 'violet'
-        })
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 50)
+    query = ActivityEvent.query.filter_by(user_id=user_id)
+    
+    # Keyset pagination on the (user_id, created_at, id) index
+    before = request.args.get('before')
+    if before:
+        try:
+            before_time, before_id = before.rsplit('_', 1)
+            before_time = datetime.fromisoformat(before_time)
+            before_id = int(before_id)
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        query = query.filter(or_(
+            ActivityEvent.created_at < before_time,
+            and_(ActivityEvent.created_at == before_time, ActivityEvent.id < before_id)
+        ))
+    
+    events = query.order_by(ActivityEvent.created_at.desc(), ActivityEvent.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(events) > limit:
+        last = events[limit - 1]
+        next_cursor = f"{last.created_at.isoformat()}_{last.id}"
     
-    # Get recent medical reports (user-specific)
-    medical_reports = MedicalReport.query.filter_by(user_id=user_id).order_by(MedicalReport.uploaded_at.desc()).limit(3).all()
-    for report in medical_reports:
-        activities.append({
-            'type': 'report',
-            'title': 'Medical Report Uploaded',
-            'desc': report.filename,
-            'time': report.uploaded_at.isoformat() + 'Z' if report.uploaded_at else datetime.now(datetime.UTC).isoformat(),
-            'icon': 'FileText',
-            'color': 'blue'
-        })
-    
-    # Get recent health records (make user-specific if patient_id exists)
-    health_records = HealthRecord.query.order_by(HealthRecord.created_at.desc()).limit(2).all()
-    for record in health_records:
-        activities.append({
-            'type': 'health_record',
-            'title': f'{record.type} Record' if record.type else 'Health Record',
-            'desc': record.title,
-            'time': record.created_at.isoformat() + 'Z' if record.created_at else datetime.now(datetime.UTC).isoformat(),
-            'icon': 'Activity',
-            'color': 'rose'
-        })
-    
-    # Get recent doctor notes from vector store
-    try:
-        from services.doctor_notes_vector_store import DoctorNotesVectorStore
-        vector_store = DoctorNotesVectorStore()
-        all_notes = vector_store.get_all_notes()
-        
-        # Filter by user and get recent ones
-        user_notes = [
-            note for note in all_notes 
-            if note.get('user_id') == user_id and not note.get('deleted', False)
-        ]
-        
-        # Sort by created_at and take top 3
-        user_notes.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        recent_notes = user_notes[:3]
-        
-        for note in recent_notes:
-            activities.append({
-                'type': 'doctor_note',
-                'title': 'Doctor Note Created',
-                'desc': note.get('title', 'Consultation Note')[:50] + '...' if len(note.get('title', '')) > 50 else note.get('title', 'Consultation Note'),
-                'time': note.get('created_at', '') + 'Z' if note.get('created_at') else datetime.now(datetime.UTC).isoformat(),
-                'icon': 'FileText',
-                'color': 'emerald'
-            })
-    except Exception as e:
-        print(f"DEBUG: Error fetching doctor notes for activity: {str(e)}")
-    
-    # Get recent video consultations
-    try:
-        import os
-        import json
-        from pathlib import Path
-        
-        print(f"DEBUG: Looking for videos for user_id: {user_id}")
-        
-        video_folder = os.path.join(os.path.dirname(__file__), 'uploads', 'videos')
-        print(f"DEBUG: Video folder path: {video_folder}")
-        print(f"DEBUG: Video folder exists: {os.path.exists(video_folder)}")
-        
-        if os.path.exists(video_folder):
-            video_files = []
-            all_files = os.listdir(video_folder)
-            print(f"DEBUG: All files in video folder: {all_files}")
-            
-            # Get all metadata files for this user
-            for filename in all_files:
-                print(f"DEBUG: Checking file: {filename}")
-                if filename.endswith('_metadata.json'):
-                    print(f"DEBUG: Found metadata file: {filename}")
-                    if filename.startswith(f"{user_id}_"):
-                        print(f"DEBUG: Metadata file matches user_id: {filename}")
-                        metadata_filepath = os.path.join(video_folder, filename)
-                        
-                        try:
-                            with open(metadata_filepath, 'r') as f:
-                                metadata = json.load(f)
-                            print(f"DEBUG: Loaded metadata: {metadata}")
-                            video_files.append(metadata)
-                        except Exception as e:
-                            print(f"Error reading video metadata {filename}: {str(e)}")
-                    else:
-                        print(f"DEBUG: Metadata file does NOT match user_id {user_id}: {filename}")
-            
-            print(f"DEBUG: Total video files found for user: {len(video_files)}")
-            
-            # Sort by upload time and take recent ones
-            video_files.sort(key=lambda x: x.get('uploaded_at', ''), reverse=True)
-            recent_videos = video_files[:3]
-            
-            for video in recent_videos:
-                description = video.get('description', '')
-                if description:
-                    desc_text = description[:50] + '...' if len(description) > 50 else description
-                else:
-                    desc_text = f"Video message to doctor"
-                
-                activities.append({
-                    'type': 'video_consultation',
-                    'title': 'Video Consultation Sent',
-                    'desc': desc_text,
-                    'time': video.get('uploaded_at', '') + 'Z' if video.get('uploaded_at') else datetime.now(datetime.UTC).isoformat(),
-                    'icon': 'Video',
-                    'color': 'purple'
-                })
-                print(f"DEBUG: Added video activity: {desc_text}")
-    except Exception as e:
-        print(f"DEBUG: Error fetching video consultations for activity: {str(e)}")
-        import traceback
-        traceback.print_exc()
-    
-    # Sort by time (most recent first) and limit to 10
-    activities.sort(key=lambda x: x['time'], reverse=True)
-    activities = activities[:5]
-    
-    return jsonify({'activities': activities}), 200
+    return jsonify({
+        'activities': [event.to_dict() for event in events[:limit]],
+        'next_cursor': next_cursor
+    }), 200
 
 # Upload & Explanation Routes
 
@@ -539,6 +427,7 @@ def create_journal_entry():
 
 
 if __name__ == '__main__':
+    # Prefer server.py: spawned job workers re-run the main module, and this one loads everything
     # Use debug=False in production, or read from environment
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     app.run(debug=debug_mode, host='0.0.0.0', port=5001)
\ No newline at end of file
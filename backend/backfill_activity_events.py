@@ -0,0 +1,64 @@
+"""
+Backfill the activity feed from data created before activity events existed.
+
+Creates an ActivityEvent for every symptom check, medical report, live
+doctor note and uploaded video that does not have one yet, so it is safe
+to run more than once. Run import_video_metadata.py first so that older
+videos are in the database.
+"""
+from datetime import datetime, timezone
+
+from app import app
+from extensions import db
+from models.activity import ActivityEvent
+from models.medical import SymptomCheck
+from models.medical_report import MedicalReport
+from models.video_consultation import VideoConsultation
+from services.doctor_notes_vector_store import get_vector_store
+
+
+def parse_time(value):
+    """Naive UTC datetime from an ISO timestamp, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.rstrip('Z'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+with app.app_context():
+    existing = {
+        (event_type, source_id)
+        for event_type, source_id in db.session.query(ActivityEvent.event_type, ActivityEvent.source_id)
+    }
+    added = 0
+    
+    def record(user_id, event_type, title, description, source_id, created_at):
+        global added
+        if user_id is None or (event_type, str(source_id)) in existing:
+            return
+        ActivityEvent.record(user_id, event_type, title, description, source_id=source_id, created_at=created_at)
+        existing.add((event_type, str(source_id)))
+        added += 1
+    
+    for check in SymptomCheck.query.filter(SymptomCheck.user_id.isnot(None)).yield_per(1000):
+        record(check.user_id, 'symptom', 'Symptom Check', check.description or '', check.id, check.created_at)
+    
+    for report in MedicalReport.query.yield_per(1000):
+        record(report.user_id, 'report', 'Medical Report Uploaded', report.filename, report.id, report.uploaded_at)
+    
+    for note in get_vector_store().get_all_notes():
+        if not note['deleted']:
+            record(note['user_id'], 'doctor_note', 'Doctor Note Created', note.get('title') or 'Consultation Note',
+                   note['id'], parse_time(note.get('created_at')))
+    
+    for video in VideoConsultation.query.yield_per(1000):
+        record(video.user_id, 'video_consultation', 'Video Consultation Sent',
+               video.description or 'Video message to doctor', video.video_id, video.uploaded_at)
+    
+    db.session.commit()
+    print(f"✓ Added {added} activity event(s)")
@@ -0,0 +1,155 @@
+"""
+Benchmark the DICOM series indexer on a synthetic multi-series study.
+
+Writes a CT-like study of several axial series (full pixel data, 16-bit)
+whose InstanceNumbers are shuffled relative to anatomy, then indexes it
+serially and with process pools of increasing size, reports files/s and
+checks that every series came back in spatial order. With --zip the study
+is also packed into an archive and indexed from that.
+
+Usage:
+    python benchmark_dicom_indexer.py                     # 4 series x 750 slices
+    python benchmark_dicom_indexer.py --series 2 --slices 1000 --size 512 --zip
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from utils.dicom_series_indexer import DicomSeriesIndexer
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+
+
+def write_study(directory, num_series, num_slices, size, seed=0):
+    """Write the synthetic study; returns {series_uid: z positions in anatomical order}."""
+    rng = random.Random(seed)
+    pixels = np.random.default_rng(seed).integers(0, 4096, (size, size), dtype=np.uint16).tobytes()
+    study_uid = generate_uid()
+    expected = {}
+    
+    for series_number in range(1, num_series + 1):
+        series_uid = generate_uid()
+        spacing = rng.choice([0.625, 1.0, 1.25])
+        z_positions = [-200.0 + i * spacing for i in range(num_slices)]
+        # Scanners do not always number slices in anatomical order
+        instance_numbers = list(range(1, num_slices + 1))
+        rng.shuffle(instance_numbers)
+        expected[series_uid] = z_positions
+        
+        for z, instance_number in zip(z_positions, instance_numbers):
+            meta = Dataset()
+            meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+            meta.MediaStorageSOPInstanceUID = generate_uid()
+            meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            path = os.path.join(directory, f'{series_number:02d}_{instance_number:05d}.dcm')
+            ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+            ds.is_little_endian = True
+            ds.is_implicit_VR = False
+            ds.SOPClassUID = CT_IMAGE_STORAGE
+            ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+            ds.PatientName = 'Benchmark^Patient'
+            ds.PatientID = 'BENCH001'
+            ds.StudyInstanceUID = study_uid
+            ds.StudyDate = '20240101'
+            ds.SeriesInstanceUID = series_uid
+            ds.SeriesNumber = series_number
+            ds.Modality = 'CT'
+            ds.InstanceNumber = instance_number
+            ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+            ds.ImagePositionPatient = [-250.0, -250.0, z]
+            ds.SliceThickness = spacing
+            ds.PixelSpacing = [0.7, 0.7]
+            ds.Rows = ds.Columns = size
+            ds.SamplesPerPixel = 1
+            ds.PhotometricInterpretation = 'MONOCHROME2'
+            ds.BitsAllocated = ds.BitsStored = 16
+            ds.HighBit = 15
+            ds.PixelRepresentation = 0
+            ds.PixelData = pixels
+            ds.save_as(path, write_like_original=False)
+    
+    return expected
+
+
+def check_order(result, expected):
+    """Problems with the indexed tree, if any."""
+    problems = []
+    series_by_uid = {s['series_instance_uid']: s for study in result['studies'] for s in study['series']}
+    for series_uid, z_positions in expected.items():
+        series = series_by_uid.get(series_uid)
+        if series is None:
+            problems.append(f'series {series_uid} missing')
+            continue
+        got = [instance['image_position_patient'][2] for instance in series['instances']]
+        if not np.allclose(got, z_positions):
+            problems.append(f'series {series["series_number"]} is not in spatial order')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--series', type=int, default=4)
+    parser.add_argument('--slices', type=int, default=750, help='Slices per series')
+    parser.add_argument('--size', type=int, default=256, help='Rows and columns of each slice')
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='Pool sizes to compare (default: 1, 2, 4, ... up to all cores)')
+    parser.add_argument('--zip', action='store_true', help='Also index the study from a ZIP archive')
+    args = parser.parse_args()
+    
+    cores = os.cpu_count() or 1
+    pool_sizes = args.workers or sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+    
+    workdir = tempfile.mkdtemp(prefix='dicom-index-bench-')
+    try:
+        study_dir = os.path.join(workdir, 'study')
+        os.makedirs(study_dir)
+        started = time.perf_counter()
+        expected = write_study(study_dir, args.series, args.slices, args.size)
+        total = args.series * args.slices
+        size_mb = sum(os.path.getsize(os.path.join(study_dir, f)) for f in os.listdir(study_dir)) / 2 ** 20
+        print(f"Wrote {total} slices ({size_mb:.0f} MB) in {time.perf_counter() - started:.1f}s, "
+              f"{cores} cores available")
+        
+        failures = []
+        baseline = None
+        for workers in pool_sizes:
+            started = time.perf_counter()
+            result = DicomSeriesIndexer.index(study_dir, max_workers=workers)
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            print(f"  {workers:>3} worker(s): {elapsed:6.2f}s  {total / elapsed:8.0f} files/s  "
+                  f"speedup {baseline / elapsed:4.1f}x")
+            failures += check_order(result, expected)
+            if len(result['skipped']) or result['studies'][0]['instance_count'] != total:
+                failures.append(f'{workers} workers indexed {result["studies"][0]["instance_count"]} of {total}')
+        
+        if args.zip:
+            archive = os.path.join(workdir, 'study.zip')
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for name in os.listdir(study_dir):
+                    zf.write(os.path.join(study_dir, name), os.path.join('study', name))
+            started = time.perf_counter()
+            result = DicomSeriesIndexer.index(archive, extract_dir=os.path.join(workdir, 'extracted'))
+            print(f"  ZIP (extract + index, {cores} workers): {time.perf_counter() - started:.2f}s")
+            failures += check_order(result, expected)
+        
+        if failures:
+            print(f"FAILED ({len(failures)} problems):")
+            for failure in failures[:20]:
+                print(f"  {failure}")
+            raise SystemExit(1)
+        print("OK: every series in spatial order")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
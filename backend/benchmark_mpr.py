@@ -0,0 +1,91 @@
+"""
+Benchmark multi-planar reconstruction from the in-memory volume cache.
+
+Writes a CT-like int16 NIfTI volume, then times MprService renders of
+orthogonal, oblique and thick-slab planes at full and preview resolution,
+against reloading the volume for every request (what rendering a reformatted
+plane cost before volumes were cached). The first MPR request includes
+loading the volume and building its pyramid. Also checks that an untilted
+plane matches NiftiProcessor's slice of the same file.
+
+Usage:
+    python benchmark_mpr.py                     # 512x512x200
+    python benchmark_mpr.py --shape 512 512 400 --repeat 20
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+workdir = tempfile.mkdtemp(prefix='mpr-bench-')
+os.environ['NIFTI_CACHE_DIR'] = os.path.join(workdir, 'cache')
+
+import nibabel as nib
+import numpy as np
+
+from services.radiology.mpr_service import MprService
+from utils.nifti_processor import NiftiProcessor
+
+CASES = [
+    ('axial slice', {'plane': 'axial'}),
+    ('coronal slice (resampled)', {'plane': 'coronal'}),
+    ('double oblique', {'plane': 'axial', 'tilt_x': 20, 'tilt_y': -15}),
+    ('oblique 10mm MIP slab', {'plane': 'coronal', 'tilt_x': 25, 'thickness': 10, 'projection': 'mip'}),
+    ('axial 20mm MIP slab', {'plane': 'axial', 'thickness': 20, 'projection': 'mip'}),
+    ('oblique, level 2 preview', {'plane': 'sagittal', 'tilt_y': 30, 'level': 2}),
+]
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=[512, 512, 200])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    
+    try:
+        x, y, z = np.ogrid[:args.shape[0], :args.shape[1], :args.shape[2]]
+        volume = ((x + 2 * y + 3 * z) % 2000 - 1000).astype(np.int16)
+        path = os.path.join(workdir, 'volume.nii')
+        nib.save(nib.Nifti1Image(volume, np.diag([0.7, 0.7, 1.25, 1])), path)
+        del volume
+        
+        started = time.perf_counter()
+        MprService.render(MprService.get_nifti_volume(path), 'png', 40, 400)
+        print(f"Volume {'x'.join(map(str, args.shape))} int16: first request (load + pyramid + render) "
+              f"{(time.perf_counter() - started) * 1000:.0f} ms")
+        
+        # The old way: every request reloads the whole volume before reformatting
+        reload_ms = median_ms(lambda: nib.load(path).get_fdata(dtype=np.float32), max(args.repeat // 2, 1))
+        print(f"Reloading the volume per request would add {reload_ms:.0f} ms to each render")
+        print(f"{'plane':<28} {'cached ms':>10} {'with reload ms':>15}")
+        for name, plane in CASES:
+            cached_ms = median_ms(
+                lambda: MprService.render(MprService.get_nifti_volume(path), 'png', 40, 400, **plane),
+                args.repeat
+            )
+            print(f"{name:<28} {cached_ms:>10.1f} {cached_ms + reload_ms:>15.1f}")
+        
+        middle = args.shape[2] // 2
+        expected = NiftiProcessor.read_slice(NiftiProcessor.load_nifti(path), middle, 2)
+        image = MprService.reformat(MprService.get_nifti_volume(path), 'axial', middle)[0]
+        print(f"Cache: {MprService.get_cache_stats()}")
+        if not np.array_equal(image, expected):
+            print("FAILED: the axial MPR plane differs from NiftiProcessor.read_slice")
+            raise SystemExit(1)
+        print("OK: axial MPR plane matches NiftiProcessor.read_slice")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
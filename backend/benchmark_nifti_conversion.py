@@ -0,0 +1,100 @@
+"""
+Benchmark DICOM-to-NIfTI conversion of a multi-series study.
+
+Writes a synthetic study (see benchmark_dicom_indexer), then converts every
+series with DicomNiftiConverter, serially and with a process pool. If
+dicom2nifti is installed, the previous approach (linking each series into a
+temporary directory and running dicom2nifti.convert_directory on it) is
+timed as well, and the volumes and affines are checked to match its output.
+
+Usage:
+    python benchmark_nifti_conversion.py                 # 4 series x 200 slices
+    python benchmark_nifti_conversion.py --series 8 --slices 300 --size 512
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from benchmark_dicom_indexer import write_study
+from utils.dicom_nifti_converter import DicomNiftiConverter
+from utils.dicom_series_indexer import DicomSeriesIndexer
+
+try:
+    import dicom2nifti
+except ImportError:
+    dicom2nifti = None
+
+
+def convert_with_dicom2nifti(series, workdir):
+    """The previous per-series round trip; returns the output paths"""
+    outputs = []
+    for n, file_paths in enumerate(series):
+        temp_dir = os.path.join(workdir, 'temp', str(n))
+        output_dir = os.path.join(workdir, 'dicom2nifti', str(n))
+        os.makedirs(temp_dir)
+        os.makedirs(output_dir)
+        for path in file_paths:
+            os.symlink(path, os.path.join(temp_dir, os.path.basename(path)))
+        dicom2nifti.convert_directory(temp_dir, output_dir, compression=True, reorient=True)
+        outputs.append(os.path.join(output_dir, os.listdir(output_dir)[0]))
+        shutil.rmtree(temp_dir)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--series', type=int, default=4)
+    parser.add_argument('--slices', type=int, default=200, help='Slices per series')
+    parser.add_argument('--size', type=int, default=256, help='Rows and columns of each slice')
+    args = parser.parse_args()
+    
+    cores = os.cpu_count() or 1
+    workdir = tempfile.mkdtemp(prefix='nifti-conversion-bench-')
+    try:
+        study_dir = os.path.join(workdir, 'study')
+        os.makedirs(study_dir)
+        write_study(study_dir, args.series, args.slices, args.size)
+        index = DicomSeriesIndexer.index(study_dir)
+        series = [[i['file_path'] for i in s['instances']] for s in index['studies'][0]['series']]
+        print(f"{args.series} series x {args.slices} slices of {args.size}x{args.size}, {cores} cores available")
+        
+        results = None
+        for label, workers in (('serial', 1), (f'{cores} workers', cores)):
+            output_dir = os.path.join(workdir, label.replace(' ', '_'))
+            os.makedirs(output_dir)
+            jobs = [(file_paths, os.path.join(output_dir, f'{n}.nii.gz')) for n, file_paths in enumerate(series)]
+            started = time.perf_counter()
+            results = DicomNiftiConverter.convert_many(jobs, max_workers=workers)
+            print(f"  {'DicomNiftiConverter, ' + label:<32} {time.perf_counter() - started:6.2f}s")
+        
+        failures = [f"series {n}: {r['error']}" for n, r in enumerate(results) if not r['output_path']]
+        if dicom2nifti is None:
+            print("  dicom2nifti is not installed; skipping the comparison")
+        elif not failures:
+            started = time.perf_counter()
+            expected = convert_with_dicom2nifti(series, workdir)
+            print(f"  {'temp dir + dicom2nifti':<32} {time.perf_counter() - started:6.2f}s")
+            for n, (result, path) in enumerate(zip(results, expected)):
+                ours, theirs = nib.load(result['output_path']), nib.load(path)
+                if not np.allclose(ours.affine, theirs.affine, atol=1e-3):
+                    failures.append(f"series {n}: affine differs from dicom2nifti")
+                elif not np.array_equal(ours.get_fdata(), theirs.get_fdata()):
+                    failures.append(f"series {n}: voxels differ from dicom2nifti")
+        
+        if failures:
+            print("FAILED:")
+            for failure in failures:
+                print(f"  {failure}")
+            raise SystemExit(1)
+        print("OK: every series converted" + (", matching dicom2nifti" if dicom2nifti else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
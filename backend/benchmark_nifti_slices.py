@@ -0,0 +1,98 @@
+"""
+Benchmark single-slice NIfTI reads: whole-volume get_fdata() vs proxy slicing.
+
+Writes a CT-like int16 volume as .nii and .nii.gz, then for each file and
+each axis times reading one slice the old way (get_fdata() then index) and
+through NiftiProcessor.load_nifti/read_slice, reporting the peak memory
+allocated (tracemalloc) and checking both give the same pixels. For .nii.gz
+the one-off decompression into the NIfTI cache is reported separately.
+
+Usage:
+    python benchmark_nifti_slices.py                   # 512x512x200
+    python benchmark_nifti_slices.py --shape 512 512 400
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+workdir = tempfile.mkdtemp(prefix='nifti-slice-bench-')
+os.environ['NIFTI_CACHE_DIR'] = os.path.join(workdir, 'cache')
+
+import nibabel as nib
+import numpy as np
+
+from utils.nifti_processor import NiftiProcessor
+
+
+def legacy_slice(file_path, slice_index, axis):
+    """The slice the renderer got before, by loading the whole volume"""
+    data = nib.load(file_path).get_fdata(dtype=np.float32)
+    slicer = [slice(None)] * 3
+    slicer[axis] = slice_index
+    return np.rot90(data[tuple(slicer)])
+
+
+def proxy_slice(file_path, slice_index, axis):
+    return NiftiProcessor.read_slice(NiftiProcessor.load_nifti(file_path), slice_index, axis)
+
+
+def measure(function, *args):
+    """(milliseconds, peak bytes allocated, result) of one call"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function(*args)
+    elapsed = (time.perf_counter() - started) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=[512, 512, 200])
+    args = parser.parse_args()
+
+    try:
+        # Smooth data with noise, so gzip behaves as it does on real scans
+        x, y, z = np.ogrid[:args.shape[0], :args.shape[1], :args.shape[2]]
+        volume = ((x + y + z) % 2000 - 1000).astype(np.int16)
+        volume += np.random.default_rng(0).integers(-20, 20, args.shape, dtype=np.int16)
+        image = nib.Nifti1Image(volume, np.eye(4))
+        files = {}
+        for name in ('volume.nii', 'volume.nii.gz'):
+            files[name] = os.path.join(workdir, name)
+            nib.save(image, files[name])
+        del volume, image
+        print(f"Volume {'x'.join(map(str, args.shape))} int16, "
+              f"{os.path.getsize(files['volume.nii']) / 2 ** 20:.0f} MB uncompressed")
+
+        elapsed, _, _ = measure(NiftiProcessor.uncompressed_path, files['volume.nii.gz'])
+        print(f"One-off decompression of volume.nii.gz into the cache: {elapsed:.0f} ms")
+
+        failures = []
+        print(f"{'file':<14} {'axis':>4} {'get_fdata ms':>13} {'peak':>9} {'slice ms':>9} {'peak':>9}")
+        for name, path in files.items():
+            for axis in (2, 1, 0):
+                slice_index = args.shape[axis] // 3
+                legacy_ms, legacy_peak, expected = measure(legacy_slice, path, slice_index, axis)
+                new_ms, new_peak, result = measure(proxy_slice, path, slice_index, axis)
+                print(f"{name:<14} {axis:>4} {legacy_ms:>13.1f} {legacy_peak / 2 ** 20:>7.1f}MB "
+                      f"{new_ms:>9.1f} {new_peak / 2 ** 20:>7.2f}MB")
+                if not np.array_equal(result, expected):
+                    failures.append(f"{name} axis {axis}: slices differ")
+
+        if failures:
+            print("FAILED:")
+            for failure in failures:
+                print(f"  {failure}")
+            raise SystemExit(1)
+        print("OK: proxy slices match get_fdata()")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
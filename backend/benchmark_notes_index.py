@@ -0,0 +1,95 @@
+"""
+Benchmark the doctor notes index types against the exact flat baseline.
+
+Builds a synthetic corpus of clustered, unit-length 384-d vectors (shaped like
+all-MiniLM-L6-v2 note embeddings), then reports build time, recall@k against
+exact search and single-query p50/p95 latency for each index type.
+
+Usage:
+    python benchmark_notes_index.py                      # 1M notes
+    python benchmark_notes_index.py --num-notes 100000 --types flat hnsw
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from services.embedding_service import EMBEDDING_DIMENSION
+from services.vector_index_factory import build_index
+
+
+def synthetic_corpus(num_notes, num_queries, dimension, num_topics=1000, seed=0):
+    """Clustered unit vectors for the corpus, plus held-out queries."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_topics, dimension)).astype('float32')
+
+    def sample(n):
+        vectors = topics[rng.integers(0, num_topics, n)]
+        vectors += 0.6 * rng.standard_normal((n, dimension)).astype('float32')
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    return sample(num_notes), sample(num_queries)
+
+
+def time_queries(index, queries, k):
+    """Per-query latencies in milliseconds and the returned IDs."""
+    latencies = []
+    results = np.empty((len(queries), k), dtype='int64')
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results[i] = ids[0]
+    return np.array(latencies), results
+
+
+def recall_at_k(results, ground_truth):
+    """Mean fraction of the exact top-k present in the approximate top-k."""
+    hits = sum(len(set(r) & set(g)) for r, g in zip(results, ground_truth))
+    return hits / float(ground_truth.size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-notes', type=int, default=1000000)
+    parser.add_argument('--num-queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', nargs='+', default=['flat', 'hnsw', 'ivfpq'],
+                        choices=['flat', 'hnsw', 'ivfpq'])
+    args = parser.parse_args()
+
+    print(f"Generating {args.num_notes:,} synthetic notes ({EMBEDDING_DIMENSION}-d)...")
+    vectors, queries = synthetic_corpus(args.num_notes, args.num_queries, EMBEDDING_DIMENSION)
+    vector_ids = np.arange(len(vectors), dtype='int64')
+
+    print("Computing exact ground truth...")
+    _, ground_truth = faiss.knn(queries, vectors, args.k)
+
+    rows = []
+    for kind in args.types:
+        print(f"Building {kind} index...")
+        started = time.perf_counter()
+        index = build_index(kind, EMBEDDING_DIMENSION, vectors, vector_ids)
+        build_seconds = time.perf_counter() - started
+
+        latencies, results = time_queries(index, queries, args.k)
+        rows.append((
+            kind,
+            build_seconds,
+            recall_at_k(results, ground_truth),
+            np.percentile(latencies, 50),
+            np.percentile(latencies, 95)
+        ))
+        del index
+
+    print()
+    print(f"{'index':<8}{'build (s)':>12}{f'recall@{args.k}':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}")
+    print("-" * 56)
+    for kind, build_seconds, recall, p50, p95 in rows:
+        print(f"{kind:<8}{build_seconds:>12.1f}{recall:>12.3f}{p50:>12.3f}{p95:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
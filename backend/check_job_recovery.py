@@ -0,0 +1,118 @@
+"""
+Check that jobs of a server process that dies are failed, not left unfinished.
+
+Starts a worker process that queues two slow jobs (one running, one queued
+behind it) and kills it. This process, which has a job of its own running,
+then starts its job monitor: the dead worker's jobs must be failed as
+interrupted once their heartbeat is JOB_STALE_SECONDS old, while this
+process's job keeps running and completes. Uses a temporary SQLite database.
+
+Usage:
+    python check_job_recovery.py
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('JOB_QUEUE_WORKERS', '1')
+os.environ['JOB_HEARTBEAT_SECONDS'] = '1'
+os.environ['JOB_STALE_SECONDS'] = '3'
+
+from flask import Flask
+
+from extensions import db
+import models.auth  # noqa: F401 (jobs.user_id references users)
+from models.job import Job
+from services import job_queue
+
+JOB_SECONDS = 6
+
+
+def slow_job(job, steps):
+    """Sleep in JOB_SECONDS / steps increments, reporting progress"""
+    for step in range(steps):
+        time.sleep(JOB_SECONDS / steps)
+        job.update((step + 1) / steps, f"Step {step + 1} of {steps}")
+    return {'steps': steps}
+
+
+def create_app(database_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    db.init_app(app)
+    job_queue.JOB_HANDLERS['slow'] = slow_job
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def run_worker(database_path):
+    """Queue two jobs, report their ids, then wait to be killed"""
+    app = create_app(database_path)
+    with app.app_context():
+        ids = [job_queue.enqueue_job(app, 'slow', {'steps': 12}).id for _ in range(2)]
+    print(' '.join(ids), flush=True)
+    time.sleep(3600)
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='job-recovery-check-')
+    try:
+        database_path = os.path.join(workdir, 'jobs.db')
+        app = create_app(database_path)
+        
+        worker = subprocess.Popen([sys.executable, __file__, '--worker', database_path],
+                                  stdout=subprocess.PIPE, text=True)
+        orphaned = worker.stdout.readline().split()
+        time.sleep(1.5)  # Let the first job start
+        worker.send_signal(signal.SIGKILL)
+        worker.wait()
+        with app.app_context():
+            before = {job.id: job.status for job in Job.query.filter(Job.id.in_(orphaned))}
+            print(f"Killed a worker with jobs {before}")
+            own = job_queue.enqueue_job(app, 'slow', {'steps': 12}).id
+        
+        started = time.monotonic()
+        deadline = started + int(os.environ['JOB_STALE_SECONDS']) + JOB_SECONDS + 5
+        failures = []
+        while time.monotonic() < deadline:
+            with app.app_context():
+                jobs = {job.id: job for job in Job.query.filter(Job.id.in_(orphaned + [own]))}
+                if all(jobs[i].status == 'failed' for i in orphaned) and jobs[own].status == 'completed':
+                    break
+                if jobs[own].status == 'failed':
+                    failures.append("this process's own job was failed as interrupted")
+                    break
+                db.session.remove()
+            time.sleep(0.25)
+        
+        with app.app_context():
+            for job_id in orphaned:
+                job = db.session.get(Job, job_id)
+                print(f"  orphaned {job_id}: {job.status} ({job.error})")
+                if job.status != 'failed' or job.error != job_queue.INTERRUPTED_ERROR:
+                    failures.append(f"job {job_id} of the killed worker is {job.status}")
+            job = db.session.get(Job, own)
+            print(f"  own {own}: {job.status} after {time.monotonic() - started:.1f}s")
+            if job.status != 'completed':
+                failures.append(f"this process's job is {job.status}")
+        
+        if failures:
+            print("FAILED:")
+            for failure in failures:
+                print(f"  {failure}")
+            raise SystemExit(1)
+        print("OK: the killed worker's jobs were failed as interrupted; live jobs were untouched")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[2])
+    else:
+        main()
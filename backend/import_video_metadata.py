@@ -0,0 +1,67 @@
+"""
+One-shot import of video consultation JSON sidecars into the database.
+
+Videos uploaded before the video_consultations table existed have their
+metadata in uploads/videos/*_metadata.json. This loads every sidecar whose
+video_id is not in the table yet, so it is safe to run more than once.
+The sidecars are left in place and removed when the video is deleted.
+"""
+import json
+import os
+from datetime import datetime
+
+from app import app
+from extensions import db
+from models.video_consultation import VideoConsultation
+from routes.video_consultation import UPLOAD_FOLDER
+
+with app.app_context():
+    existing = {video_id for (video_id,) in db.session.query(VideoConsultation.video_id)}
+    imported = 0
+    skipped = 0
+    
+    for filename in sorted(os.listdir(UPLOAD_FOLDER)) if os.path.exists(UPLOAD_FOLDER) else []:
+        if not filename.endswith('_metadata.json'):
+            continue
+        try:
+            with open(os.path.join(UPLOAD_FOLDER, filename), 'r') as f:
+                metadata = json.load(f)
+            video_id = metadata['video_id']
+            user_id = int(metadata['user_id'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"  Skipping unreadable sidecar {filename}: {str(e)}")
+            skipped += 1
+            continue
+        
+        if video_id in existing:
+            continue
+        if not os.path.exists(os.path.join(UPLOAD_FOLDER, metadata.get('filename', ''))):
+            print(f"  Skipping {filename}: video file is missing")
+            skipped += 1
+            continue
+        
+        try:
+            uploaded_at = datetime.fromisoformat(metadata['uploaded_at'])
+        except (KeyError, TypeError, ValueError):
+            uploaded_at = datetime.utcfromtimestamp(os.path.getmtime(os.path.join(UPLOAD_FOLDER, filename)))
+        
+        db.session.add(VideoConsultation(
+            video_id=video_id,
+            user_id=user_id,
+            filename=metadata['filename'],
+            original_filename=metadata.get('original_filename'),
+            description=metadata.get('description'),
+            patient_name=metadata.get('patient_name'),
+            file_size=metadata.get('file_size'),
+            status=metadata.get('status', 'uploaded'),
+            uploaded_at=uploaded_at
+        ))
+        existing.add(video_id)
+        imported += 1
+        
+        # Keep transactions bounded on large upload folders
+        if imported % 1000 == 0:
+            db.session.commit()
+    
+    db.session.commit()
+    print(f"✓ Imported {imported} video(s), skipped {skipped}")
@@ -0,0 +1,70 @@
+"""Unified per-user activity feed shown on the dashboard."""
+from datetime import datetime
+from extensions import db
+
+# Icon and colour the dashboard uses for each kind of event
+ACTIVITY_STYLES = {
+    'symptom': ('MessageCircle', 'violet'),
+    'report': ('FileText', 'blue'),
+    'health_record': ('Activity', 'rose'),
+    'doctor_note': ('FileText', 'emerald'),
+    'video_consultation': ('Video', 'purple'),
+}
+
+
+class ActivityEvent(db.Model):
+    """One feed entry, written by each feature when the user does something."""
+    __tablename__ = 'activity_events'
+    __table_args__ = (
+        # The feed is a keyset scan of this index
+        db.Index('ix_activity_events_user_created', 'user_id', db.desc('created_at'), db.desc('id')),
+        db.Index('ix_activity_events_source', 'event_type', 'source_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)  # key of ACTIVITY_STYLES
+    title = db.Column(db.String(255), nullable=False)
+    description = db.Column(db.String(255))
+    source_id = db.Column(db.String(100))  # ID of the symptom check, report, note, ...
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    @classmethod
+    def record(cls, user_id, event_type, title, description=None, source_id=None, created_at=None):
+        """
+        Add an event to the current session.
+        
+        The caller commits it, normally together with the write it describes.
+        
+        Returns:
+            The new ActivityEvent
+        """
+        if description and len(description) > 50:
+            description = description[:50] + '...'
+        event = cls(
+            user_id=user_id,
+            event_type=event_type,
+            title=title,
+            description=description,
+            source_id=str(source_id) if source_id is not None else None,
+            created_at=created_at or datetime.utcnow()
+        )
+        db.session.add(event)
+        return event
+    
+    @classmethod
+    def forget(cls, event_type, source_id):
+        """Remove the events of a deleted item (the caller commits)."""
+        cls.query.filter_by(event_type=event_type, source_id=str(source_id)).delete(synchronize_session=False)
+    
+    def to_dict(self):
+        icon, color = ACTIVITY_STYLES.get(self.event_type, ('Activity', 'gray'))
+        return {
+            'id': self.id,
+            'type': self.event_type,
+            'title': self.title,
+            'desc': self.description,
+            'time': self.created_at.isoformat() + 'Z',
+            'icon': icon,
+            'color': color
+        }
@@ -0,0 +1,10 @@
+"""Shared state of the dashboard statistics cache (services/dashboard_stats.py)."""
+from extensions import db
+
+
+class DashboardStatsVersion(db.Model):
+    """Per-user counter bumped after writes that change the user's dashboard stats, so every worker's cache sees them."""
+    __tablename__ = 'dashboard_stats_versions'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
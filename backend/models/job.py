@@ -0,0 +1,48 @@
+"""Database model for background jobs (study conversion, AI analysis)."""
+import json
+import uuid
+from datetime import datetime
+from extensions import db
+
+
+class Job(db.Model):
+    """A unit of background work with its progress and outcome; run by services/job_queue.py."""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # A user's jobs, newest first
+        db.Index('ix_jobs_user_created', 'user_id', 'created_at'),
+    )
+    
+    TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    job_type = db.Column(db.String(50), nullable=False)  # A key of services.job_queue.JOB_HANDLERS
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed, cancelled
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0 to 1
+    message = db.Column(db.String(255))  # Current step, for display
+    params = db.Column(db.Text)  # JSON arguments of the handler
+    result = db.Column(db.Text)  # JSON result of a completed job
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker_id = db.Column(db.String(100))  # Process whose queue holds the job
+    heartbeat_at = db.Column(db.DateTime)  # Last time that process reported the job alive
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'params': json.loads(self.params) if self.params else None,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -83,6 +83,10 @@ class Study(db.Model):
 
 class DicomFile(db.Model):
     __tablename__ = 'dicom_files'
+    __table_args__ = (
+        # Study image listings and the per-study series/instance counts
+        db.Index('ix_dicom_files_study_series', 'study_id', 'series_instance_uid'),
+    )
     
     id = db.Column(db.String(50), primary_key=True, default=lambda: str(uuid.uuid4()))
     study_id = db.Column(db.String(50), db.ForeignKey('studies.id'), nullable=False)
@@ -251,6 +255,10 @@ class Report(db.Model):
 
 class SymptomCheck(db.Model):
     __tablename__ = 'symptom_checks'
+    __table_args__ = (
+        # Per-user dashboard aggregates and newest-first listings
+        db.Index('ix_symptom_checks_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.String(50), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True) # Optional if generic/anonymous
@@ -7,6 +7,10 @@ import json
 class MedicalReport(db.Model):
     """Model for storing uploaded medical reports and their analysis."""
     __tablename__ = 'medical_reports'
+    __table_args__ = (
+        # Per-user dashboard aggregates and newest-first listings
+        db.Index('ix_medical_reports_user_uploaded', 'user_id', 'uploaded_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -0,0 +1,73 @@
+"""Database model for patient video consultation recordings."""
+from datetime import datetime
+from extensions import db
+
+
+class VideoConsultation(db.Model):
+    """Metadata of an uploaded video; the recording itself stays in uploads/videos."""
+    __tablename__ = 'video_consultations'
+    __table_args__ = (
+        # A user's videos, newest first
+        db.Index('ix_video_consultations_user_uploaded', 'user_id', 'uploaded_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.String(36), unique=True, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)  # Name of the stored file in uploads/videos
+    original_filename = db.Column(db.String(255))
+    description = db.Column(db.Text)
+    patient_name = db.Column(db.String(255))
+    file_size = db.Column(db.BigInteger)
+    status = db.Column(db.String(50), default='uploaded')
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Filled in by services/video_processing.py after upload
+    processing_status = db.Column(db.String(20), default='pending')  # pending, processing, ready, failed
+    duration = db.Column(db.Float)  # Seconds
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    thumbnail_filename = db.Column(db.String(255))  # Poster JPEG, relative to uploads/videos
+    preview_filename = db.Column(db.String(255))  # Low-bitrate preview clip, relative to uploads/videos
+    
+    def to_dict(self):
+        """Same shape as the JSON metadata sidecars this table replaces."""
+        return {
+            'video_id': self.video_id,
+            'user_id': self.user_id,
+            'filename': self.filename,
+            'original_filename': self.original_filename,
+            'description': self.description,
+            'patient_name': self.patient_name,
+            'file_size': self.file_size,
+            'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None,
+            'status': self.status,
+            'processing_status': self.processing_status or 'pending',
+            'duration': self.duration,
+            'width': self.width,
+            'height': self.height
+        }
+
+
+class VideoUpload(db.Model):
+    """An in-progress chunked upload; the bytes received so far are in a .part file."""
+    __tablename__ = 'video_uploads'
+    
+    upload_id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)  # Declared total size in bytes
+    checksum = db.Column(db.String(64))  # Expected SHA-256 hex digest, if given at init
+    description = db.Column(db.Text)
+    patient_name = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Last chunk received; unfinished uploads expire by this
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def to_dict(self, offset):
+        return {
+            'upload_id': self.upload_id,
+            'offset': offset,
+            'file_size': self.file_size,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,32 @@
+"""
+Generate posters and previews for videos that do not have them yet.
+
+New uploads are processed in the background by the app; this covers
+videos uploaded before preview generation existed, and retries failed
+ones. Videos left 'processing' by a worker that stopped mid-job are reset
+and processed again, so run it while the app is not processing uploads.
+Safe to run more than once.
+"""
+from app import app
+from extensions import db
+from models.video_consultation import VideoConsultation
+from routes.video_consultation import UPLOAD_FOLDER
+from services.video_processing import process_video
+
+with app.app_context():
+    VideoConsultation.query.filter(
+        db.or_(VideoConsultation.processing_status.in_(('processing', 'failed')),
+               VideoConsultation.processing_status.is_(None))
+    ).update({'processing_status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+    
+    video_ids = [
+        video_id for (video_id,) in
+        db.session.query(VideoConsultation.video_id).filter_by(processing_status='pending')
+    ]
+    processed = 0
+    for video_id in video_ids:
+        if process_video(video_id, UPLOAD_FOLDER):
+            processed += 1
+    
+    print(f"✓ Processed {processed} of {len(video_ids)} video(s)")
@@ -2,12 +2,33 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from datetime import datetime
 import uuid
-from services.doctor_notes_vector_store import DoctorNotesVectorStore
+from extensions import db
+from models.activity import ActivityEvent
+from services.doctor_notes_vector_store import get_vector_store
+from services.dashboard_stats import invalidate_dashboard_stats
 
 doctor_notes_bp = Blueprint('doctor_notes', __name__)
 
-# Initialize vector store
-vector_store = DoctorNotesVectorStore()
+# Maximum number of notes accepted by a single bulk import request
+MAX_IMPORT_NOTES = 5000
+
+
+def _build_note_data(data, user_id, note_id):
+    """Build the vector store metadata for a note from request JSON."""
+    return {
+        'id': note_id,
+        'user_id': user_id,  # Link to user
+        'date': data.get('date', datetime.utcnow().isoformat()),
+        'doctor': data.get('doctor', 'Dr. Unknown'),
+        'patient_context': {
+            'conditions': data.get('conditions', []),
+            'medications': data.get('medications', []),
+            'patient_name': data.get('patient_name', 'Unknown Patient')
+        },
+        'type': data.get('type', 'Consultation'),
+        'title': data.get('title', 'Consultation Note')
+    }
+
 
 @doctor_notes_bp.route('/notes', methods=['POST'])
 def create_note():
@@ -34,22 +55,14 @@ def create_note():
         note_id = str(uuid.uuid4())
         
         # Prepare note data with user_id
-        note_data = {
-            'id': note_id,
-            'user_id': user_id,  # Link to user
-            'date': data.get('date', datetime.utcnow().isoformat()),
-            'doctor': data.get('doctor', 'Dr. Unknown'),
-            'patient_context': {
-                'conditions': data.get('conditions', []),
-                'medications': data.get('medications', []),
-                'patient_name': data.get('patient_name', 'Unknown Patient')
-            },
-            'type': data.get('type', 'Consultation'),
-            'title': data.get('title', 'Consultation Note')
-        }
+        note_data = _build_note_data(data, user_id, note_id)
         
         # Add to vector store
-        index = vector_store.add_note(data['content'], note_data)
+        index = get_vector_store().add_note(data['content'], note_data)
+        invalidate_dashboard_stats(user_id)
+        
+        ActivityEvent.record(user_id, 'doctor_note', 'Doctor Note Created', note_data['title'], source_id=note_id)
+        db.session.commit()
         
         return jsonify({
             'success': True,
@@ -62,11 +75,73 @@ def create_note():
         return jsonify({'error': str(e)}), 500
 
 
+@doctor_notes_bp.route('/notes/import', methods=['POST'])
+def import_notes():
+    """
+    Bulk import doctor notes (e.g. historic notes) for the logged-in user.
+    Embeddings are computed in batches and persisted with a single write.
+    
+    Request JSON:
+        {
+            "notes": [{"content": "...", "id": "optional existing id", "date": "...", ...}],
+            "batch_size": 64
+        }
+    """
+    # Verify JWT
+    try:
+        verify_jwt_in_request()
+        user_id = int(get_jwt_identity())
+    except Exception as e:
+        print(f"DEBUG: JWT Error in import_notes: {str(e)}")
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    try:
+        data = request.get_json()
+        notes = data.get('notes')
+        
+        if not isinstance(notes, list) or not notes:
+            return jsonify({'error': 'A non-empty notes list is required'}), 400
+        if len(notes) > MAX_IMPORT_NOTES:
+            return jsonify({'error': f'At most {MAX_IMPORT_NOTES} notes can be imported per request'}), 400
+        
+        vector_store = get_vector_store()
+        batch = []
+        seen_ids = set()
+        for i, note in enumerate(notes):
+            if not isinstance(note, dict) or not note.get('content'):
+                return jsonify({'error': f'Note {i} is missing content'}), 400
+            
+            # Keep existing IDs from the source system unless they are taken
+            note_id = note.get('id')
+            if not note_id or note_id in seen_ids or vector_store.get_note_by_id(note_id):
+                note_id = str(uuid.uuid4())
+            seen_ids.add(note_id)
+            batch.append((note['content'], _build_note_data(note, user_id, note_id)))
+        
+        batch_size = data.get('batch_size')
+        vector_store.add_notes(batch, batch_size=int(batch_size) if batch_size else None)
+        invalidate_dashboard_stats(user_id)
+        
+        ActivityEvent.record(user_id, 'doctor_note', 'Doctor Notes Imported', f'{len(batch)} notes')
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Imported {len(batch)} notes',
+            'note_ids': [note_data['id'] for _, note_data in batch],
+            'count': len(batch)
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @doctor_notes_bp.route('/notes', methods=['GET'])
 def get_all_notes():
     """
     Get all doctor notes for the logged-in user from the vector store.
     Excludes deleted notes and returns only the latest version of each note ID.
+    Optional ?limit=&offset= query parameters page through the notes.
     """
     # Verify JWT
     try:
@@ -77,40 +152,21 @@ def get_all_notes():
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        all_notes = vector_store.get_all_notes()
-        
-        # Filter by user_id, and filter out deleted notes
-        user_notes = [
-            note for note in all_notes 
-            if note.get('user_id') == user_id and not note.get('deleted', False)
-        ]
-        
-        # Remove duplicates - keep only the latest version of each note ID
-        # (When updating, we mark old as deleted and create new with same ID)
-        seen_ids = {}
-        for note in user_notes:
-            note_id = note.get('id')
-            if note_id:
-                # Keep the note with the latest created_at timestamp
-                if note_id not in seen_ids:
-                    seen_ids[note_id] = note
-                else:
-                    # Compare timestamps and keep the newer one
-                    existing_time = seen_ids[note_id].get('created_at', '')
-                    current_time = note.get('created_at', '')
-                    if current_time > existing_time:
-                        seen_ids[note_id] = note
-        
-        # Convert back to list
-        unique_notes = list(seen_ids.values())
-        
-        # Sort by date (newest first)
-        unique_notes.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if (limit is not None and limit < 0) or offset < 0:
+            return jsonify({'error': 'limit and offset must be non-negative'}), 400
+        
+        vector_store = get_vector_store()
+        # Latest non-deleted version of each of the user's notes, newest first
+        # (updates tombstone every older version of a note ID)
+        unique_notes = vector_store.get_user_notes(user_id, limit=limit, offset=offset)
         
         return jsonify({
             'success': True,
             'notes': unique_notes,
-            'count': len(unique_notes)
+            'count': len(unique_notes),
+            'total': vector_store.count_user_notes(user_id)
         }), 200
         
     except Exception as e:
@@ -131,7 +187,7 @@ def get_note(note_id):
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        note = vector_store.get_note_by_id(note_id)
+        note = get_vector_store().get_note_by_id(note_id)
         
         if not note or note.get('user_id') != user_id:
             return jsonify({'error': 'Note not found'}), 404
@@ -162,6 +218,8 @@ def update_note(note_id):
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
+        vector_store = get_vector_store()
+        
         # Verify note belongs to user
         existing_note = vector_store.get_note_by_id(note_id)
         print(f"DEBUG update_note: note_id={note_id}, user_id={user_id}, type(user_id)={type(user_id)}")
@@ -179,22 +237,11 @@ def update_note(note_id):
             return jsonify({'error': 'Note content is required'}), 400
         
         # Prepare updated note data
-        note_data = {
-            'id': note_id,
-            'user_id': user_id,
-            'date': data.get('date', datetime.utcnow().isoformat()),
-            'doctor': data.get('doctor', 'Dr. Unknown'),
-            'patient_context': {
-                'conditions': data.get('conditions', []),
-                'medications': data.get('medications', []),
-                'patient_name': data.get('patient_name', 'Unknown Patient')
-            },
-            'type': data.get('type', 'Consultation'),
-            'title': data.get('title', 'Consultation Note')
-        }
+        note_data = _build_note_data(data, user_id, note_id)
         
         # Update in vector store
         index = vector_store.update_note(note_id, data['content'], note_data)
+        invalidate_dashboard_stats(user_id)
         
         if index is None:
             return jsonify({'error': 'Note not found'}), 404
@@ -224,12 +271,18 @@ def delete_note(note_id):
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
+        vector_store = get_vector_store()
+        
         # Verify note belongs to user
         existing_note = vector_store.get_note_by_id(note_id)
         if not existing_note or existing_note.get('user_id') != user_id:
             return jsonify({'error': 'Note not found'}), 404
         
         success = vector_store.delete_note(note_id)
+        invalidate_dashboard_stats(user_id)
+        
+        ActivityEvent.forget('doctor_note', note_id)
+        db.session.commit()
         
         if not success:
             return jsonify({'error': 'Note not found'}), 404
@@ -247,6 +300,13 @@ def delete_note(note_id):
 def search_notes():
     """
     Search for similar notes using semantic search for the logged-in user.
+    
+    Request JSON:
+        {
+            "query": "search text",
+            "k": 5,
+            "filters": {"type": "...", "doctor": "...", "date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"}
+        }
     """
     # Verify JWT
     try:
@@ -263,15 +323,14 @@ def search_notes():
             return jsonify({'error': 'Search query is required'}), 400
         
         k = data.get('k', 5)  # Number of results to return
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'filters must be an object'}), 400
         
-        # Search in vector store
-        results = vector_store.search_similar_notes(data['query'], k)
-        
-        # Filter by user_id and filter out deleted notes
-        active_results = [
-            r for r in results 
-            if r.get('user_id') == user_id and not r.get('deleted', False)
-        ]
+        # Search only this user's live notes
+        active_results = get_vector_store().search_similar_notes(
+            data['query'], k, user_id=user_id, filters=filters
+        )
         
         return jsonify({
             'success': True,
@@ -280,6 +339,8 @@ def search_notes():
             'count': len(active_results)
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -290,7 +351,7 @@ def get_stats():
     Get statistics about the doctor notes vector store.
     """
     try:
-        stats = vector_store.get_stats()
+        stats = get_vector_store().get_stats()
         
         return jsonify({
             'success': True,
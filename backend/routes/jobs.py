@@ -0,0 +1,99 @@
+import json
+import time
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from extensions import db
+from models.job import Job
+from services.job_queue import cancel_job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+EVENT_POLL_SECONDS = 1.0  # How often the event stream re-reads the job
+EVENT_KEEPALIVE_SECONDS = 15  # Comment lines keep idle proxies from closing the stream
+EVENT_STREAM_MAX_SECONDS = 3600  # Clients reconnect (EventSource does so itself) after this
+MAX_LIST_LIMIT = 100
+
+def _user_job(job_id):
+    """The job if it belongs to the current user, else None"""
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != int(get_jwt_identity()):
+        return None
+    return job
+
+@jobs_bp.route('/', methods=['GET'])
+@jwt_required()
+def list_jobs():
+    """The current user's most recent jobs, optionally filtered by status and job_type"""
+    try:
+        query = Job.query.filter_by(user_id=int(get_jwt_identity()))
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        if request.args.get('job_type'):
+            query = query.filter_by(job_type=request.args['job_type'])
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_LIST_LIMIT)
+        jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+        return jsonify({'success': True, 'jobs': [job.to_dict() for job in jobs]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    job = _user_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress step"""
+    job = _user_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job.status in Job.TERMINAL_STATUSES:
+        return jsonify({'success': False, 'error': f"Job is already {job.status}", 'job': job.to_dict()}), 409
+    try:
+        job = cancel_job(job_id)
+        return jsonify({'success': True, 'job': job.to_dict()})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@jobs_bp.route('/<job_id>/events', methods=['GET'])
+@jwt_required()
+def job_events(job_id):
+    """
+    Server-sent events with the job's state: one event on connecting, one
+    whenever it changes, and the stream ends once the job has finished.
+    """
+    job = _user_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def generate():
+        last = None
+        last_sent = started = time.monotonic()
+        while True:
+            # End the read transaction so the next poll sees the worker's commits
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            if not job:
+                return
+            state = json.dumps(job.to_dict())
+            now = time.monotonic()
+            if state != last:
+                yield f"data: {state}\n\n"
+                last, last_sent = state, now
+            elif now - last_sent >= EVENT_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = now
+            if job.status in Job.TERMINAL_STATUSES or now - started >= EVENT_STREAM_MAX_SECONDS:
+                return
+            time.sleep(EVENT_POLL_SECONDS)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -8,6 +8,7 @@ from datetime import datetime
 
 from extensions import db
 from models.medical_report import MedicalReport, ReportChatMessage
+from models.activity import ActivityEvent
 from services.medical_report_agent import MedicalReportAgent, ReportChatAgent
 from utils.pdf_extractor import extract_text_from_pdf
 
@@ -84,6 +85,8 @@ def upload_report():
             analysis_status='pending'
         )
         db.session.add(report)
+        db.session.flush()
+        ActivityEvent.record(user_id, 'report', 'Medical Report Uploaded', filename, source_id=report.id)
         db.session.commit()
         
         return jsonify({
@@ -303,6 +306,7 @@ def delete_report(report_id):
         
         # Delete from database (cascade will delete chat messages)
         db.session.delete(report)
+        ActivityEvent.forget('report', report_id)
         db.session.commit()
         
         return jsonify({'message': 'Report deleted successfully'}), 200
@@ -1,10 +1,22 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+import uuid
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from extensions import db
+from models.medical import DicomFile, NiftiFile
 from services.radiology.radiology_service import RadiologyService
 from services.radiology.ai_segmentation_service import AISegmentationService
+from services.radiology.mpr_service import MprService
+from services.job_queue import enqueue_job
+from utils.dicom_processor import DicomProcessor
+from utils.nifti_processor import NiftiProcessor
+from utils.render_cache import RenderCache, get_render_cache, decode_array, IMAGE_MIMETYPES
 
 radiology_bp = Blueprint('radiology', __name__)
 
+# Rendered slices are immutable for a given ETag, so browsers may reuse them for this long
+IMAGE_CACHE_MAX_AGE = 3600
+MAX_PREFETCH_SLICES = 64
+
 @radiology_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_dicom():
@@ -24,6 +36,28 @@ def upload_dicom():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@radiology_bp.route('/upload/bulk', methods=['POST'])
+@jwt_required()
+def upload_dicom_bulk():
+    """
+    Ingest a whole study in one request.
+    Accepts any number of `files` (DICOM slices and/or ZIP archives of them).
+    """
+    try:
+        files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not files:
+            return jsonify({'success': False, 'error': 'No files provided'}), 400
+            
+        patient_id = request.form.get('patient_id')
+        
+        result = RadiologyService.process_dicom_bulk_upload(files, patient_id)
+        if not result['ingested'] and not result['duplicates']:
+            return jsonify({'success': False, 'error': 'No DICOM files found', 'skipped': result['skipped']}), 400
+        return jsonify(result), 201
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @radiology_bp.route('/metadata', methods=['POST'])
 @jwt_required()
 def get_metadata():
@@ -105,12 +139,367 @@ def get_nifti_metadata():
 @radiology_bp.route('/studies/<study_id>/convert/nifti', methods=['POST'])
 @jwt_required()
 def convert_to_nifti(study_id):
+    """Queue the study's conversion; follow it at /api/jobs/<job_id>"""
     try:
-        result = RadiologyService.convert_study_to_nifti(study_id)
-        return jsonify({'success': True, 'files': result})
+        if not RadiologyService.get_study(study_id):
+            return jsonify({'success': False, 'error': 'Study not found'}), 404
+        job = enqueue_job(current_app._get_current_object(), 'nifti_conversion',
+                          {'study_id': study_id}, user_id=int(get_jwt_identity()))
+        return _job_accepted(job)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _job_accepted(job):
+    """202 response pointing at a queued job"""
+    response = jsonify({'success': True, 'job_id': job.id, 'job': job.to_dict()})
+    response.headers['Location'] = f"/api/jobs/{job.id}"
+    return response, 202
+
+@radiology_bp.route('/render-cache/stats', methods=['GET'])
+@jwt_required()
+def get_render_cache_stats():
+    """Hit/miss metrics of this worker's rendered-image cache"""
+    return jsonify({'success': True, 'stats': get_render_cache().get_stats()})
+
+# --- Slice Streaming Endpoints ---
+# Serve rendered slices as raw image bytes (or raw pixel arrays) rather than
+# base64 data URLs in JSON, with ETags so browsers and proxies can cache them.
+
+def _render_params():
+    """Window and output format query parameters shared by the render endpoints"""
+    image_format = request.args.get('format', 'png')
+    if image_format not in IMAGE_MIMETYPES:
+        raise ValueError(f"format must be one of {', '.join(IMAGE_MIMETYPES)}")
+    return (request.args.get('window_center', type=float),
+            request.args.get('window_width', type=float),
+            image_format)
+
+def _slice_range(total):
+    """start/count query parameters of the prefetch endpoints, clamped to the available slices"""
+    start = request.args.get('start', 0, type=int)
+    count = min(request.args.get('count', 16, type=int), MAX_PREFETCH_SLICES)
+    if start < 0 or start >= total or count < 1:
+        raise ValueError(f"start must be in [0, {total}) and count positive")
+    return range(start, min(start + count, total))
+
+def _part_body(data, image_format):
+    """Body and extra headers of one rendered slice"""
+    if image_format != 'raw':
+        return data, {}
+    array = decode_array(data)
+    return array.tobytes(), {
+        'X-Array-Dtype': array.dtype.str,
+        'X-Array-Shape': ','.join(str(n) for n in array.shape)
+    }
+
+def _cacheable(response, etag):
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+def _not_modified(etag):
+    """304 response if the client already has this ETag, else None (checked before rendering)"""
+    if request.if_none_match.contains(etag):
+        return _cacheable(current_app.response_class(status=304), etag)
+    return None
+
+def _image_response(render, etag, image_format, headers=None):
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    body, extra = _part_body(render(), image_format)
+    mimetype = 'application/octet-stream' if image_format == 'raw' else IMAGE_MIMETYPES[image_format]
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.headers.update(dict(headers or {}, **extra))
+    return _cacheable(response, etag)
+
+def _multipart_response(parts, etag, image_format):
+    """
+    Stream several slices as one multipart/related response.
+    parts: (part headers, render callable) per slice; each slice is rendered as it is sent,
+    and its headers are read after rendering.
+    """
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+    boundary = uuid.uuid4().hex
+    mimetype = 'application/octet-stream' if image_format == 'raw' else IMAGE_MIMETYPES[image_format]
+    
+    def generate():
+        for headers, render in parts:
+            body, extra = _part_body(render(), image_format)
+            lines = [f'--{boundary}', f'Content-Type: {mimetype}', f'Content-Length: {len(body)}']
+            lines += [f'{name}: {value}' for name, value in dict(headers, **extra).items()]
+            yield ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+            yield body
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode('ascii')
+    
+    response = current_app.response_class(
+        generate(),
+        content_type=f'multipart/related; type="{mimetype}"; boundary={boundary}'
+    )
+    return _cacheable(response, etag)
+
+def _dicom_part(dicom_file, frame, window_center, window_width, image_format, headers=None):
+    """
+    Part headers and render callable of one DICOM frame.
+    For raw, the rescale headers are read from the file and added to the
+    headers when the frame is rendered, so a 304 never touches the file.
+    """
+    headers = dict(headers or {}, **{'X-Instance-Id': dicom_file.id, 'X-Instance-Number': dicom_file.instance_number or ''})
+    
+    def render():
+        if image_format == 'raw':
+            # The client applies the modality LUT and windowing itself
+            ds = DicomProcessor.read_dicom_header(dicom_file.file_path, ['RescaleSlope', 'RescaleIntercept'])
+            headers['X-Rescale-Slope'] = getattr(ds, 'RescaleSlope', 1)
+            headers['X-Rescale-Intercept'] = getattr(ds, 'RescaleIntercept', 0)
+        return DicomProcessor.render_dicom(dicom_file.file_path, window_center, window_width, frame, image_format)[0]
+    return headers, render
+
+@radiology_bp.route('/images/<file_id>/render', methods=['GET'])
+@jwt_required()
+def render_dicom_image(file_id):
+    """
+    Stream one rendered DICOM frame.
+    Query: frame, window_center, window_width, format (png, jpeg, webp or raw).
+    raw returns the stored pixel values with X-Array-Dtype/X-Array-Shape and
+    X-Rescale-Slope/X-Rescale-Intercept headers for client-side windowing.
+    """
+    try:
+        window_center, window_width, image_format = _render_params()
+        frame = request.args.get('frame', 0, type=int)
+        dicom_file = db.session.get(DicomFile, file_id)
+        if not dicom_file:
+            return jsonify({'success': False, 'error': 'Image not found'}), 404
+        
+        etag = RenderCache.make_key(dicom_file.file_path, frame, window_center, window_width, image_format)
+        headers, render = _dicom_part(dicom_file, frame, window_center, window_width, image_format)
+        return _image_response(render, etag, image_format, headers)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Image file is missing on the server'}), 404
+    except IndexError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@radiology_bp.route('/studies/<study_id>/series/<series_uid>/render', methods=['GET'])
+@jwt_required()
+def render_dicom_series(study_id, series_uid):
+    """
+    Prefetch a range of a series' slices (in spatial order) in one multipart/related response.
+    Query: start, count (at most MAX_PREFETCH_SLICES), window_center, window_width, format.
+    """
+    try:
+        window_center, window_width, image_format = _render_params()
+        images = RadiologyService.get_series_images(study_id, series_uid)
+        if not images:
+            return jsonify({'success': False, 'error': 'Series not found'}), 404
+        
+        indexes = _slice_range(len(images))
+        parts = []
+        keys = []
+        for index in indexes:
+            parts.append(_dicom_part(images[index], 0, window_center, window_width, image_format,
+                                     {'X-Slice-Index': index}))
+            keys.append(RenderCache.make_key(images[index].file_path, 0, window_center, window_width, image_format))
+        return _multipart_response(parts, RenderCache.make_key(images[0].file_path, *keys), image_format)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Image file is missing on the server'}), 404
+    except IndexError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _nifti_params(nifti_id):
+    """The NiftiFile, its slice count along the requested axis, and the axis"""
+    axis = request.args.get('axis', 2, type=int)
+    if axis not in (0, 1, 2):
+        raise ValueError('axis must be 0 (sagittal), 1 (coronal) or 2 (axial)')
+    nifti_file = db.session.get(NiftiFile, nifti_id)
+    if not nifti_file:
+        return None, 0, axis
+    dims = NiftiProcessor.read_nifti_metadata(nifti_file.file_path)['dims']
+    return nifti_file, dims[axis], axis
+
+@radiology_bp.route('/nifti/<nifti_id>/slices/<int:slice_index>', methods=['GET'])
+@jwt_required()
+def render_nifti_slice(nifti_id, slice_index):
+    """
+    Stream one rendered NIfTI slice.
+    Query: axis (0, 1 or 2), window_center, window_width, format (png, jpeg, webp or raw).
+    """
+    try:
+        window_center, window_width, image_format = _render_params()
+        nifti_file, total, axis = _nifti_params(nifti_id)
+        if not nifti_file:
+            return jsonify({'success': False, 'error': 'NIfTI file not found'}), 404
+        if slice_index >= total:
+            return jsonify({'success': False, 'error': f'slice_index must be below {total}'}), 400
+        
+        path = nifti_file.file_path
+        etag = RenderCache.make_key(path, slice_index, axis, window_center, window_width, image_format)
+        return _image_response(
+            lambda: NiftiProcessor.render_nifti_slice(path, slice_index, axis, window_center, window_width, image_format)[0],
+            etag, image_format, {'X-Slice-Index': slice_index}
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Image file is missing on the server'}), 404
+    except IndexError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@radiology_bp.route('/nifti/<nifti_id>/slices', methods=['GET'])
+@jwt_required()
+def render_nifti_slices(nifti_id):
+    """
+    Prefetch a range of NIfTI slices in one multipart/related response.
+    Query: axis, start, count (at most MAX_PREFETCH_SLICES), window_center, window_width, format.
+    """
+    try:
+        window_center, window_width, image_format = _render_params()
+        nifti_file, total, axis = _nifti_params(nifti_id)
+        if not nifti_file:
+            return jsonify({'success': False, 'error': 'NIfTI file not found'}), 404
+        
+        path = nifti_file.file_path
+        indexes = _slice_range(total)
+        parts = [
+            ({'X-Slice-Index': index},
+             lambda index=index: NiftiProcessor.render_nifti_slice(
+                 path, index, axis, window_center, window_width, image_format)[0])
+            for index in indexes
+        ]
+        etag = RenderCache.make_key(path, indexes.start, indexes.stop, axis, window_center, window_width, image_format)
+        return _multipart_response(parts, etag, image_format)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Image file is missing on the server'}), 404
+    except IndexError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# --- Multi-planar Reconstruction Endpoints ---
+# Reformat whole volumes (kept in MprService's volume cache between requests)
+# into orthogonal or oblique planes and thick-slab projections.
+
+def _mpr_params():
+    """Plane query parameters of the MPR endpoints, as keyword arguments of MprService.reformat"""
+    return {
+        'plane': request.args.get('plane', 'axial'),
+        'index': request.args.get('index', type=int),
+        'tilt_x': request.args.get('tilt_x', 0.0, type=float),
+        'tilt_y': request.args.get('tilt_y', 0.0, type=float),
+        'thickness': request.args.get('thickness', 0.0, type=float),
+        'projection': request.args.get('projection', 'mip'),
+        'level': request.args.get('level', 0, type=int)
+    }
+
+def _mpr_response(file_path, volume_key, load_volume):
+    """Rendered plane of a volume, through the render cache; the volume is only loaded on a miss"""
+    window_center, window_width, image_format = _render_params()
+    plane = _mpr_params()
+    etag = RenderCache.make_key(file_path, 'mpr', volume_key, sorted(plane.items()),
+                                window_center, window_width, image_format)
+    return _image_response(
+        lambda: get_render_cache().get_or_render(
+            etag, lambda: MprService.render(load_volume(), image_format, window_center, window_width, **plane)
+        ),
+        etag, image_format
+    )
+
+@radiology_bp.route('/nifti/<nifti_id>/mpr', methods=['GET'])
+@jwt_required()
+def render_nifti_mpr(nifti_id):
+    """
+    Stream a reformatted plane of a NIfTI volume.
+    Query: plane (axial, coronal or sagittal), index (slice along the plane's
+    normal, default middle), tilt_x/tilt_y (degrees, for oblique planes),
+    thickness (slab mm), projection (mip, minip or avg), level (pyramid level,
+    0 = full resolution), window_center, window_width, format.
+    """
+    try:
+        nifti_file = db.session.get(NiftiFile, nifti_id)
+        if not nifti_file:
+            return jsonify({'success': False, 'error': 'NIfTI file not found'}), 404
+        path = nifti_file.file_path
+        return _mpr_response(path, MprService.nifti_volume_key(path), lambda: MprService.get_nifti_volume(path))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Image file is missing on the server'}), 404
+    except IndexError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@radiology_bp.route('/nifti/<nifti_id>/mpr/info', methods=['GET'])
+@jwt_required()
+def get_nifti_mpr_info(nifti_id):
+    """Volume shape and spacing per pyramid level (loads the volume into the cache)"""
+    try:
+        nifti_file = db.session.get(NiftiFile, nifti_id)
+        if not nifti_file:
+            return jsonify({'success': False, 'error': 'NIfTI file not found'}), 404
+        volume = MprService.get_nifti_volume(nifti_file.file_path)
+        return jsonify({'success': True, 'volume': volume.describe()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@radiology_bp.route('/studies/<study_id>/series/<series_uid>/mpr', methods=['GET'])
+@jwt_required()
+def render_series_mpr(study_id, series_uid):
+    """
+    Stream a reformatted plane of a DICOM series.
+    Query: as for /nifti/<nifti_id>/mpr; window values are in rescaled units (HU for CT).
+    """
+    try:
+        images = RadiologyService.get_series_images(study_id, series_uid)
+        if not images:
+            return jsonify({'success': False, 'error': 'Series not found'}), 404
+        return _mpr_response(images[0].file_path, MprService.series_volume_key(images),
+                             lambda: MprService.get_series_volume(images))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Image file is missing on the server'}), 404
+    except IndexError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@radiology_bp.route('/studies/<study_id>/series/<series_uid>/mpr/info', methods=['GET'])
+@jwt_required()
+def get_series_mpr_info(study_id, series_uid):
+    """Volume shape and spacing per pyramid level (loads the volume into the cache)"""
+    try:
+        images = RadiologyService.get_series_images(study_id, series_uid)
+        if not images:
+            return jsonify({'success': False, 'error': 'Series not found'}), 404
+        volume = MprService.get_series_volume(images)
+        return jsonify({'success': True, 'volume': volume.describe()})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@radiology_bp.route('/mpr/cache/stats', methods=['GET'])
+@jwt_required()
+def get_mpr_cache_stats():
+    """Hit rate and size of the MPR volume cache of this worker process"""
+    return jsonify({'success': True, 'stats': MprService.get_cache_stats()})
+
 # --- AI Analysis Endpoints ---
 
 @radiology_bp.route('/models', methods=['GET'])
@@ -127,7 +516,7 @@ def get_models():
 @radiology_bp.route('/analyze', methods=['POST'])
 @jwt_required()
 def analyze_image():
-    """Run AI analysis on a study or specific image"""
+    """Queue AI analysis of a study; follow it at /api/jobs/<job_id>"""
     try:
         data = request.get_json()
         study_id = data.get('study_id')
@@ -137,23 +526,13 @@ def analyze_image():
         if not all([study_id, modality, model_id]):
             return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
             
-        # Get image path from study (simplified: getting first image)
-        images = RadiologyService.get_study_images(study_id)
-        if not images:
+        if not RadiologyService.get_study_images(study_id):
             return jsonify({'success': False, 'error': 'No images found for study'}), 404
             
-        # In a real scenario, we might analyze the whole series or a specific slice
-        # For now, let's analyze the middle slice or first one
-        target_image = images[len(images)//2]
-        
-        results = AISegmentationService.analyze_image(target_image.file_path, modality, model_id)
-        
-        return jsonify({
-            'success': True, 
-            'results': results,
-            'model_id': model_id,
-            'analyzed_image_id': target_image.id
-        })
+        job = enqueue_job(current_app._get_current_object(), 'ai_analysis',
+                          {'study_id': study_id, 'modality': modality, 'model_id': model_id},
+                          user_id=int(get_jwt_identity()))
+        return _job_accepted(job)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
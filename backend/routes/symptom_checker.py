@@ -4,6 +4,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_req
 from typing import Dict, Any
 from extensions import db
 from models.medical import SymptomCheck
+from models.activity import ActivityEvent
 import datetime
 
 # Create blueprint
@@ -134,6 +135,8 @@ def analyze_symptoms():
                     created_at=datetime.datetime.now(datetime.UTC)
                 )
                 db.session.add(symptom_check)
+                db.session.flush()
+                ActivityEvent.record(user_id, 'symptom', 'Symptom Check', symptoms, source_id=symptom_check.id)
                 db.session.commit()
                 print(f"DEBUG: Saved symptom check for user {user_id}")
             except Exception as db_error:
@@ -1,10 +1,15 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, current_app, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from werkzeug.utils import secure_filename
+import hashlib
 import os
 import uuid
-from datetime import datetime
-import json
+from datetime import datetime, timedelta
+from extensions import db
+from models.activity import ActivityEvent
+from models.video_consultation import VideoConsultation, VideoUpload
+from services.file_lock import FileLock
+from services.video_processing import enqueue_video_processing, preview_mimetype, remove_video_previews
 
 video_consultation_bp = Blueprint('video_consultation', __name__)
 
@@ -13,12 +18,57 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'upload
 ALLOWED_EXTENSIONS = {'webm', 'mp4', 'avi', 'mov'}
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 
-# Ensure upload directory exists
+# Served types; anything else falls back to application/octet-stream
+VIDEO_MIMETYPES = {
+    'webm': 'video/webm',
+    'mp4': 'video/mp4',
+    'avi': 'video/x-msvideo',
+    'mov': 'video/quicktime'
+}
+# When set (e.g. '/protected-videos/'), playback is handed to nginx with
+# X-Accel-Redirect to an internal location aliasing UPLOAD_FOLDER
+ACCEL_REDIRECT_PREFIX = os.getenv('VIDEO_ACCEL_REDIRECT_PREFIX', '')
+
+# Chunked uploads: received bytes are appended to PARTIAL_FOLDER/<upload_id>.part
+PARTIAL_FOLDER = os.path.join(UPLOAD_FOLDER, 'partial')
+MAX_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+RECOMMENDED_CHUNK_SIZE = 1024 * 1024  # 1MB, small enough to resend cheaply on flaky connections
+STREAM_BUFFER_SIZE = 256 * 1024  # Bytes read from the request stream at a time
+UPLOAD_EXPIRY = timedelta(hours=24)  # Unfinished uploads are discarded after this long without a chunk
+
+# Ensure upload directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(PARTIAL_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _register_video(user_id, video_id, filename, original_filename, description, patient_name, file_size):
+    """Record a stored video and its activity event, commit, and queue its preview generation."""
+    video = _add_video(user_id, video_id, filename, original_filename, description, patient_name, file_size)
+    db.session.commit()
+    enqueue_video_processing(current_app._get_current_object(), video_id, UPLOAD_FOLDER)
+    return video
+
+def _add_video(user_id, video_id, filename, original_filename, description, patient_name, file_size):
+    """Add a stored video and its activity event to the session (the caller commits)."""
+    video = VideoConsultation(
+        video_id=video_id,
+        user_id=user_id,
+        filename=filename,
+        original_filename=secure_filename(original_filename),
+        description=description,
+        patient_name=patient_name,
+        file_size=file_size,
+        status='uploaded'
+    )
+    db.session.add(video)
+    ActivityEvent.record(
+        user_id, 'video_consultation', 'Video Consultation Sent',
+        description or 'Video message to doctor', source_id=video_id
+    )
+    return video
+
 @video_consultation_bp.route('/upload', methods=['POST'])
 def upload_video():
     """
@@ -63,24 +113,7 @@ def upload_video():
         file_size = os.path.getsize(filepath)
         
         # Save metadata
-        metadata = {
-            'video_id': unique_id,
-            'user_id': user_id,
-            'filename': filename,
-            'original_filename': secure_filename(video_file.filename),
-            'description': description,
-            'patient_name': patient_name,
-            'file_size': file_size,
-            'uploaded_at': datetime.utcnow().isoformat(),
-            'status': 'uploaded'
-        }
-        
-        # Save metadata to JSON file
-        metadata_filename = f"{user_id}_{timestamp}_{unique_id}_metadata.json"
-        metadata_filepath = os.path.join(UPLOAD_FOLDER, metadata_filename)
-        
-        with open(metadata_filepath, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        _register_video(user_id, unique_id, filename, video_file.filename, description, patient_name, file_size)
         
         print(f"Video uploaded successfully: {filename}")
         
@@ -97,6 +130,292 @@ def upload_video():
         return jsonify({'error': f'Failed to upload video: {str(e)}'}), 500
 
 
+def _part_path(upload_id):
+    return os.path.join(PARTIAL_FOLDER, f"{upload_id}.part")
+
+
+def _discard_upload(upload):
+    """Delete an unfinished upload's received bytes and session (the caller commits)."""
+    for path in (_part_path(upload.upload_id), _part_path(upload.upload_id) + '.lock'):
+        if os.path.exists(path):
+            os.remove(path)
+    db.session.delete(upload)
+
+
+def _upload_gone(part_path):
+    """
+    Inside an upload's lock: whether an abort or finalize removed it while we waited.
+    
+    Taking the lock re-creates the lock file that abort/finalize deleted, so
+    it is removed again here.
+    """
+    if os.path.exists(part_path):
+        return False
+    _remove_lock_file(part_path)
+    return True
+
+
+def _remove_lock_file(part_path):
+    try:
+        os.remove(part_path + '.lock')
+    except FileNotFoundError:
+        pass
+
+
+def _expire_stale_uploads():
+    """
+    Drop unfinished uploads that received no chunk for UPLOAD_EXPIRY.
+    
+    Each is discarded under its upload lock, and only if it is still stale
+    once the lock is held, so a chunk or finalize in progress is never cut off.
+    """
+    cutoff = datetime.utcnow() - UPLOAD_EXPIRY
+    stale = VideoUpload.query.filter(VideoUpload.updated_at < cutoff).limit(100).all()
+    for upload_id in [upload.upload_id for upload in stale]:
+        part_path = _part_path(upload_id)
+        with FileLock(part_path + '.lock'):
+            upload = VideoUpload.query.filter(
+                VideoUpload.upload_id == upload_id, VideoUpload.updated_at < cutoff
+            ).populate_existing().first()
+            if upload:
+                _discard_upload(upload)
+                db.session.commit()
+            else:
+                # Finalized or aborted meanwhile, or it received a chunk
+                _upload_gone(part_path)
+
+
+def _authenticated_upload(upload_id):
+    """
+    Resolve the JWT user and their upload session.
+    
+    Returns:
+        (upload, None) or (None, error response)
+    """
+    try:
+        verify_jwt_in_request()
+        user_id = int(get_jwt_identity())
+    except Exception as e:
+        print(f"DEBUG: JWT Error in chunked upload: {str(e)}")
+        return None, (jsonify({'error': 'Authentication required'}), 401)
+    
+    upload = VideoUpload.query.filter_by(upload_id=upload_id, user_id=user_id).first()
+    if not upload or not os.path.exists(_part_path(upload_id)):
+        return None, (jsonify({'error': 'Upload not found'}), 404)
+    return upload, None
+
+
+@video_consultation_bp.route('/uploads', methods=['POST'])
+def init_upload():
+    """
+    Start a chunked, resumable video upload.
+    
+    Body (JSON): filename, file_size (bytes), optional checksum (SHA-256 hex,
+    may instead be sent on finalize), description and patient_name.
+    Chunks are then sent with PUT /uploads/<upload_id>?offset=<bytes received>
+    and the upload completed with POST /uploads/<upload_id>/finalize.
+    """
+    # Verify JWT
+    try:
+        verify_jwt_in_request()
+        user_id = int(get_jwt_identity())
+    except Exception as e:
+        print(f"DEBUG: JWT Error in init_upload: {str(e)}")
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    try:
+        data = request.get_json() or {}
+        filename = data.get('filename', '')
+        if not allowed_file(filename):
+            return jsonify({'error': 'Invalid file type. Allowed types: webm, mp4, avi, mov'}), 400
+        
+        file_size = data.get('file_size')
+        if not isinstance(file_size, int) or file_size <= 0:
+            return jsonify({'error': 'file_size must be a positive number of bytes'}), 400
+        if file_size > MAX_FILE_SIZE:
+            return jsonify({'error': f'File too large. Maximum size is {MAX_FILE_SIZE // (1024 * 1024)}MB'}), 413
+        
+        _expire_stale_uploads()
+        
+        upload = VideoUpload(
+            upload_id=str(uuid.uuid4()),
+            user_id=user_id,
+            original_filename=filename,
+            file_size=file_size,
+            checksum=(data.get('checksum') or '').lower() or None,
+            description=data.get('description', ''),
+            patient_name=data.get('patient_name', 'Unknown Patient')
+        )
+        open(_part_path(upload.upload_id), 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+        
+        return jsonify(dict(
+            upload.to_dict(0),
+            chunk_size=RECOMMENDED_CHUNK_SIZE,
+            max_chunk_size=MAX_CHUNK_SIZE
+        )), 201
+        
+    except Exception as e:
+        print(f"Error starting upload: {str(e)}")
+        return jsonify({'error': f'Failed to start upload: {str(e)}'}), 500
+
+
+@video_consultation_bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """
+    Get the number of bytes received so far, i.e. the offset to resume from.
+    """
+    upload, error = _authenticated_upload(upload_id)
+    if error:
+        return error
+    return jsonify(upload.to_dict(os.path.getsize(_part_path(upload_id)))), 200
+
+
+@video_consultation_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Append a chunk (the raw request body) at the given offset.
+    
+    The offset (query parameter `offset` or `Upload-Offset` header) must
+    equal the bytes received so far; otherwise 409 returns the current
+    offset. The body is streamed to disk, so memory use is bounded no
+    matter the chunk size, and if the connection drops mid-chunk the bytes
+    that did arrive are kept.
+    """
+    upload, error = _authenticated_upload(upload_id)
+    if error:
+        return error
+    
+    try:
+        offset = int(request.args.get('offset', request.headers.get('Upload-Offset', '')))
+    except ValueError:
+        return jsonify({'error': 'offset is required'}), 400
+    
+    length = request.content_length
+    if length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    if length > MAX_CHUNK_SIZE:
+        return jsonify({'error': f'Chunks may be at most {MAX_CHUNK_SIZE} bytes'}), 413
+    
+    part_path = _part_path(upload_id)
+    # Serializes concurrent PUTs of the same upload across workers
+    with FileLock(part_path + '.lock'):
+        if _upload_gone(part_path):
+            return jsonify({'error': 'Upload not found'}), 404
+        current = os.path.getsize(part_path)
+        if offset != current:
+            return jsonify({'error': 'Offset does not match bytes received', 'offset': current}), 409
+        if offset + length > upload.file_size:
+            return jsonify({'error': 'Chunk extends past the declared file size', 'offset': current}), 400
+        
+        written = 0
+        with open(part_path, 'ab') as f:
+            try:
+                while written < length:
+                    data = request.stream.read(min(STREAM_BUFFER_SIZE, length - written))
+                    if not data:
+                        break
+                    f.write(data)
+                    written += len(data)
+            except Exception as e:
+                print(f"Upload {upload_id} interrupted after {written} bytes of chunk: {str(e)}")
+            f.flush()
+            os.fsync(f.fileno())
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+    
+    return jsonify(upload.to_dict(offset + written)), 200
+
+
+@video_consultation_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """
+    Verify a complete upload's SHA-256 checksum and publish it as a video.
+    
+    Body (JSON, optional): checksum, if it was not given when the upload started.
+    On a checksum mismatch the received bytes are discarded and the upload
+    restarts from offset 0.
+    """
+    upload, error = _authenticated_upload(upload_id)
+    if error:
+        return error
+    
+    try:
+        expected = ((request.get_json(silent=True) or {}).get('checksum') or upload.checksum or '').lower()
+        if not expected:
+            return jsonify({'error': 'checksum is required'}), 400
+        
+        part_path = _part_path(upload_id)
+        with FileLock(part_path + '.lock'):
+            if _upload_gone(part_path):
+                return jsonify({'error': 'Upload not found'}), 404
+            received = os.path.getsize(part_path)
+            if received != upload.file_size:
+                return jsonify({'error': 'Upload is incomplete', 'offset': received}), 409
+            
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(STREAM_BUFFER_SIZE), b''):
+                    digest.update(block)
+            if digest.hexdigest() != expected:
+                open(part_path, 'wb').close()
+                return jsonify({'error': 'Checksum mismatch, upload restarted', 'offset': 0}), 422
+            
+            # Publish under the same naming scheme as single-request uploads
+            file_extension = upload.original_filename.rsplit('.', 1)[1].lower()
+            video_id = str(uuid.uuid4())
+            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+            filename = f"{upload.user_id}_{timestamp}_{video_id}.{file_extension}"
+            destination = os.path.join(UPLOAD_FOLDER, filename)
+            os.replace(part_path, destination)
+            try:
+                db.session.delete(upload)
+                _add_video(
+                    upload.user_id, video_id, filename, upload.original_filename,
+                    upload.description, upload.patient_name, received
+                )
+                db.session.commit()
+            except Exception:
+                # Keep the bytes with their upload session rather than orphan an unrecorded video
+                db.session.rollback()
+                os.replace(destination, part_path)
+                raise
+            _remove_lock_file(part_path)
+        
+        enqueue_video_processing(current_app._get_current_object(), video_id, UPLOAD_FOLDER)
+        
+        print(f"Video uploaded successfully: {filename}")
+        
+        return jsonify({
+            'success': True,
+            'message': 'Video uploaded successfully',
+            'video_id': video_id,
+            'filename': filename,
+            'file_size': received
+        }), 201
+        
+    except Exception as e:
+        print(f"Error finalizing upload: {str(e)}")
+        return jsonify({'error': f'Failed to finalize upload: {str(e)}'}), 500
+
+
+@video_consultation_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """
+    Abandon an unfinished upload and discard the bytes received.
+    """
+    upload, error = _authenticated_upload(upload_id)
+    if error:
+        return error
+    
+    with FileLock(_part_path(upload_id) + '.lock'):
+        _discard_upload(upload)
+        db.session.commit()
+    
+    return jsonify({'success': True, 'message': 'Upload aborted'}), 200
+
+
 @video_consultation_bp.route('/videos', methods=['GET'])
 def get_all_videos():
     """
@@ -111,23 +430,19 @@ def get_all_videos():
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        # Get all metadata files for this user
         videos = []
-        
-        for filename in os.listdir(UPLOAD_FOLDER):
-            if filename.endswith('_metadata.json') and filename.startswith(f"{user_id}_"):
-                metadata_filepath = os.path.join(UPLOAD_FOLDER, filename)
-                
-                with open(metadata_filepath, 'r') as f:
-                    metadata = json.load(f)
-                    
-                # Verify the video file still exists
-                video_filepath = os.path.join(UPLOAD_FOLDER, metadata['filename'])
-                if os.path.exists(video_filepath):
-                    videos.append(metadata)
-        
-        # Sort by upload date (newest first)
-        videos.sort(key=lambda x: x.get('uploaded_at', ''), reverse=True)
+        for video in VideoConsultation.query.filter_by(user_id=user_id).order_by(VideoConsultation.uploaded_at.desc()):
+            # Verify the video file still exists
+            if os.path.exists(os.path.join(UPLOAD_FOLDER, video.filename)):
+                video_dict = video.to_dict()
+                # Lets list views render tiles without fetching the originals
+                video_dict['thumbnail_url'] = url_for(
+                    'video_consultation.get_video_thumbnail', video_id=video.video_id
+                ) if video.thumbnail_filename else None
+                video_dict['preview_url'] = url_for(
+                    'video_consultation.get_video_preview', video_id=video.video_id
+                ) if video.preview_filename else None
+                videos.append(video_dict)
         
         return jsonify({
             'success': True,
@@ -140,10 +455,55 @@ def get_all_videos():
         return jsonify({'error': f'Failed to retrieve videos: {str(e)}'}), 500
 
 
+def _stored_file_response(filename, etag, mimetype):
+    """
+    Serve a file from UPLOAD_FOLDER with Range (206) and conditional GET (ETag/304) support.
+    
+    Stored files never change, so callers derive the ETag from the video ID,
+    size and mtime. With ACCEL_REDIRECT_PREFIX set, nginx streams the bytes
+    (and answers Range requests) via sendfile instead of a Python worker.
+    """
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    stat = os.stat(filepath)
+    etag = f"{etag}-{stat.st_size}-{int(stat.st_mtime)}"
+    
+    if ACCEL_REDIRECT_PREFIX:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + filename
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        # Answers If-None-Match with 304 before nginx is involved
+        response.make_conditional(request)
+    else:
+        response = send_file(
+            filepath,
+            mimetype=mimetype,
+            as_attachment=False,
+            conditional=True,
+            etag=etag,
+            last_modified=stat.st_mtime
+        )
+    
+    # Let players seek from the first response
+    response.accept_ranges = 'bytes'
+    # Patient recordings must not be stored by shared caches
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _video_response(video):
+    """Serve the original recording of a video."""
+    mimetype = VIDEO_MIMETYPES.get(video.filename.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+    return _stored_file_response(video.filename, video.video_id, mimetype)
+
+
 @video_consultation_bp.route('/video/<video_id>', methods=['GET'])
 def get_video(video_id):
     """
     Stream a specific video file.
+    Supports Range requests (206 Partial Content) for seeking and
+    If-None-Match/If-Modified-Since revalidation (304).
     """
     # Verify JWT
     try:
@@ -154,26 +514,12 @@ def get_video(video_id):
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        # Find the metadata file for this video
-        metadata_file = None
-        
-        for filename in os.listdir(UPLOAD_FOLDER):
-            if filename.endswith('_metadata.json') and video_id in filename:
-                metadata_filepath = os.path.join(UPLOAD_FOLDER, filename)
-                
-                with open(metadata_filepath, 'r') as f:
-                    metadata = json.load(f)
-                    
-                # Verify ownership
-                if metadata.get('user_id') == user_id and metadata.get('video_id') == video_id:
-                    video_filepath = os.path.join(UPLOAD_FOLDER, metadata['filename'])
-                    
-                    if os.path.exists(video_filepath):
-                        return send_file(
-                            video_filepath,
-                            mimetype='video/webm',
-                            as_attachment=False
-                        )
+        video = VideoConsultation.query.filter_by(video_id=video_id, user_id=user_id).first()
+        if video:
+            video_filepath = os.path.join(UPLOAD_FOLDER, video.filename)
+            
+            if os.path.exists(video_filepath):
+                return _video_response(video)
         
         return jsonify({'error': 'Video not found'}), 404
         
@@ -182,6 +528,45 @@ def get_video(video_id):
         return jsonify({'error': f'Failed to retrieve video: {str(e)}'}), 500
 
 
+def _video_asset(video_id, field, mimetype_for, label):
+    """Serve a generated poster or preview of one of the JWT user's videos."""
+    # Verify JWT
+    try:
+        verify_jwt_in_request()
+        user_id = int(get_jwt_identity())
+    except Exception as e:
+        print(f"DEBUG: JWT Error in get_video_{label}: {str(e)}")
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    try:
+        video = VideoConsultation.query.filter_by(video_id=video_id, user_id=user_id).first()
+        filename = getattr(video, field) if video else None
+        if filename and os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
+            return _stored_file_response(filename, f"{video_id}-{label}", mimetype_for(filename))
+        
+        return jsonify({'error': f'Video {label} not found'}), 404
+        
+    except Exception as e:
+        print(f"Error getting video {label}: {str(e)}")
+        return jsonify({'error': f'Failed to retrieve video {label}: {str(e)}'}), 500
+
+
+@video_consultation_bp.route('/video/<video_id>/thumbnail', methods=['GET'])
+def get_video_thumbnail(video_id):
+    """
+    Get the poster frame (JPEG) of a video, once background processing is done.
+    """
+    return _video_asset(video_id, 'thumbnail_filename', lambda filename: 'image/jpeg', 'thumbnail')
+
+
+@video_consultation_bp.route('/video/<video_id>/preview', methods=['GET'])
+def get_video_preview(video_id):
+    """
+    Get the short low-resolution preview clip of a video, once background processing is done.
+    """
+    return _video_asset(video_id, 'preview_filename', preview_mimetype, 'preview')
+
+
 @video_consultation_bp.route('/video/<video_id>', methods=['DELETE'])
 def delete_video(video_id):
     """
@@ -199,25 +584,21 @@ def delete_video(video_id):
         # Find and delete the video and metadata
         deleted = False
         
-        for filename in os.listdir(UPLOAD_FOLDER):
-            if video_id in filename:
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                
-                # If it's a metadata file, verify ownership first
-                if filename.endswith('_metadata.json'):
-                    with open(filepath, 'r') as f:
-                        metadata = json.load(f)
-                    
-                    if metadata.get('user_id') == user_id and metadata.get('video_id') == video_id:
-                        # Delete video file
-                        video_filepath = os.path.join(UPLOAD_FOLDER, metadata['filename'])
-                        if os.path.exists(video_filepath):
-                            os.remove(video_filepath)
-                        
-                        # Delete metadata file
-                        os.remove(filepath)
-                        deleted = True
-                        break
+        video = VideoConsultation.query.filter_by(video_id=video_id, user_id=user_id).first()
+        if video:
+            # Delete video file, and the JSON sidecar of videos uploaded before the metadata table
+            video_filepath = os.path.join(UPLOAD_FOLDER, video.filename)
+            sidecar_filepath = os.path.join(UPLOAD_FOLDER, os.path.splitext(video.filename)[0] + '_metadata.json')
+            for filepath in (video_filepath, sidecar_filepath):
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            remove_video_previews(video, UPLOAD_FOLDER)
+            
+            # Delete metadata
+            db.session.delete(video)
+            ActivityEvent.forget('video_consultation', video_id)
+            db.session.commit()
+            deleted = True
         
         if deleted:
             return jsonify({
@@ -5,10 +5,11 @@ Medical Imaging Platform with AI Analysis
 """
 
 import os
-from app import app, db
 
 def create_app():
     """Create and configure the Flask application"""
+    # Imported here, not at module level: spawned job workers re-run this module
+    from app import app, db
     
     # Create upload directories
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
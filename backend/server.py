@@ -0,0 +1,17 @@
+"""
+Start the backend server.
+
+Use this rather than "python app.py": background-job worker processes are
+spawned, and spawning re-runs the main module in every worker. With this
+file as the main module a worker imports nothing beyond what its task
+needs; with app.py it would load the whole application (models, AI
+libraries) into each worker.
+"""
+import os
+
+if __name__ == '__main__':
+    from app import app
+    
+    # Use debug=False in production, or read from environment
+    debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+    app.run(debug=debug_mode, host='0.0.0.0', port=5001)
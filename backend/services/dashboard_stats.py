@@ -0,0 +1,147 @@
+"""
+Aggregated dashboard statistics with a per-user TTL cache.
+
+All counters come from a single SQL statement of COUNT/MAX aggregates
+(plus the notes store's medication count), and are cached per user for
+DASHBOARD_STATS_TTL seconds. Commits that write a user's MedicalReport or
+SymptomCheck rows, and doctor note writes, bump the user's row in
+dashboard_stats_versions. Every read compares it (one primary-key lookup)
+with the version its cache entry was computed at, so all workers, not
+only the one that wrote, serve fresh stats right after a write.
+"""
+import logging
+import os
+import threading
+import time
+from itertools import chain
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.dashboard import DashboardStatsVersion
+from models.medical import SymptomCheck
+from models.medical_report import MedicalReport
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_STATS_TTL = float(os.getenv('DASHBOARD_STATS_TTL', '30'))
+
+# Models whose writes change a user's dashboard stats
+TRACKED_MODELS = (MedicalReport, SymptomCheck)
+
+_cache = {}  # user_id -> (expires_at, shared version the stats were computed at, stats)
+_cache_lock = threading.Lock()
+
+
+def get_user_dashboard_stats(user_id):
+    """
+    Dashboard counters for a user, served from the cache while fresh.
+    
+    Args:
+        user_id: The user to aggregate for
+    
+    Returns:
+        Dictionary with health_records_count, active_medications_count,
+        symptom_checks_count, last_symptom_check_at and latest_health_record
+    """
+    # Read before computing: a write committed meanwhile bumps it, and the entry stored below is then stale on arrival
+    version = _shared_version(user_id)
+    with _cache_lock:
+        cached = _cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic() and cached[1] == version:
+            return cached[2]
+    
+    stats = _compute_stats(user_id)
+    
+    with _cache_lock:
+        _cache[user_id] = (time.monotonic() + DASHBOARD_STATS_TTL, version, stats)
+    return stats
+
+
+def invalidate_dashboard_stats(user_id):
+    """Drop a user's cached dashboard stats after a write, in every worker (call after committing)."""
+    with _cache_lock:
+        _cache.pop(user_id, None)
+    try:
+        _bump_shared_version(user_id)
+    except Exception as e:
+        # Other workers then catch up within DASHBOARD_STATS_TTL
+        logger.warning(f"Could not publish dashboard stats invalidation for user {user_id}: {e}")
+
+
+def _shared_version(user_id):
+    return db.session.execute(
+        select(DashboardStatsVersion.version).where(DashboardStatsVersion.user_id == user_id)
+    ).scalar() or 0
+
+
+def _bump_shared_version(user_id):
+    """Increment the user's version in its own transaction (the write it follows is already committed)."""
+    table = DashboardStatsVersion.__table__
+    bump = update(table).where(table.c.user_id == user_id).values(version=table.c.version + 1)
+    with db.engine.begin() as connection:
+        if connection.execute(bump).rowcount:
+            return
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(insert(table).values(user_id=user_id, version=1))
+    except IntegrityError:
+        # Another worker created the row first
+        with db.engine.begin() as connection:
+            connection.execute(bump)
+
+
+def _compute_stats(user_id):
+    """Run the aggregate query for a user."""
+    def aggregate(column, model, *order_by):
+        query = select(column).where(model.user_id == user_id)
+        if order_by:
+            query = query.order_by(*order_by).limit(1)
+        return query.scalar_subquery()
+    
+    row = db.session.execute(select(
+        aggregate(func.count(MedicalReport.id), MedicalReport).label('reports_count'),
+        aggregate(MedicalReport.id, MedicalReport,
+                  MedicalReport.uploaded_at.desc(), MedicalReport.id.desc()).label('latest_report_id'),
+        aggregate(func.count(SymptomCheck.id), SymptomCheck).label('symptom_checks_count'),
+        aggregate(func.max(SymptomCheck.created_at), SymptomCheck).label('last_symptom_check_at')
+    )).one()
+    
+    latest_report = db.session.get(MedicalReport, row.latest_report_id) if row.latest_report_id else None
+    
+    # Count active medications from doctor notes
+    active_medications_count = 0
+    try:
+        from services.doctor_notes_vector_store import get_vector_store
+        active_medications_count = get_vector_store().count_active_medications(user_id)
+    except Exception as e:
+        print(f"DEBUG: Error counting medications from notes: {str(e)}")
+    
+    return {
+        'health_records_count': row.reports_count,  # Count of uploaded medical reports
+        'active_medications_count': active_medications_count,  # Count from doctor notes
+        'symptom_checks_count': row.symptom_checks_count,
+        'last_symptom_check_at': row.last_symptom_check_at.isoformat() + 'Z' if row.last_symptom_check_at else None,
+        'latest_health_record': latest_report.to_dict() if latest_report else None
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    users = session.info.setdefault('dashboard_stats_users', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, TRACKED_MODELS) and obj.user_id is not None:
+            users.add(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('dashboard_stats_users', ()):
+        invalidate_dashboard_stats(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('dashboard_stats_users', None)
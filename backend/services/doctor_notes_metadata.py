@@ -0,0 +1,258 @@
+"""
+SQLite-backed metadata store for doctor notes.
+
+Each note version is a row whose INTEGER PRIMARY KEY is the `vector_id` the
+FAISS index is keyed by. Listing, lookups and aggregates are SQL queries over
+indexed columns, so nothing proportional to the corpus is held in memory.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    vector_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    note_id TEXT,
+    user_id INTEGER,
+    content TEXT NOT NULL,
+    date TEXT,
+    doctor TEXT,
+    patient_context TEXT,
+    type TEXT,
+    title TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_notes_user_created ON notes (user_id, deleted, created_at DESC);
+CREATE INDEX IF NOT EXISTS ix_notes_note_id ON notes (note_id);
+CREATE INDEX IF NOT EXISTS ix_notes_deleted ON notes (deleted);
+
+CREATE TABLE IF NOT EXISTS note_medications (
+    vector_id INTEGER NOT NULL,
+    user_id INTEGER,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_note_medications_user ON note_medications (user_id, name);
+CREATE INDEX IF NOT EXISTS ix_note_medications_vector ON note_medications (vector_id);
+
+CREATE TABLE IF NOT EXISTS store_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns that search filters may match exactly
+FILTERABLE_COLUMNS = ('type', 'doctor', 'title')
+
+
+def _row_to_note(row):
+    """Convert a notes row to the note dict returned by the vector store."""
+    note = dict(row)
+    note['id'] = note.pop('note_id')
+    note['patient_context'] = json.loads(note['patient_context'] or '{}')
+    note['deleted'] = bool(note['deleted'])
+    return note
+
+
+def _note_medications(note):
+    """Medications listed in a note's patient context."""
+    medications = (note.get('patient_context') or {}).get('medications', [])
+    if not isinstance(medications, list):
+        return []
+    return sorted({m for m in medications if isinstance(m, str)})
+
+
+class DoctorNotesMetadataStore:
+    """Note metadata in SQLite (WAL mode), one connection per thread."""
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) if os.path.dirname(db_path) else '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+    
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    # --- writes ---------------------------------------------------------
+    
+    def insert_notes(self, notes, before_commit=None):
+        """
+        Insert note versions in one transaction.
+        
+        Args:
+            notes: Note dicts (id, user_id, content, date, doctor,
+                patient_context, type, title, created_at, optional vector_id)
+            before_commit: Called with the assigned vector IDs before the
+                transaction commits; an exception rolls the insert back
+        
+        Returns:
+            List of assigned vector IDs
+        """
+        conn = self._connection()
+        vector_ids = []
+        with conn:
+            for note in notes:
+                cursor = conn.execute(
+                    'INSERT INTO notes (vector_id, note_id, user_id, content, date, doctor, patient_context, '
+                    'type, title, created_at, updated_at, deleted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        note.get('vector_id'), note.get('id'), note.get('user_id'), note['content'],
+                        note.get('date'), note.get('doctor'), json.dumps(note.get('patient_context') or {}),
+                        note.get('type'), note.get('title'), note['created_at'], note.get('updated_at'),
+                        int(bool(note.get('deleted', False)))
+                    )
+                )
+                vector_ids.append(cursor.lastrowid)
+                if not note.get('deleted', False):
+                    conn.executemany(
+                        'INSERT INTO note_medications (vector_id, user_id, name) VALUES (?, ?, ?)',
+                        [(cursor.lastrowid, note.get('user_id'), name) for name in _note_medications(note)]
+                    )
+            if before_commit is not None:
+                before_commit(vector_ids)
+        return vector_ids
+    
+    def mark_deleted(self, note_id):
+        """
+        Tombstone every live version of a note.
+        
+        Returns:
+            (found, vector IDs that were newly tombstoned)
+        """
+        conn = self._connection()
+        with conn:
+            rows = conn.execute('SELECT vector_id, deleted FROM notes WHERE note_id = ?', (note_id,)).fetchall()
+            if not rows:
+                return False, []
+            vector_ids = [row['vector_id'] for row in rows if not row['deleted']]
+            if vector_ids:
+                placeholders = ','.join('?' * len(vector_ids))
+                conn.execute(f'UPDATE notes SET deleted = 1 WHERE vector_id IN ({placeholders})', vector_ids)
+                conn.execute(f'DELETE FROM note_medications WHERE vector_id IN ({placeholders})', vector_ids)
+        return True, vector_ids
+    
+    def purge_deleted(self, keep_vector_ids=()):
+        """
+        Drop tombstoned rows, except those in `keep_vector_ids`.
+        
+        Returns:
+            Number of rows removed
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS keep_ids (vector_id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM keep_ids')
+            conn.executemany('INSERT INTO keep_ids (vector_id) VALUES (?)', [(int(v),) for v in keep_vector_ids])
+            cursor = conn.execute(
+                'DELETE FROM notes WHERE deleted = 1 AND vector_id NOT IN (SELECT vector_id FROM keep_ids)'
+            )
+            conn.execute('DELETE FROM keep_ids')
+        return cursor.rowcount
+    
+    def set_state(self, key, value):
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO store_state (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+    
+    # --- reads ----------------------------------------------------------
+    
+    def get_state(self, key, default=None):
+        row = self._connection().execute('SELECT value FROM store_state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+    
+    def is_empty(self):
+        return self._connection().execute('SELECT 1 FROM notes LIMIT 1').fetchone() is None
+    
+    def get_latest(self, note_id):
+        """Latest version of a note (possibly tombstoned), or None."""
+        row = self._connection().execute(
+            'SELECT * FROM notes WHERE note_id = ? ORDER BY vector_id DESC LIMIT 1', (note_id,)
+        ).fetchone()
+        return _row_to_note(row) if row else None
+    
+    def get_user_notes(self, user_id, limit=None, offset=0):
+        """A user's live notes, newest first, optionally paged."""
+        query = 'SELECT * FROM notes WHERE user_id = ? AND deleted = 0 ORDER BY created_at DESC, vector_id DESC'
+        params = [user_id]
+        if limit is not None:
+            query += ' LIMIT ? OFFSET ?'
+            params += [int(limit), int(offset)]
+        return [_row_to_note(row) for row in self._connection().execute(query, params)]
+    
+    def count_user_notes(self, user_id):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM notes WHERE user_id = ? AND deleted = 0', (user_id,)
+        ).fetchone()[0]
+    
+    def count_active_medications(self, user_id):
+        return self._connection().execute(
+            'SELECT COUNT(DISTINCT name) FROM note_medications WHERE user_id = ?', (user_id,)
+        ).fetchone()[0]
+    
+    def get_live_notes(self, vector_ids):
+        """Live notes for the given vector IDs, as {vector_id: note}."""
+        notes = {}
+        vector_ids = [int(v) for v in vector_ids]
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(vector_ids), 500):
+            chunk = vector_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self._connection().execute(
+                f'SELECT * FROM notes WHERE deleted = 0 AND vector_id IN ({placeholders})', chunk
+            ):
+                notes[row['vector_id']] = _row_to_note(row)
+        return notes
+    
+    def candidate_vector_ids(self, user_id=None, filters=None):
+        """
+        Vector IDs of live notes owned by `user_id` and matching `filters`.
+        
+        Raises:
+            ValueError: If a filter names an unsupported field
+        """
+        clauses = ['deleted = 0']
+        params = []
+        if user_id is not None:
+            clauses.append('user_id = ?')
+            params.append(user_id)
+        for key, value in (filters or {}).items():
+            if key == 'date_from':
+                clauses.append('date >= ?')
+                params.append(value)
+            elif key == 'date_to':
+                # Inclusive of the whole end day for plain YYYY-MM-DD bounds
+                clauses.append('substr(date, 1, ?) <= ?')
+                params += [len(value), value]
+            elif key in FILTERABLE_COLUMNS:
+                clauses.append(f'{key} = ?')
+                params.append(value)
+            else:
+                raise ValueError(f'Unsupported filter: {key}')
+        query = f'SELECT vector_id FROM notes WHERE {" AND ".join(clauses)}'
+        return [row[0] for row in self._connection().execute(query, params)]
+    
+    def live_vector_ids(self):
+        return self.candidate_vector_ids()
+    
+    def deleted_vector_ids(self):
+        return [row[0] for row in self._connection().execute('SELECT vector_id FROM notes WHERE deleted = 1')]
+    
+    def all_notes(self):
+        return [_row_to_note(row) for row in self._connection().execute('SELECT * FROM notes ORDER BY vector_id')]
+    
+    def counts(self):
+        """(total rows, live rows)."""
+        row = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(CASE WHEN deleted = 0 THEN 1 ELSE 0 END), 0) FROM notes'
+        ).fetchone()
+        return row[0], row[1]
@@ -2,37 +2,358 @@ import faiss
 import numpy as np
 import pickle
 import os
-from sentence_transformers import SentenceTransformer
+import base64
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 import json
 
+from services.embedding_service import get_embedding_model, encode_texts, get_cache_stats, EMBEDDING_DIMENSION
+from services.doctor_notes_metadata import DoctorNotesMetadataStore
+from services.file_lock import FileLock
+from services.vector_index_factory import (
+    build_index, configure_search, estimate_recall, index_kind, is_id_mapped,
+    remove_vectors, search_parameters, supports_removal, target_index_kind
+)
+
+DEFAULT_INDEX_PATH = 'instance/doctor_notes_faiss.index'
+DEFAULT_DB_PATH = 'instance/doctor_notes.db'
+# Pickled metadata list used before notes moved to SQLite; imported once
+LEGACY_METADATA_PATH = 'instance/doctor_notes_metadata.pkl'
+
+# Number of journal records after which a background checkpoint folds the
+# journal into a fresh snapshot
+CHECKPOINT_EVERY = int(os.getenv('DOCTOR_NOTES_CHECKPOINT_EVERY', '500'))
+
+# Scoped searches over at most this many candidate vectors are scored
+# exactly against just those vectors instead of going through the index
+EXACT_SEARCH_LIMIT = 2048
+# Initial over-fetch factor for index searches whose hits are post-filtered
+SEARCH_OVERSAMPLE = 4
+# Rebuild an index that cannot remove vectors in place (HNSW) once this
+# fraction of its vectors belongs to deleted notes
+STALE_REBUILD_FRACTION = 0.2
+# Number of recent searches kept for latency percentiles
+LATENCY_SAMPLES = 1000
+
 class DoctorNotesVectorStore:
     """
     FAISS-based vector store for doctor consultation notes.
     Stores notes with embeddings for semantic search and retrieval.
+    
+    Note metadata lives in SQLite (see services.doctor_notes_metadata); each
+    note version's row ID is its `vector_id` in the FAISS index, which holds
+    only vectors. Lists, lookups and aggregates are indexed SQL queries.
+    
+    The index is persisted as a snapshot plus an append-only JSON-lines
+    journal of vector additions and removals. Each mutation appends one
+    fsync'd journal record, and a background checkpoint periodically folds
+    the journal into a new snapshot. On startup the journal is replayed on
+    top of the snapshot.
+    
+    Several processes (e.g. gunicorn workers) may open the same store. Writes
+    serialize on an exclusive lock file and first catch up on the journal, so
+    journal sequence numbers stay global. Readers keep their in-memory index
+    and refresh() it by tailing the journal; they reload the snapshot only
+    when a rebuild bumps the store generation or records were missed.
+    
+    Deleted and superseded versions are removed from the index immediately
+    (or, for HNSW, excluded until the next rebuild); compact() also drops
+    their tombstoned rows.
+    
+    The index starts as exact flat search and is promoted in the background
+    to an approximate index once the corpus is large enough (see
+    services.vector_index_factory).
     """
     
-    def __init__(self, index_path='instance/doctor_notes_faiss.index', metadata_path='instance/doctor_notes_metadata.pkl'):
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, db_path=DEFAULT_DB_PATH, journal_path=None,
+                 legacy_metadata_path=LEGACY_METADATA_PATH):
         self.index_path = index_path
-        self.metadata_path = metadata_path
-        self.dimension = 384  # all-MiniLM-L6-v2 embedding dimension
+        self.db_path = db_path
+        self.journal_path = journal_path or os.path.splitext(index_path)[0] + '.journal'
+        self.legacy_metadata_path = legacy_metadata_path
+        self.dimension = EMBEDDING_DIMENSION
+        self.notes = DoctorNotesMetadataStore(db_path)
+        self._lock = threading.RLock()
+        # Serializes writers across processes; held (reentrantly) via _write_lock()
+        self._file_lock = FileLock(index_path + '.lock')
+        self._write_depth = 0
+        # Serializes checkpoints and rebuilds across processes
+        self._maintenance_lock = FileLock(index_path + '.maintenance.lock')
+        self._maintenance_thread = None
+        self._rebuild_additions = None
+        self._rebuild_deletions = None
+        self._search_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._generation = None
+        # Live journal read position: (seq of the file's first record, byte offset).
+        # Journal files are identified by their first record, as inodes get reused
+        self._journal_cursor = (None, 0)
+        # The first write lock sees a generation mismatch and loads the store
+        with self._write_lock():
+            pass
+    
+    @property
+    def model(self):
+        """Shared sentence transformer model (loaded once per process)."""
+        return get_embedding_model()
+    
+    @property
+    def _rotated_journal_path(self):
+        """Journal segment being folded into a snapshot by a checkpoint."""
+        return self.journal_path + '.checkpoint'
+    
+    @contextmanager
+    def _write_lock(self):
+        """
+        Hold the store's inter-process write lock (reentrant within a thread).
+        
+        On acquisition the in-memory index is brought up to date with writes
+        made by other processes, so new journal records continue the global
+        sequence.
+        """
+        with self._lock:
+            if self._write_depth == 0:
+                self._file_lock.acquire()
+                try:
+                    self._catch_up(locked=True)
+                except Exception:
+                    self._file_lock.release()
+                    raise
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._file_lock.release()
+    
+    def refresh(self):
+        """
+        Apply writes other processes made since the last refresh.
+        
+        Normally this just tails the journal; the snapshot is reloaded when a
+        rebuild changed the store generation.
         
-        # Initialize sentence transformer model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        Returns:
+            True if the in-memory index changed
+        """
+        with self._lock:
+            if self._write_depth:
+                return False  # Caught up when the write lock was taken
+            return self._catch_up(locked=False)
+    
+    def _catch_up(self, locked):
+        """
+        Bring the in-memory index up to date with the files on disk.
         
+        Without the write lock, journal tails being appended are left alone
+        and anything that needs a reload retakes the lock.
+        """
+        snapshot_seq = self.notes.get_state('snapshot_seq', 0)
+        if self._generation == self.notes.get_state('generation', 0):
+            applied, complete = self._replay_journals(truncate_torn=locked)
+            # Records a checkpoint folded into the snapshot before we read
+            # them are gone from the journal
+            if complete and self._seq >= snapshot_seq:
+                return applied > 0
+        if not locked:
+            with self._write_lock():
+                return True
+        self._load()
+        return True
+    
+    def _load(self):
+        """
+        Load the index snapshot from disk (or start empty) and replay the journal.
+        Must be called holding the write lock.
+        """
         # Load or create FAISS index
         if os.path.exists(self.index_path):
             self.index = faiss.read_index(self.index_path)
+            configure_search(self.index)
         else:
-            # Create a new FAISS index (using L2 distance)
-            self.index = faiss.IndexFlatL2(self.dimension)
+            self.index = self._new_index()
         
-        # Load or create metadata store
-        if os.path.exists(self.metadata_path):
-            with open(self.metadata_path, 'rb') as f:
-                self.metadata = pickle.load(f)
-        else:
-            self.metadata = []
+        if os.path.exists(self.legacy_metadata_path) and self.notes.is_empty():
+            self._migrate_legacy_metadata()
+        
+        self._generation = self.notes.get_state('generation', 0)
+        self._seq = self.notes.get_state('snapshot_seq', 0)
+        self._index_recall = self.notes.get_state('index_recall')
+        
+        # Replay records newer than the snapshot
+        self._stale_vector_ids = set()
+        self._journal_cursor = (None, 0)
+        if not self._replay_journals(truncate_torn=True)[1]:
+            print(f"WARNING: doctor notes journal {self.journal_path} is missing records after seq {self._seq}")
+        
+        # Deleted notes whose vectors an HNSW index could not drop
+        if not supports_removal(self.index):
+            self._stale_vector_ids = {
+                vector_id for vector_id in self.notes.deleted_vector_ids()
+                if self._index_contains(vector_id)
+            }
+    
+    def _new_index(self):
+        """Create an empty exact FAISS index (L2 distance) keyed by vector_id."""
+        return build_index('flat', self.dimension)
+    
+    def _migrate_legacy_metadata(self):
+        """
+        Import the pickled metadata list into SQLite.
+        
+        Older stores kept every vector (deleted ones included) in a plain
+        IndexFlatL2 whose row number was the metadata position; that position
+        becomes the note's vector_id and only live vectors are carried over.
+        """
+        with open(self.legacy_metadata_path, 'rb') as f:
+            legacy = pickle.load(f)
+        if isinstance(legacy, dict):
+            legacy = legacy['notes']
+        
+        for position, note in enumerate(legacy):
+            note.setdefault('vector_id', position)
+            note.setdefault('created_at', note.get('date') or datetime.utcnow().isoformat())
+        
+        if not is_id_mapped(self.index):
+            positional_index = self.index
+            self.index = self._new_index()
+            live_positions = [
+                position for position, note in enumerate(legacy)
+                if not note.get('deleted', False) and position < positional_index.ntotal
+            ]
+            if live_positions:
+                vectors = positional_index.reconstruct_n(0, positional_index.ntotal)[live_positions]
+                self.index.add_with_ids(vectors, np.array(live_positions, dtype='int64'))
+            _atomic_write(self.index_path, faiss.serialize_index(self.index).tobytes())
+        
+        self.notes.insert_notes(legacy)
+        os.replace(self.legacy_metadata_path, self.legacy_metadata_path + '.migrated')
+    
+    def _index_contains(self, vector_id):
+        """Whether the FAISS index holds a vector for `vector_id`."""
+        try:
+            self.index.reconstruct(int(vector_id))
+            return True
+        except RuntimeError:
+            return False
+    
+    def _replay_journals(self, truncate_torn):
+        """
+        Apply journal records newer than the in-memory state, oldest segment first.
+        
+        Returns:
+            (number of records applied, False if records were missing)
+        """
+        applied, complete = self._replay_journal(self._rotated_journal_path, truncate_torn)
+        if not complete:
+            return applied, False
+        live_applied, complete = self._replay_journal(self.journal_path, truncate_torn, from_cursor=True)
+        return applied + live_applied, complete
+    
+    def _replay_journal(self, path, truncate_torn, from_cursor=False):
+        """
+        Apply journal records from `path` that are newer than the current state.
+        
+        A partial last line is either a crash mid-append (truncated when
+        `truncate_torn`, i.e. under the write lock) or another process's
+        append in progress (left for the next refresh).
+        
+        Returns:
+            (number of records applied, False if a gap in sequence numbers
+            shows records were missed)
+        """
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return 0, True
+        
+        applied = 0
+        torn = False
+        with f:
+            first_seq = _record_seq(f.readline())
+            f.seek(0)
+            offset = 0
+            if from_cursor and first_seq is not None and self._journal_cursor[0] == first_seq:
+                offset = self._journal_cursor[1]
+                f.seek(offset)
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete journal record')
+                    record = json.loads(line)
+                except ValueError:
+                    torn = True
+                    break
+                if record['seq'] > self._seq:
+                    if record['seq'] != self._seq + 1:
+                        return applied, False
+                    self._apply_record(record)
+                    self._seq = record['seq']
+                    applied += 1
+                offset += len(line)
+            if from_cursor:
+                self._journal_cursor = (first_seq, offset)
+        
+        if torn and truncate_torn:
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return applied, True
+    
+    def _apply_record(self, record):
+        """
+        Apply a single journal record to the in-memory index.
+        
+        Replay is idempotent: a snapshot written just before a crash may
+        already contain some of the journaled vectors. A vector ID is only
+        reused after its orphaned vector was journaled as removed, so an add
+        can never undo a later removal.
+        """
+        if record['op'] == 'add':
+            if not self._index_contains(record['vector_id']):
+                embedding = np.frombuffer(base64.b64decode(record['embedding']), dtype='float32')
+                self.index.add_with_ids(embedding.reshape(1, -1), np.array([record['vector_id']], dtype='int64'))
+            if self._rebuild_additions is not None:
+                self._rebuild_additions.append(record['vector_id'])
+        elif record['op'] == 'remove':
+            for vector_id in record['vector_ids']:
+                self._remove_vector(vector_id)
+            if self._rebuild_deletions is not None:
+                self._rebuild_deletions.extend(record['vector_ids'])
+    
+    def _append_journal(self, *records):
+        """
+        Durably append records to the journal with a single fsync (O(1) in the corpus size).
+        Must be called holding the write lock.
+        """
+        lines = []
+        for record in records:
+            self._seq += 1
+            record['seq'] = self._seq
+            lines.append(json.dumps(record).encode('utf-8') + b'\n')
+        
+        # Ensure directory exists
+        os.makedirs(os.path.dirname(self.journal_path) if os.path.dirname(self.journal_path) else '.', exist_ok=True)
+        
+        with open(self.journal_path, 'ab') as f:
+            # Our own records need not be read back
+            first_seq = self._journal_cursor[0] if f.tell() else records[0]['seq']
+            f.write(b''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_cursor = (first_seq, f.tell())
+        
+        if self._seq - self.notes.get_state('snapshot_seq', 0) >= CHECKPOINT_EVERY:
+            self._schedule_maintenance()
+    
+    def _remove_vector(self, vector_id):
+        """Remove a vector from the index, or mark it stale if that is not supported."""
+        if supports_removal(self.index):
+            remove_vectors(self.index, [vector_id])
+        elif self._index_contains(vector_id):
+            self._stale_vector_ids.add(vector_id)
     
     def add_note(self, note_content, note_data):
         """
@@ -43,67 +364,178 @@ class DoctorNotesVectorStore:
             note_data: Dictionary containing metadata (id, date, doctor, patient_context, etc.)
         
         Returns:
-            The index position where the note was added
+            The vector ID of the stored note version
+        """
+        return self.add_notes([(note_content, note_data)])[0]
+    
+    def add_notes(self, notes, batch_size=None):
+        """
+        Add many doctor notes at once.
+        
+        Embeddings are computed in batches, the rows are inserted in one
+        transaction and all journal records are written with a single fsync,
+        so importing thousands of notes costs a few model forward passes
+        rather than one per note.
+        
+        Args:
+            notes: List of (note_content, note_data) pairs, as for add_note()
+            batch_size: Notes per embedding forward pass
+        
+        Returns:
+            List of vector IDs of the stored note versions
         """
-        # Generate embedding
-        embedding = self.model.encode([note_content])[0]
-        embedding = np.array([embedding], dtype='float32')
+        if not notes:
+            return []
         
-        # Add to FAISS index
-        self.index.add(embedding)
+        # Generate embeddings
+        embeddings = encode_texts([content for content, _ in notes], batch_size=batch_size)
         
         # Store metadata
-        metadata_entry = {
-            'id': note_data.get('id'),
-            'user_id': note_data.get('user_id'),  # Store user_id
-            'content': note_content,
-            'date': note_data.get('date', datetime.utcnow().isoformat()),
-            'doctor': note_data.get('doctor', 'Unknown'),
-            'patient_context': note_data.get('patient_context', {}),
-            'type': note_data.get('type', 'Consultation'),
-            'title': note_data.get('title', 'Consultation Note'),
-            'created_at': datetime.utcnow().isoformat()
-        }
-        self.metadata.append(metadata_entry)
+        now = datetime.utcnow().isoformat()
+        metadata_entries = [
+            {
+                'id': note_data.get('id'),
+                'user_id': note_data.get('user_id'),  # Store user_id
+                'content': note_content,
+                'date': note_data.get('date', now),
+                'doctor': note_data.get('doctor', 'Unknown'),
+                'patient_context': note_data.get('patient_context', {}),
+                'type': note_data.get('type', 'Consultation'),
+                'title': note_data.get('title', 'Consultation Note'),
+                'created_at': now,
+                'updated_at': note_data.get('updated_at')
+            }
+            for note_content, note_data in notes
+        ]
         
-        # Save to disk
-        self._save()
+        def index_vectors(vector_ids):
+            # Runs inside the SQLite transaction: the journal is written
+            # before the rows commit, so a committed row always has a vector
+            ids = np.array(vector_ids, dtype='int64')
+            # A vector left behind by an insert that never committed may
+            # hold a reused row ID; its removal is journaled first
+            orphans = [int(vector_id) for vector_id in ids if self._index_contains(vector_id)]
+            records = [{'op': 'remove', 'vector_ids': orphans}] if orphans else []
+            records += [
+                {
+                    'op': 'add',
+                    'vector_id': int(vector_id),
+                    'embedding': base64.b64encode(embedding.tobytes()).decode('ascii')
+                }
+                for vector_id, embedding in zip(ids, embeddings)
+            ]
+            self._append_journal(*records)
+            for vector_id in orphans:
+                self._remove_vector(vector_id)
+            
+            # Add to FAISS index
+            self.index.add_with_ids(embeddings, ids)
+            if self._rebuild_additions is not None:
+                self._rebuild_additions.extend(vector_ids)
         
-        return len(self.metadata) - 1
+        with self._write_lock():
+            vector_ids = self.notes.insert_notes(metadata_entries, before_commit=index_vectors)
+            
+            if index_kind(self.index) == 'flat' and target_index_kind(self.index.ntotal) != 'flat':
+                self._schedule_maintenance()
+            
+            return vector_ids
     
-    def search_similar_notes(self, query, k=5):
+    def search_similar_notes(self, query, k=5, user_id=None, filters=None):
         """
         Search for similar notes using semantic similarity.
         
+        When `user_id` or `filters` are given, only matching live notes are
+        candidates. Small candidate sets are scored directly, so a user's
+        search costs O(that user's notes); larger ones are searched through
+        the index restricted by an ID selector.
+        
         Args:
             query: Search query text
             k: Number of similar notes to return
+            user_id: Only search notes owned by this user
+            filters: Optional metadata filters, e.g. {'type': 'Consultation',
+                'doctor': 'Dr. Smith', 'date_from': '2024-01-01', 'date_to': '2024-12-31'}
         
         Returns:
             List of similar notes with their metadata and similarity scores
+        
+        Raises:
+            ValueError: If a filter names an unsupported field
         """
-        if self.index.ntotal == 0:
+        if self.index.ntotal == 0 or k <= 0:
             return []
         
-        # Generate query embedding
-        query_embedding = self.model.encode([query])[0]
-        query_embedding = np.array([query_embedding], dtype='float32')
+        # Generate query embedding (repeated queries hit the embedding cache)
+        query_embedding = encode_texts([query])
         
-        # Search in FAISS
-        k = min(k, self.index.ntotal)  # Don't search for more than we have
-        distances, indices = self.index.search(query_embedding, k)
+        started = time.perf_counter()
+        candidate_ids = None
+        if user_id is not None or filters:
+            candidate_ids = np.array(self.notes.candidate_vector_ids(user_id, filters), dtype='int64')
+            if len(candidate_ids) == 0:
+                return []
+        
+        with self._lock:
+            if candidate_ids is not None and len(candidate_ids) <= EXACT_SEARCH_LIMIT:
+                hits = self._exact_search(query_embedding, candidate_ids, k)
+            else:
+                hits = self._index_search(query_embedding, k, candidate_ids)
         
         # Retrieve metadata for results
         results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.metadata):
-                result = self.metadata[idx].copy()
-                result['similarity_score'] = float(1 / (1 + distance))  # Convert distance to similarity
-                result['rank'] = i + 1
-                results.append(result)
+        for distance, note in hits:
+            result = note.copy()
+            result['similarity_score'] = float(1 / (1 + distance))  # Convert distance to similarity
+            result['rank'] = len(results) + 1
+            results.append(result)
         
+        self._search_latencies.append((time.perf_counter() - started) * 1000)
         return results
     
+    def _exact_search(self, query_embedding, candidate_ids, k):
+        """Brute-force L2 search over just the candidate vectors."""
+        candidate_ids = np.array([v for v in candidate_ids if self._index_contains(v)], dtype='int64')
+        if len(candidate_ids) == 0:
+            return []
+        vectors = self._reconstruct(candidate_ids)
+        distances = ((vectors - query_embedding) ** 2).sum(axis=1)
+        
+        k = min(k, len(candidate_ids))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        
+        notes = self.notes.get_live_notes(candidate_ids[nearest])
+        return [
+            (distances[i], notes[int(candidate_ids[i])])
+            for i in nearest if int(candidate_ids[i]) in notes
+        ]
+    
+    def _index_search(self, query_embedding, k, candidate_ids):
+        """
+        Search the FAISS index, restricted to `candidate_ids` if given.
+        
+        Hits are re-checked against the live rows; if stale hits leave fewer
+        than k results, the search is retried with a larger k.
+        """
+        params = None
+        limit = self.index.ntotal
+        if candidate_ids is not None:
+            params = search_parameters(self.index, faiss.IDSelectorBatch(candidate_ids))
+            limit = min(limit, len(candidate_ids))
+        k = min(k, limit)
+        
+        exact_hits = params is None and not self._stale_vector_ids
+        search_k = min(k if exact_hits else k * SEARCH_OVERSAMPLE, limit)
+        while True:
+            distances, vector_ids = self.index.search(query_embedding, search_k, params=params)
+            valid = [(d, int(v)) for d, v in zip(distances[0], vector_ids[0]) if v >= 0]
+            notes = self.notes.get_live_notes([v for _, v in valid])
+            hits = [(distance, notes[vector_id]) for distance, vector_id in valid if vector_id in notes]
+            if len(hits) >= k or search_k >= limit:
+                return hits[:k]
+            search_k = min(search_k * 2, limit)
+    
     def get_all_notes(self):
         """
         Get all notes from the vector store.
@@ -111,11 +543,49 @@ class DoctorNotesVectorStore:
         Returns:
             List of all notes with metadata
         """
-        return self.metadata
+        return self.notes.all_notes()
+    
+    def get_user_notes(self, user_id, limit=None, offset=0):
+        """
+        Get the latest, non-deleted version of every note owned by a user.
+        
+        Args:
+            user_id: The owner of the notes
+            limit: Maximum number of notes to return (all if None)
+            offset: Number of notes to skip
+        
+        Returns:
+            List of note metadata, newest first
+        """
+        return self.notes.get_user_notes(user_id, limit, offset)
+    
+    def count_user_notes(self, user_id):
+        """
+        Count a user's live notes.
+        
+        Args:
+            user_id: The owner of the notes
+        
+        Returns:
+            Number of notes
+        """
+        return self.notes.count_user_notes(user_id)
+    
+    def count_active_medications(self, user_id):
+        """
+        Count the distinct medications across a user's active notes.
+        
+        Args:
+            user_id: The owner of the notes
+        
+        Returns:
+            Number of unique medications
+        """
+        return self.notes.count_active_medications(user_id)
     
     def get_note_by_id(self, note_id):
         """
-        Get a specific note by ID.
+        Get the latest version of a specific note by ID.
         
         Args:
             note_id: The ID of the note to retrieve
@@ -123,16 +593,13 @@ class DoctorNotesVectorStore:
         Returns:
             The note metadata or None if not found
         """
-        for note in self.metadata:
-            if note.get('id') == note_id:
-                return note
-        return None
+        return self.notes.get_latest(note_id)
     
     def delete_note(self, note_id):
         """
         Delete a note from the vector store.
-        Note: FAISS doesn't support deletion, so we mark it as deleted in metadata.
-        This marks ALL instances of the note_id as deleted (in case of duplicates from updates).
+        The vectors of ALL versions of the note_id are removed from the FAISS index;
+        their rows are kept as tombstones until compact().
         
         Args:
             note_id: The ID of the note to delete
@@ -140,16 +607,17 @@ class DoctorNotesVectorStore:
         Returns:
             True if at least one note was deleted, False if not found
         """
-        found = False
-        for i, note in enumerate(self.metadata):
-            if note.get('id') == note_id:
-                self.metadata[i]['deleted'] = True
-                found = True
-        
-        if found:
-            self._save()
-        
-        return found
+        with self._write_lock():
+            # Tombstone first: a crash before the journal write only leaves a
+            # vector that searches skip and the next compaction drops
+            found, vector_ids = self.notes.mark_deleted(note_id)
+            if vector_ids:
+                self._append_journal({'op': 'remove', 'vector_ids': vector_ids})
+                for vector_id in vector_ids:
+                    self._remove_vector(vector_id)
+                if self._rebuild_deletions is not None:
+                    self._rebuild_deletions.extend(vector_ids)
+            return found
     
     def update_note(self, note_id, note_content, note_data):
         """
@@ -162,27 +630,167 @@ class DoctorNotesVectorStore:
             note_data: New metadata
         
         Returns:
-            The new index position or None if original not found
+            The new version's vector ID or None if original not found
         """
-        # Mark old note as deleted
-        if self.delete_note(note_id):
-            # Add new version
-            note_data['id'] = note_id
-            note_data['updated_at'] = datetime.utcnow().isoformat()
-            return self.add_note(note_content, note_data)
-        return None
+        with self._write_lock():
+            # Mark old note as deleted
+            if self.delete_note(note_id):
+                # Add new version
+                note_data['id'] = note_id
+                note_data['updated_at'] = datetime.utcnow().isoformat()
+                return self.add_note(note_content, note_data)
+            return None
     
-    def _save(self):
-        """Save the FAISS index and metadata to disk."""
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(self.index_path) if os.path.dirname(self.index_path) else '.', exist_ok=True)
+    def _schedule_maintenance(self):
+        """Start background maintenance unless it is already running."""
+        if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+            return
+        self._maintenance_thread = threading.Thread(target=self._run_maintenance, daemon=True)
+        self._maintenance_thread.start()
+    
+    def _run_maintenance(self):
+        """Promote or rebuild the index if due, otherwise checkpoint the journal."""
+        try:
+            with self._lock:
+                ntotal = self.index.ntotal
+                live = ntotal - len(self._stale_vector_ids)
+                promote = index_kind(self.index) == 'flat' and target_index_kind(live) != 'flat'
+                rebuild = len(self._stale_vector_ids) > STALE_REBUILD_FRACTION * max(ntotal, 1)
+            if promote or rebuild:
+                self.compact()
+            else:
+                self.checkpoint()
+        except Exception as e:
+            print(f"Error during doctor notes store maintenance: {str(e)}")
+    
+    def checkpoint(self, force=False):
+        """
+        Fold the journal into a new index snapshot.
+        
+        The index is serialized and the live journal rotated aside under the
+        write lock; the snapshot is then written without blocking readers or
+        writers, via an atomic rename.
         
-        # Save FAISS index
-        faiss.write_index(self.index, self.index_path)
+        Args:
+            force: Write a snapshot even if the journal is empty
         
-        # Save metadata
-        with open(self.metadata_path, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        Returns:
+            True if a snapshot was written
+        """
+        with self._maintenance_lock:
+            with self._write_lock():
+                if (not force and self._seq == self.notes.get_state('snapshot_seq', 0)
+                        and not os.path.exists(self._rotated_journal_path)):
+                    return False
+                
+                index_bytes = faiss.serialize_index(self.index).tobytes()
+                seq = self._seq
+                index_recall = self._index_recall
+                self._rotate_journal()
+            
+            # A crash before the state update below only means replaying
+            # records the snapshot already holds, which is idempotent
+            _atomic_write(self.index_path, index_bytes)
+            
+            with self._write_lock():
+                self.notes.set_state('snapshot_seq', seq)
+                self.notes.set_state('index_recall', index_recall)
+                # Everything in the rotated segment is now part of the snapshot;
+                # other processes have read it or will find the gap and reload
+                if os.path.exists(self._rotated_journal_path):
+                    os.remove(self._rotated_journal_path)
+            return True
+    
+    def compact(self):
+        """
+        Drop tombstoned notes and rebuild the FAISS index from live vectors.
+        
+        The new index uses the kind suited to the live corpus size, which is
+        how a flat index gets promoted to HNSW/IVF-PQ. It is built outside
+        the write lock; notes added or deleted meanwhile (by any process) are
+        applied before it is swapped in. The result is persisted as a fresh
+        snapshot under a new generation, which other processes reload.
+        
+        Note that IVF-PQ only stores compressed vectors, so rebuilding it
+        re-encodes the reconstructed (approximate) vectors.
+        
+        Returns:
+            Number of tombstoned notes removed
+        """
+        with self._maintenance_lock:
+            with self._write_lock():
+                vector_ids = np.array([
+                    vector_id for vector_id in self.notes.live_vector_ids()
+                    if self._index_contains(vector_id)
+                ], dtype='int64')
+                vectors = self._reconstruct(vector_ids)
+                self._rebuild_additions = []
+                self._rebuild_deletions = []
+            
+            try:
+                kind = target_index_kind(len(vector_ids))
+                index = build_index(kind, self.dimension, vectors, vector_ids)
+                recall = estimate_recall(index, vectors, vector_ids) if kind != 'flat' else None
+            except Exception:
+                with self._lock:
+                    self._rebuild_additions = None
+                    self._rebuild_deletions = None
+                raise
+            
+            # Taking the write lock replays other processes' writes into the
+            # rebuild lists
+            with self._write_lock():
+                # Catch up on notes added while the new index was being built
+                added = [v for v in self._rebuild_additions if self._index_contains(v)]
+                if added:
+                    index.add_with_ids(self._reconstruct(added), np.array(added, dtype='int64'))
+                
+                # ... and on deletions, whose vectors may be in the new index
+                deleted_during_build = set(self._rebuild_deletions)
+                self._rebuild_additions = None
+                self._rebuild_deletions = None
+                
+                self.index = index
+                self._index_recall = recall
+                self._stale_vector_ids = set()
+                for vector_id in deleted_during_build:
+                    self._remove_vector(vector_id)
+                
+                # Keep only the tombstones whose vectors are still indexed
+                removed = self.notes.purge_deleted(keep_vector_ids=self._stale_vector_ids)
+                
+                # The snapshot holds every journaled write, so the journal restarts
+                _atomic_write(self.index_path, faiss.serialize_index(self.index).tobytes())
+                self.notes.set_state('snapshot_seq', self._seq)
+                self.notes.set_state('index_recall', recall)
+                self._generation += 1
+                self.notes.set_state('generation', self._generation)
+                for path in (self._rotated_journal_path, self.journal_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._journal_cursor = (None, 0)
+        
+        return removed
+    
+    def _reconstruct(self, vector_ids):
+        """Stored vectors for the given IDs as a float32 (n, dimension) array."""
+        if len(vector_ids) == 0:
+            return np.empty((0, self.dimension), dtype='float32')
+        return np.vstack([self.index.reconstruct(int(vector_id)) for vector_id in vector_ids])
+    
+    def _rotate_journal(self):
+        """Move the live journal aside so new writes start a fresh segment."""
+        if not os.path.exists(self.journal_path):
+            return
+        if os.path.exists(self._rotated_journal_path):
+            # Left over from an interrupted checkpoint: keep both segments
+            with open(self.journal_path, 'rb') as src, open(self._rotated_journal_path, 'ab') as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self._rotated_journal_path)
     
     def get_stats(self):
         """
@@ -191,11 +799,67 @@ class DoctorNotesVectorStore:
         Returns:
             Dictionary with stats
         """
-        active_notes = [n for n in self.metadata if not n.get('deleted', False)]
+        total_notes, active_notes = self.notes.counts()
+        kind = index_kind(self.index)
+        latencies = sorted(self._search_latencies)
         return {
-            'total_notes': len(self.metadata),
-            'active_notes': len(active_notes),
-            'deleted_notes': len(self.metadata) - len(active_notes),
+            'total_notes': total_notes,
+            'active_notes': active_notes,
+            'deleted_notes': total_notes - active_notes,
             'index_size': self.index.ntotal,
-            'dimension': self.dimension
+            'index_type': kind,
+            'stale_vectors': len(self._stale_vector_ids),
+            'dimension': self.dimension,
+            'journal_records': self._seq - self.notes.get_state('snapshot_seq', 0),
+            'generation': self._generation,
+            'embedding_cache': get_cache_stats(),
+            # Measured against exact search when the index was last built
+            'estimated_recall_at_10': 1.0 if kind == 'flat' else self._index_recall,
+            'search_latency_ms': {
+                'samples': len(latencies),
+                'p50': round(latencies[len(latencies) // 2], 3) if latencies else None,
+                'p95': round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None
+            }
         }
+
+
+def _record_seq(line):
+    """Sequence number of a complete journal line, or None."""
+    try:
+        return json.loads(line)['seq'] if line.endswith(b'\n') else None
+    except ValueError:
+        return None
+
+
+def _atomic_write(path, data):
+    """Write `data` to `path` so readers only ever see the old or new file."""
+    os.makedirs(os.path.dirname(path) if os.path.dirname(path) else '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Process-wide registry of vector stores, keyed by their backing files
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(index_path=DEFAULT_INDEX_PATH, db_path=DEFAULT_DB_PATH):
+    """
+    Get the shared DoctorNotesVectorStore for the given files.
+    
+    The store is created once per process and refreshed with other
+    processes' writes on every call (see DoctorNotesVectorStore.refresh).
+    """
+    key = (os.path.abspath(index_path), os.path.abspath(db_path))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = DoctorNotesVectorStore(index_path, db_path)
+            _stores[key] = store
+            return store
+    store.refresh()
+    return store
@@ -0,0 +1,93 @@
+"""Process-wide shared sentence embedding model and embedding cache."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIMENSION = 384  # all-MiniLM-L6-v2 embedding dimension
+
+# Texts per forward pass when encoding in bulk
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+# Number of embeddings kept in the LRU cache
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '4096'))
+
+_model = None
+_model_lock = threading.Lock()
+
+_cache = OrderedDict()  # (sha256 of text, normalized) -> float32 embedding
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_embedding_model():
+    """
+    Lazily load the shared SentenceTransformer model.
+
+    The model is loaded at most once per process and reused by the doctor
+    notes vector store and the medical report agents.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+    return _model
+
+
+def encode_texts(texts, normalize=False, batch_size=None):
+    """
+    Embed texts with the shared model, reusing cached embeddings.
+
+    Cache misses are encoded together in batches of `batch_size`, so bulk
+    ingestion costs a handful of forward passes instead of one per text.
+
+    Args:
+        texts: List of strings
+        normalize: L2-normalize the embeddings
+        batch_size: Texts per forward pass (defaults to EMBEDDING_BATCH_SIZE)
+
+    Returns:
+        float32 array of shape (len(texts), EMBEDDING_DIMENSION)
+    """
+    keys = [(hashlib.sha256(text.encode('utf-8')).hexdigest(), normalize) for text in texts]
+    embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype='float32')
+
+    missing = {}  # key -> indices into texts
+    with _cache_lock:
+        for i, key in enumerate(keys):
+            cached = _cache.get(key)
+            if cached is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                _cache.move_to_end(key)
+                embeddings[i] = cached
+        _cache_stats['hits'] += len(texts) - sum(len(indices) for indices in missing.values())
+        _cache_stats['misses'] += len(missing)
+
+    if missing:
+        # Duplicate texts within a call are encoded once
+        encoded = get_embedding_model().encode(
+            [texts[indices[0]] for indices in missing.values()],
+            batch_size=batch_size or EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=normalize
+        )
+        encoded = np.asarray(encoded, dtype='float32')
+        with _cache_lock:
+            for (key, indices), embedding in zip(missing.items(), encoded):
+                embeddings[indices] = embedding
+                _cache[key] = embedding
+                _cache.move_to_end(key)
+            while len(_cache) > EMBEDDING_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return embeddings
+
+
+def get_cache_stats():
+    """Hit/miss counters and current size of the embedding cache."""
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache), max_size=EMBEDDING_CACHE_SIZE)
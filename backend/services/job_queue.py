@@ -0,0 +1,297 @@
+"""
+Background jobs for long-running imaging work (study conversion, AI analysis).
+
+A job is a row in the jobs table: the request that creates it returns at
+once with the job's id, and clients follow it with GET /api/jobs/<id> (or
+its server-sent event stream). Jobs run on a per-process thread pool;
+CPU-bound conversion work is handed on to a shared process pool, so it
+neither holds the GIL nor blocks the threads serving requests.
+
+Handlers report progress through JobContext.update(), which raises
+JobCancelled once cancellation has been requested, so a running job stops
+at its next progress step. All state is in the database, so any web worker
+can report on or cancel a job started by another.
+
+Jobs live in the queue of the process that created them. Each process
+stamps heartbeat_at on its queued and running jobs every
+JOB_HEARTBEAT_SECONDS, and fails those of any process (itself before a
+restart included) that stopped reporting for JOB_STALE_SECONDS, so a crash
+or redeploy never leaves a job queued or running forever.
+
+Conversion workers are spawned, which re-runs the main module in each of
+them: start the server with server.py, which imports nothing in workers.
+Started as "python app.py", every worker would load the whole application
+(models, AI libraries) before converting anything.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from extensions import db
+from models.job import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_WORKERS = int(os.getenv('JOB_QUEUE_WORKERS', '2'))
+# Processes for CPU-bound steps; 0 means one per core
+JOB_PROCESS_WORKERS = int(os.getenv('JOB_PROCESS_WORKERS', '0'))
+JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', '30'))
+# Unfinished jobs whose process has not reported for this long are failed as interrupted
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '120'))
+INTERRUPTED_ERROR = 'Interrupted: the server process running this job stopped before it finished'
+
+# Unique per process, and per restart of a process that keeps its host name and pid (e.g. pid 1 in a container)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_executor = None
+_monitor = None
+_process_pool = None
+_executor_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled"""
+
+
+class JobContext:
+    """Handle a running job's handler uses to report progress"""
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+    
+    def update(self, progress, message=None):
+        """
+        Record progress and check for cancellation.
+        
+        Args:
+            progress: Fraction done, 0 to 1
+            message: Current step, for display
+        
+        Raises:
+            JobCancelled: If the job has been cancelled
+        """
+        Job.query.filter_by(id=self.job_id).update(
+            {'progress': min(max(float(progress), 0.0), 1.0), 'message': message, 'heartbeat_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if db.session.query(Job.cancel_requested).filter_by(id=self.job_id).scalar():
+            raise JobCancelled()
+
+
+def enqueue_job(app, job_type, params, user_id=None):
+    """
+    Create a job and run it in the background.
+    
+    Args:
+        app: The Flask app, for the job's application context
+        job_type: A key of JOB_HANDLERS
+        params: JSON-serializable arguments of the handler
+        user_id: The user who started the job
+    
+    Returns:
+        The committed Job
+    """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    job = Job(job_type=job_type, params=json.dumps(params), user_id=user_id, message='Queued',
+              worker_id=WORKER_ID, heartbeat_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    
+    start_job_queue(app)
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_QUEUE_WORKERS, thread_name_prefix='job-queue')
+    _executor.submit(_run_job, app, job.id)
+    return job
+
+
+def cancel_job(job_id):
+    """
+    Cancel a job: a queued job is cancelled at once, a running one at its next progress step.
+    
+    Returns:
+        The Job, or None if it does not exist
+    """
+    now = datetime.utcnow()
+    cancelled = Job.query.filter_by(id=job_id, status='queued').update(
+        {'status': 'cancelled', 'cancel_requested': True, 'message': 'Cancelled', 'finished_at': now},
+        synchronize_session=False
+    )
+    if not cancelled:
+        Job.query.filter_by(id=job_id, status='running').update(
+            {'cancel_requested': True, 'message': 'Cancelling'}, synchronize_session=False
+        )
+    db.session.commit()
+    return db.session.get(Job, job_id, populate_existing=True)
+
+
+def start_job_queue(app):
+    """
+    Start this process's job monitor (once): it keeps this process's jobs'
+    heartbeats current and fails jobs interrupted elsewhere or by a restart.
+    
+    Args:
+        app: The Flask app, for the monitor's application context
+    """
+    global _monitor
+    with _executor_lock:
+        if _monitor is not None and _monitor.is_alive():
+            return
+        _monitor = threading.Thread(target=_run_monitor, args=(app,), name='job-monitor', daemon=True)
+        _monitor.start()
+
+
+def _run_monitor(app):
+    while True:
+        with app.app_context():
+            try:
+                record_heartbeat()
+                recover_interrupted_jobs()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"Error in job monitor: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+
+
+def record_heartbeat():
+    """Mark this process's unfinished jobs as alive (needs an app context)"""
+    Job.query.filter(Job.worker_id == WORKER_ID, Job.status.in_(('queued', 'running'))).update(
+        {'heartbeat_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def recover_interrupted_jobs():
+    """
+    Fail unfinished jobs whose process stopped reporting (needs an app context).
+    
+    Returns:
+        The number of jobs failed
+    """
+    now = datetime.utcnow()
+    interrupted = Job.query.filter(
+        Job.status.in_(('queued', 'running')),
+        db.func.coalesce(Job.heartbeat_at, Job.created_at) < now - timedelta(seconds=JOB_STALE_SECONDS)
+    ).update(
+        {'status': 'failed', 'message': 'Interrupted', 'error': INTERRUPTED_ERROR, 'finished_at': now},
+        synchronize_session=False
+    )
+    db.session.commit()
+    if interrupted:
+        logger.warning(f"Failed {interrupted} interrupted job(s)")
+    return interrupted
+
+
+def get_process_pool():
+    """The process pool shared by CPU-bound job steps"""
+    global _process_pool
+    with _executor_lock:
+        # A pool whose worker died (e.g. killed for memory) fails every later submit; start a new one
+        if _process_pool is None or _process_pool._broken:
+            # Spawned, not forked: the web process has threads (and locks) that must not be copied
+            _process_pool = ProcessPoolExecutor(
+                max_workers=JOB_PROCESS_WORKERS or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        try:
+            run_job(job_id)
+        except Exception as e:
+            logger.exception(f"Error running job {job_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def run_job(job_id):
+    """
+    Run a queued job to completion (needs an app context).
+    
+    The row is claimed by moving it from queued to running, so a job is only
+    run once, and a job cancelled while queued is not run at all.
+    
+    Returns:
+        The job's final status, or None if it was not claimed
+    """
+    claimed = Job.query.filter_by(id=job_id, status='queued').update(
+        {'status': 'running', 'started_at': datetime.utcnow(), 'message': 'Started'},
+        synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        return None
+    
+    job = db.session.get(Job, job_id)
+    handler = JOB_HANDLERS[job.job_type]
+    params = json.loads(job.params) if job.params else {}
+    outcome = {'finished_at': None}
+    try:
+        result = handler(JobContext(job_id), **params)
+        outcome.update(status='completed', progress=1.0, message='Completed', result=json.dumps(result))
+    except JobCancelled:
+        db.session.rollback()
+        outcome.update(status='cancelled', message='Cancelled')
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Job {job_id} ({job.job_type}) failed: {e}")
+        outcome.update(status='failed', message='Failed', error=str(e))
+    
+    outcome['finished_at'] = datetime.utcnow()
+    Job.query.filter_by(id=job_id).update(outcome, synchronize_session=False)
+    db.session.commit()
+    return outcome['status']
+
+
+def _convert_study(job, study_id):
+    """Convert a study's DICOM series to NIfTI, in the shared process pool"""
+    from services.radiology.radiology_service import RadiologyService
+    
+    job.update(0.0, 'Converting series')
+    files = RadiologyService.convert_study_to_nifti(
+        study_id,
+        executor=get_process_pool(),
+        progress=lambda done, total: job.update(done / total, f"Converted {done} of {total} series")
+    )
+    return {'files': files}
+
+
+def _analyze_study(job, study_id, modality, model_id):
+    """Run an AI model on the middle image of a study"""
+    from services.radiology.radiology_service import RadiologyService
+    from services.radiology.ai_segmentation_service import AISegmentationService
+    
+    images = RadiologyService.get_study_images(study_id)
+    if not images:
+        raise ValueError('No images found for study')
+    # In a real scenario, we might analyze the whole series or a specific slice
+    target_image = images[len(images) // 2]
+    
+    job.update(0.1, f"Running {model_id}")
+    results = AISegmentationService.analyze_image(target_image.file_path, modality, model_id)
+    return {
+        'results': results,
+        'model_id': model_id,
+        'analyzed_image_id': target_image.id
+    }
+
+
+# job_type -> handler(JobContext, **params) returning the JSON-serializable result
+JOB_HANDLERS = {
+    'nifti_conversion': _convert_study,
+    'ai_analysis': _analyze_study
+}
@@ -3,11 +3,27 @@ import os
 from typing import Dict, Any, List
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import json
 
+from services.embedding_service import encode_texts
+
+
+class SharedEmbeddings(Embeddings):
+    """LangChain embeddings backed by the process-wide SentenceTransformer."""
+    
+    def __init__(self, normalize_embeddings: bool = True):
+        self.normalize_embeddings = normalize_embeddings
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        embeddings = encode_texts(list(texts), normalize=self.normalize_embeddings)
+        return embeddings.tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
 
 class MedicalReportAgent:
     """Agentic system for analyzing medical reports."""
@@ -20,12 +36,8 @@ class MedicalReportAgent:
             model=model,
             temperature=0.0
         )
-        # Use HuggingFace embeddings (works locally without API keys)
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Local all-MiniLM-L6-v2 embeddings, shared process-wide (no API keys needed)
+        self.embeddings = SharedEmbeddings(normalize_embeddings=True)
         
     def analyze_report(self, report_text: str) -> Dict[str, Any]:
         """
@@ -141,12 +153,8 @@ class ReportChatAgent:
             model=model,
             temperature=0.3
         )
-        # Use HuggingFace embeddings (works locally without API keys)
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Local all-MiniLM-L6-v2 embeddings, shared process-wide (no API keys needed)
+        self.embeddings = SharedEmbeddings(normalize_embeddings=True)
         self.vector_stores = {}  # Cache vector stores by report ID
         
     def create_vector_store(self, report_id: str, report_text: str, analysis: Dict[str, Any]) -> str:
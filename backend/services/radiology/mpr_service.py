@@ -0,0 +1,456 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import nibabel as nib
+import numpy as np
+import pydicom
+from PIL import Image
+
+from utils.nifti_processor import NiftiProcessor
+from utils.render_cache import RenderCache, encode_array, encode_image
+from utils.windowing import window_to_uint8
+
+logger = logging.getLogger(__name__)
+
+# Bound of the volumes (all pyramid levels included) kept in memory per process
+MPR_CACHE_BYTES = int(os.getenv('MPR_CACHE_BYTES', str(1024 * 1024 * 1024)))
+
+# Pyramid levels are each half the resolution of the previous; stop at this level or this size
+MAX_PYRAMID_LEVEL = 3
+PYRAMID_MIN_SIZE = 64
+
+MAX_OUTPUT_SIZE = 1024  # Pixels per side of an oblique plane
+MAX_SLAB_SAMPLES = 128  # Planes sampled across a thick slab
+
+# Plane name -> (axis along the normal, (in-plane axis shown horizontally, in-plane axis shown vertically))
+PLANES = {
+    'sagittal': (0, (1, 2)),
+    'coronal': (1, (0, 2)),
+    'axial': (2, (0, 1))
+}
+PROJECTIONS = ('mip', 'minip', 'avg')
+
+
+class Volume:
+    """
+    A volume held in memory for reformatting.
+    
+    Voxels keep their stored dtype and are rescaled on output. They are laid
+    out (x, y, z) as in NIfTI voxel space, so rot90 of an axial slice
+    [:, :, k] displays it the way NiftiProcessor does; DICOM series are
+    rearranged to match. levels[n] is (voxels, spacing, origin) of the volume
+    downsampled 2^n times, where spacing is mm per voxel along each axis and
+    origin the position in mm of voxel 0's center relative to level 0's.
+    """
+    
+    def __init__(self, data: np.ndarray, spacing, slope: float = 1.0, intercept: float = 0.0):
+        spacing = tuple(float(s) if s and s > 0 else 1.0 for s in spacing)
+        self.levels = [(np.ascontiguousarray(data), spacing, (0.0, 0.0, 0.0))]
+        while len(self.levels) <= MAX_PYRAMID_LEVEL and max(self.levels[-1][0].shape) > PYRAMID_MIN_SIZE:
+            self.levels.append(_downsample(*self.levels[-1]))
+        self.slope = float(slope)
+        self.intercept = float(intercept)
+        self.nbytes = sum(voxels.nbytes for voxels, _, _ in self.levels)
+    
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.levels[0][0].shape
+    
+    def describe(self) -> Dict[str, Any]:
+        """Shape and spacing of each pyramid level"""
+        return {
+            'shape': list(self.shape),
+            'spacing': list(self.levels[0][1]),
+            'levels': [{'shape': list(voxels.shape), 'spacing': list(spacing)} for voxels, spacing, _ in self.levels]
+        }
+
+
+def _downsample(voxels: np.ndarray, spacing, origin):
+    """Next pyramid level: 2x2x2 block means (axes of size 1 are kept), in the stored dtype"""
+    factors = [2 if size > 1 else 1 for size in voxels.shape]
+    shape = tuple(size // factor for size, factor in zip(voxels.shape, factors))
+    total = np.zeros(shape, dtype=np.float32)
+    for dx in range(factors[0]):
+        for dy in range(factors[1]):
+            for dz in range(factors[2]):
+                total += voxels[dx::factors[0], dy::factors[1], dz::factors[2]][:shape[0], :shape[1], :shape[2]]
+    total /= factors[0] * factors[1] * factors[2]
+    if voxels.dtype.kind in 'iub':
+        np.rint(total, out=total)
+    return (
+        total.astype(voxels.dtype),
+        tuple(s * f for s, f in zip(spacing, factors)),
+        tuple(o + (f - 1) / 2 * s for o, s, f in zip(origin, spacing, factors))
+    )
+
+
+class VolumeCache:
+    """LRU cache of Volumes bounded by their total size in bytes"""
+    
+    def __init__(self, max_bytes: int = MPR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._volumes = OrderedDict()  # key -> Volume, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock held while that volume loads, so it loads once
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'load_seconds': 0.0}
+    
+    def get_or_load(self, key: str, load: Callable[[], Volume]) -> Volume:
+        """
+        Return the cached volume for a key, loading it on a miss.
+        
+        Concurrent requests for a volume that is loading wait for that load
+        instead of starting their own.
+        """
+        with self._lock:
+            volume = self._lookup(key)
+            if volume is not None:
+                return volume
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            with self._lock:
+                volume = self._lookup(key)
+                if volume is not None:
+                    return volume
+            started = time.perf_counter()
+            try:
+                volume = load()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+            with self._lock:
+                self._stats['misses'] += 1
+                self._stats['load_seconds'] += time.perf_counter() - started
+                self._store(key, volume)
+            return volume
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and cache size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._volumes)
+            stats['bytes'] = self._size
+            stats['max_bytes'] = self.max_bytes
+        return stats
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._volumes.clear()
+            self._size = 0
+    
+    def _lookup(self, key: str) -> Optional[Volume]:
+        volume = self._volumes.get(key)
+        if volume is not None:
+            self._volumes.move_to_end(key)
+            self._stats['hits'] += 1
+        return volume
+    
+    def _store(self, key: str, volume: Volume) -> None:
+        if volume.nbytes > self.max_bytes:
+            logger.warning(f"Volume of {volume.nbytes} bytes exceeds MPR_CACHE_BYTES, not cached")
+            return
+        self._volumes[key] = volume
+        self._size += volume.nbytes
+        while self._size > self.max_bytes:
+            _, evicted = self._volumes.popitem(last=False)
+            self._size -= evicted.nbytes
+            self._stats['evictions'] += 1
+
+
+_volume_cache = VolumeCache()
+
+
+class MprService:
+    """Multi-planar reconstruction of NIfTI volumes and DICOM series"""
+    
+    @staticmethod
+    def nifti_volume_key(file_path: str) -> str:
+        """Volume cache key of a NIfTI file; changes when the file does"""
+        return RenderCache.make_key(file_path, 'volume')
+    
+    @staticmethod
+    def series_volume_key(dicom_files: List[Any]) -> str:
+        """Volume cache key of a DICOM series (its DicomFiles in spatial order)"""
+        return RenderCache.make_key(dicom_files[0].file_path, 'volume', *(f.id for f in dicom_files))
+    
+    @staticmethod
+    def get_nifti_volume(file_path: str) -> Volume:
+        """The volume of a NIfTI file, from the volume cache"""
+        return _volume_cache.get_or_load(
+            MprService.nifti_volume_key(file_path),
+            lambda: MprService._load_nifti(file_path)
+        )
+    
+    @staticmethod
+    def get_series_volume(dicom_files: List[Any]) -> Volume:
+        """
+        The volume of a DICOM series, from the volume cache.
+        
+        Args:
+            dicom_files: The series' DicomFiles in spatial order (RadiologyService.get_series_images)
+        """
+        paths = [f.file_path for f in dicom_files]
+        return _volume_cache.get_or_load(
+            MprService.series_volume_key(dicom_files),
+            lambda: MprService._load_dicom_series(paths)
+        )
+    
+    @staticmethod
+    def get_cache_stats() -> Dict[str, Any]:
+        return _volume_cache.get_stats()
+    
+    @staticmethod
+    def reformat(volume: Volume, plane: str = 'axial', index: Optional[int] = None,
+                 tilt_x: float = 0.0, tilt_y: float = 0.0, thickness: float = 0.0,
+                 projection: str = 'mip', level: int = 0) -> Tuple[np.ndarray, float, float, float]:
+        """
+        Sample a plane (or a thick slab) of a volume.
+        
+        The plane starts as an orthogonal plane through slice `index` and is
+        then tilted about its horizontal (tilt_x) and vertical (tilt_y) axes,
+        around the point where that slice meets the volume's center line.
+        Untilted planes with square pixels are sliced directly; others are
+        resampled with trilinear interpolation on a grid of square pixels.
+        
+        Args:
+            volume: From get_nifti_volume() or get_series_volume()
+            plane: 'axial', 'coronal' or 'sagittal'
+            index: Slice along the plane's normal axis at full resolution, or None for the middle
+            tilt_x: Degrees of rotation about the plane's horizontal axis
+            tilt_y: Degrees of rotation about the plane's vertical axis
+            thickness: Slab thickness in mm; 0 for a single plane
+            projection: How a slab is combined: 'mip', 'minip' or 'avg'
+            level: Pyramid level; each level halves the resolution (clamped to the coarsest)
+        
+        Returns:
+            (2D image in display orientation, rescale slope, rescale intercept,
+            pixel spacing in mm). Pixel values are rescaled with the slope and
+            intercept; resampled planes are already rescaled (slope 1, intercept 0).
+        """
+        if plane not in PLANES:
+            raise ValueError(f"plane must be one of {', '.join(PLANES)}")
+        if projection not in PROJECTIONS:
+            raise ValueError(f"projection must be one of {', '.join(PROJECTIONS)}")
+        if thickness < 0:
+            raise ValueError('thickness must not be negative')
+        normal_axis, (u_axis, v_axis) = PLANES[plane]
+        full_spacing = volume.levels[0][1]
+        if index is None:
+            index = volume.shape[normal_axis] // 2
+        if not 0 <= index < volume.shape[normal_axis]:
+            raise ValueError(f"index must be in [0, {volume.shape[normal_axis]}) for the {plane} plane")
+        
+        voxels, spacing, origin = volume.levels[min(max(level, 0), len(volume.levels) - 1)]
+        # Center of rotation in mm: the requested slice, centered in the other two axes
+        center = np.array([(size - 1) / 2 * s for size, s in zip(volume.shape, full_spacing)])
+        center[normal_axis] = index * full_spacing[normal_axis]
+        
+        if not tilt_x and not tilt_y and spacing[u_axis] == spacing[v_axis]:
+            image, slope, intercept = MprService._orthogonal_slab(
+                volume, voxels, spacing, origin, normal_axis, center[normal_axis], thickness, projection
+            )
+            return np.rot90(image), slope, intercept, spacing[u_axis]
+        
+        # Plane axes: rotate the orthogonal frame about u (tilt_x), then about the new v (tilt_y)
+        u, v, n = np.eye(3)[u_axis], np.eye(3)[v_axis], np.eye(3)[normal_axis]
+        a, b = np.radians(tilt_x), np.radians(tilt_y)
+        v, n = np.cos(a) * v + np.sin(a) * n, -np.sin(a) * v + np.cos(a) * n
+        u, n = np.cos(b) * u - np.sin(b) * n, np.sin(b) * u + np.cos(b) * n
+        
+        # Cover the whole volume's outline projected on the plane, with square pixels
+        pixel_spacing = min(spacing)
+        corners = np.array([[o + c * (size - 1) * s for o, size, s, c in zip(origin, voxels.shape, spacing, bits)]
+                            for bits in np.ndindex(2, 2, 2)]) - center
+        u_range = corners @ u
+        v_range = corners @ v
+        extent = max(np.ptp(u_range), np.ptp(v_range))
+        pixel_spacing = max(pixel_spacing, extent / (MAX_OUTPUT_SIZE - 1))
+        grid_u = u_range.min() + np.arange(int(np.ptp(u_range) / pixel_spacing) + 1) * pixel_spacing
+        grid_v = v_range.min() + np.arange(int(np.ptp(v_range) / pixel_spacing) + 1) * pixel_spacing
+        points = center + grid_u[:, None, None] * u + grid_v[None, :, None] * v
+        # mm -> voxel coordinates of this level
+        points = ((points - np.array(origin)) / np.array(spacing)).astype(np.float32)
+        
+        samples = min(MAX_SLAB_SAMPLES, int(round(thickness / min(spacing))) + 1) if thickness else 1
+        offsets = np.linspace(-thickness / 2, thickness / 2, samples) if samples > 1 else [0.0]
+        step = (n / np.array(spacing)).astype(np.float32)
+        result = None
+        count = None
+        for offset in offsets:
+            values = _trilinear(voxels, points + np.float32(offset) * step)
+            values *= np.float32(volume.slope)
+            values += np.float32(volume.intercept)
+            if result is None:
+                result = values
+                count = (~np.isnan(values)).astype(np.float32) if projection == 'avg' else None
+            elif projection == 'mip':
+                np.fmax(result, values, out=result)
+            elif projection == 'minip':
+                np.fmin(result, values, out=result)
+            else:
+                count += ~np.isnan(values)
+                np.add(np.nan_to_num(result), np.nan_to_num(values), out=result)
+        if projection == 'avg' and len(offsets) > 1:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result /= count  # 0/0 leaves points outside the volume as NaN
+        return np.rot90(result), 1.0, 0.0, float(pixel_spacing)
+    
+    @staticmethod
+    def render(volume: Volume, image_format: str = 'png', window_center: Optional[float] = None,
+               window_width: Optional[float] = None, **plane: Any) -> bytes:
+        """
+        Reformat and encode a plane.
+        
+        Args:
+            volume: The volume
+            image_format: 'png', 'jpeg', 'webp', or 'raw' for the rescaled values (.npy)
+            window_center: Window center in rescaled units, or None to auto-normalize
+            window_width: Window width in rescaled units, or None to auto-normalize
+            plane: Keyword arguments of reformat()
+        
+        Returns:
+            Encoded image bytes
+        """
+        image, slope, intercept, _ = MprService.reformat(volume, **plane)
+        if image_format == 'raw':
+            if slope != 1 or intercept != 0:
+                image = image.astype(np.float32) * np.float32(slope) + np.float32(intercept)
+            return encode_array(image)
+        windowed = window_to_uint8(image, window_center, window_width, slope, intercept)
+        return encode_image(Image.fromarray(windowed, 'L'), image_format)[0]
+    
+    @staticmethod
+    def _orthogonal_slab(volume, voxels, spacing, origin, axis, position, thickness, projection):
+        """Slices around a position (mm) along an axis, combined; (image, slope, intercept)"""
+        center = int(round((position - origin[axis]) / spacing[axis]))
+        center = min(max(center, 0), voxels.shape[axis] - 1)
+        half = int(round(thickness / 2 / spacing[axis]))
+        indexes = range(max(center - half, 0), min(center + half, voxels.shape[axis] - 1) + 1)
+        if len(indexes) == 1:
+            return voxels.take(center, axis=axis), volume.slope, volume.intercept
+        
+        slab = voxels.take(indexes, axis=axis)
+        if projection == 'avg':
+            return slab.mean(axis=axis, dtype=np.float32), volume.slope, volume.intercept
+        # A negative slope reverses which stored value is brightest
+        brightest = (projection == 'mip') == (volume.slope >= 0)
+        image = slab.max(axis=axis) if brightest else slab.min(axis=axis)
+        return image, volume.slope, volume.intercept
+    
+    @staticmethod
+    def _load_nifti(file_path: str) -> Volume:
+        img = NiftiProcessor.load_nifti(file_path)
+        proxy = img.dataobj
+        if nib.is_proxy(proxy):
+            voxels = proxy.get_unscaled()
+            slope, intercept = proxy.slope, proxy.inter
+        else:
+            voxels, slope, intercept = np.asanyarray(proxy), 1.0, 0.0
+        if voxels.ndim > 3:
+            voxels = voxels[..., 0]  # First volume of a time series
+        if voxels.ndim == 2:
+            voxels = voxels[..., None]
+        logger.debug(f"Loading NIfTI volume {file_path} {voxels.shape} for MPR")
+        return Volume(np.array(voxels), img.header.get_zooms()[:3], slope, intercept)
+    
+    @staticmethod
+    def _load_dicom_series(file_paths: List[str]) -> Volume:
+        """Stack a spatially ordered series (or one multi-frame file) into a volume"""
+        datasets = [pydicom.dcmread(path) for path in file_paths]
+        first = datasets[0]
+        if int(getattr(first, 'SamplesPerPixel', 1)) != 1:
+            raise ValueError('MPR needs grayscale images')
+        
+        slopes = {float(getattr(ds, 'RescaleSlope', 1) or 1) for ds in datasets}
+        intercepts = {float(getattr(ds, 'RescaleIntercept', 0) or 0) for ds in datasets}
+        uniform = len(slopes) == 1 and len(intercepts) == 1
+        frames = []
+        for ds in datasets:
+            pixels = ds.pixel_array
+            if not uniform:
+                pixels = pixels.astype(np.float32) * float(getattr(ds, 'RescaleSlope', 1) or 1) \
+                    + float(getattr(ds, 'RescaleIntercept', 0) or 0)
+            frames.extend(pixels if pixels.ndim == 3 else [pixels])
+        
+        rows, columns = frames[0].shape
+        voxels = np.empty((columns, rows, len(frames)), dtype=frames[0].dtype)
+        for k, frame in enumerate(frames):
+            if frame.shape != (rows, columns):
+                raise ValueError('All images of the series must have the same size')
+            # Columns along x, rows along y upwards, as NIfTI voxels are displayed
+            voxels[:, :, k] = frame[::-1, :].T
+        
+        pixel_spacing = [float(s) for s in getattr(first, 'PixelSpacing', None) or [1.0, 1.0]]
+        logger.debug(f"Loading DICOM volume {voxels.shape} for MPR")
+        return Volume(
+            voxels,
+            (pixel_spacing[1], pixel_spacing[0], MprService._slice_spacing(datasets)),
+            slopes.pop() if uniform else 1.0,
+            intercepts.pop() if uniform else 0.0
+        )
+    
+    @staticmethod
+    def _slice_spacing(datasets) -> float:
+        """Median distance between slices along the normal, else the spacing tags"""
+        orientation = getattr(datasets[0], 'ImageOrientationPatient', None)
+        if len(datasets) > 1 and orientation and all(getattr(ds, 'ImagePositionPatient', None) for ds in datasets):
+            normal = np.cross([float(x) for x in orientation[:3]], [float(x) for x in orientation[3:]])
+            positions = np.array([[float(x) for x in ds.ImagePositionPatient] for ds in datasets]) @ normal
+            gaps = np.abs(np.diff(positions))
+            if np.median(gaps) > 0:
+                return float(np.median(gaps))
+        for tag in ('SpacingBetweenSlices', 'SliceThickness'):
+            value = getattr(datasets[0], tag, None)
+            if value:
+                return abs(float(value))
+        return 1.0
+
+
+def _trilinear(voxels: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    Trilinear interpolation at voxel coordinates.
+    
+    Args:
+        voxels: C-contiguous 3D array
+        points: (..., 3) float32 voxel coordinates
+    
+    Returns:
+        float32 array of points' shape without the last axis; NaN outside the volume
+    """
+    inside = np.ones(points.shape[:-1], dtype=bool)
+    index = np.zeros(points.shape[:-1], dtype=np.intp)
+    fractions = []
+    steps = []
+    for axis, size in enumerate(voxels.shape):
+        coordinate = points[..., axis]
+        inside &= (coordinate >= 0) & (coordinate <= size - 1)
+        base = np.clip(np.floor(coordinate), 0, max(size - 2, 0)).astype(np.intp)
+        fractions.append(np.clip(coordinate - base, 0, 1))
+        stride = voxels.strides[axis] // voxels.itemsize
+        index += base * stride
+        steps.append(stride if size > 1 else 0)
+    
+    flat = voxels.reshape(-1)
+    
+    def corner(dx, dy, dz):
+        return flat.take(index + (dx * steps[0] + dy * steps[1] + dz * steps[2])).astype(np.float32)
+    
+    def lerp(low, high, fraction):
+        high -= low
+        high *= fraction
+        high += low
+        return high
+    
+    fx, fy, fz = fractions
+    result = lerp(
+        lerp(lerp(corner(0, 0, 0), corner(0, 0, 1), fz), lerp(corner(0, 1, 0), corner(0, 1, 1), fz), fy),
+        lerp(lerp(corner(1, 0, 0), corner(1, 0, 1), fz), lerp(corner(1, 1, 0), corner(1, 1, 1), fz), fy),
+        fx
+    )
+    result[~inside] = np.nan
+    return result
@@ -1,13 +1,25 @@
+import logging
 import os
+import shutil
 import uuid
+import zipfile
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from flask import current_app
+from sqlalchemy import func, select, update
 from extensions import db
 from models.medical import Study, DicomFile, Patient, NiftiFile
+from services.job_queue import get_process_pool
 from utils.dicom_processor import DicomProcessor
+from utils.dicom_nifti_converter import DicomNiftiConverter
+from utils.dicom_series_indexer import DicomSeriesIndexer
 from utils.nifti_processor import NiftiProcessor
 
+logger = logging.getLogger(__name__)
+
+# SOP Instance UIDs checked against the database per query
+SOP_LOOKUP_CHUNK_SIZE = 500
+
 class RadiologyService:
     @staticmethod
     def process_dicom_upload(file, patient_id=None):
@@ -36,38 +48,10 @@ class RadiologyService:
             
             # Handle Patient
             if not patient_id:
-                # Try to find patient by MRN or create new
-                mrn = metadata.get('patient_id', 'UNKNOWN')
-                patient = Patient.query.filter_by(mrn=mrn).first()
-                
-                if not patient:
-                    patient = Patient(
-                        name=metadata.get('patient_name', 'Unknown'),
-                        mrn=mrn,
-                        gender=metadata.get('patient_sex'),
-                        # Parse date if possible, else None
-                        date_of_birth=RadiologyService._parse_dicom_date(metadata.get('patient_birth_date'))
-                    )
-                    db.session.add(patient)
-                    db.session.flush() # Get ID
-                patient_id = patient.id
+                patient_id = RadiologyService._get_or_create_patient(metadata).id
             
             # Handle Study
-            study_uid = metadata.get('study_instance_uid')
-            study = Study.query.filter_by(study_instance_uid=study_uid).first()
-            
-            if not study:
-                study = Study(
-                    patient_id=patient_id,
-                    study_instance_uid=study_uid,
-                    study_date=RadiologyService._parse_dicom_date(metadata.get('study_date')),
-                    modality=metadata.get('modality', 'OT'),
-                    body_part=metadata.get('body_part_examined'),
-                    description=metadata.get('study_description'),
-                    accession_number=metadata.get('accession_number')
-                )
-                db.session.add(study)
-                db.session.flush()
+            study = RadiologyService._get_or_create_study(metadata, patient_id)
             
             # Create DicomFile record
             dicom_file = DicomFile(
@@ -85,11 +69,10 @@ class RadiologyService:
             )
             
             db.session.add(dicom_file)
+            db.session.flush()
             
             # Update study counts
-            study.instance_count = (study.instance_count or 0) + 1
-            # Recalculate series count (simplified)
-            # In a real app, we'd query distinct series_instance_uids
+            RadiologyService._refresh_study_counts([study.id])
             
             db.session.commit()
             
@@ -106,7 +89,180 @@ class RadiologyService:
             if os.path.exists(file_path):
                 os.remove(file_path)
             raise e
-
+    
+    @staticmethod
+    def process_dicom_bulk_upload(files, patient_id=None):
+        """
+        Ingest a whole study (or several) from one request.
+        
+        - Saves the uploaded files into one batch folder; ZIP archives are extracted.
+        - Reads all headers in parallel (DicomSeriesIndexer).
+        - Creates/Updates Patients and Studies.
+        - Inserts every DicomFile row with one bulk insert and recomputes the
+          study counts with SQL aggregates, all in a single transaction.
+        Files that are not DICOM, or whose SOP Instance UID is already stored,
+        are discarded.
+        """
+        batch_id = str(uuid.uuid4())
+        batch_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'dicom', batch_id)
+        os.makedirs(batch_dir, exist_ok=True)
+        
+        try:
+            file_paths = []
+            for i, file in enumerate(files):
+                file_path = os.path.join(batch_dir, f"{i:05d}_{secure_filename(file.filename) or 'file'}")
+                file.save(file_path)
+                if zipfile.is_zipfile(file_path):
+                    file_paths.extend(DicomSeriesIndexer.extract_zip(file_path, os.path.join(batch_dir, f"{i:05d}")))
+                    os.remove(file_path)
+                else:
+                    file_paths.append(file_path)
+            
+            # The shared spawn-based pool: forking this threaded web process is unsafe
+            index = DicomSeriesIndexer.index_files(file_paths, executor=get_process_pool())
+            for file_path in index['skipped']:
+                os.remove(file_path)
+            
+            # Skip instances that are already stored or repeated in the batch
+            instances = [i for study in index['studies'] for series in study['series'] for i in series['instances']]
+            sop_uids = [instance['sop_instance_uid'] for instance in instances]
+            seen = set()
+            for start in range(0, len(sop_uids), SOP_LOOKUP_CHUNK_SIZE):
+                chunk = sop_uids[start:start + SOP_LOOKUP_CHUNK_SIZE]
+                seen.update(uid for (uid,) in db.session.query(DicomFile.sop_instance_uid)
+                            .filter(DicomFile.sop_instance_uid.in_(chunk)))
+            
+            mappings = []
+            studies = []
+            duplicates = 0
+            for study_index in index['studies']:
+                new_instances = []
+                for series in study_index['series']:
+                    for instance in series['instances']:
+                        if instance['sop_instance_uid'] in seen:
+                            os.remove(instance['file_path'])
+                            duplicates += 1
+                            continue
+                        seen.add(instance['sop_instance_uid'])
+                        new_instances.append(instance)
+                if not new_instances:
+                    continue
+                
+                # Study-level fields plus the first series' modality and body part
+                metadata = dict(study_index['series'][0], **study_index)
+                study_patient_id = patient_id or RadiologyService._get_or_create_patient(metadata).id
+                study = RadiologyService._get_or_create_study(metadata, study_patient_id)
+                studies.append((study, len(new_instances)))
+                mappings.extend(RadiologyService._dicom_file_mapping(study.id, instance) for instance in new_instances)
+            
+            if not mappings:
+                shutil.rmtree(batch_dir, ignore_errors=True)
+            
+            db.session.bulk_insert_mappings(DicomFile, mappings)
+            RadiologyService._refresh_study_counts([study.id for study, _ in studies])
+            db.session.commit()
+            
+            results = []
+            for study, added in studies:
+                db.session.refresh(study)
+                results.append(dict(study.to_dict(), added_instances=added))
+            
+            return {
+                'success': True,
+                'studies': results,
+                'file_count': index['file_count'],
+                'ingested': len(mappings),
+                'duplicates': duplicates,
+                'skipped': len(index['skipped'])
+            }
+            
+        except Exception as e:
+            db.session.rollback()
+            # Nothing from a failed batch is kept
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            raise e
+    
+    @staticmethod
+    def _get_or_create_patient(metadata):
+        """Find a patient by MRN (the DICOM PatientID) or create one (flushed, not committed)."""
+        mrn = metadata.get('patient_id', 'UNKNOWN')
+        patient = Patient.query.filter_by(mrn=mrn).first()
+        
+        if not patient:
+            patient = Patient(
+                name=metadata.get('patient_name', 'Unknown'),
+                mrn=mrn,
+                gender=metadata.get('patient_sex'),
+                # Parse date if possible, else None
+                date_of_birth=RadiologyService._parse_dicom_date(metadata.get('patient_birth_date'))
+            )
+            db.session.add(patient)
+            db.session.flush() # Get ID
+        return patient
+    
+    @staticmethod
+    def _get_or_create_study(metadata, patient_id):
+        """Find a study by Study Instance UID or create one (flushed, not committed)."""
+        study_uid = metadata.get('study_instance_uid')
+        study = Study.query.filter_by(study_instance_uid=study_uid).first()
+        
+        if not study:
+            study = Study(
+                patient_id=patient_id,
+                study_instance_uid=study_uid,
+                study_date=RadiologyService._parse_dicom_date(metadata.get('study_date')),
+                modality=metadata.get('modality', 'OT'),
+                body_part=metadata.get('body_part_examined'),
+                description=metadata.get('study_description'),
+                accession_number=metadata.get('accession_number')
+            )
+            db.session.add(study)
+            db.session.flush()
+        return study
+    
+    @staticmethod
+    def _dicom_file_mapping(study_id, instance):
+        """DicomFile column values for an instance of the series index."""
+        def multi_value(values):
+            # DICOM's backslash-separated form fits the column widths
+            return '\\'.join(f"{float(v):g}" for v in values) if values else None
+        
+        return {
+            'id': str(uuid.uuid4()),
+            'study_id': study_id,
+            'filename': os.path.basename(instance['file_path']),
+            'file_path': instance['file_path'],
+            'file_size': os.path.getsize(instance['file_path']),
+            'series_instance_uid': instance['series_instance_uid'],
+            'sop_instance_uid': instance['sop_instance_uid'],
+            'series_number': instance['series_number'],
+            'instance_number': instance['instance_number'],
+            'slice_location': instance['slice_location'],
+            'slice_thickness': instance['slice_thickness'],
+            'pixel_spacing': multi_value(instance['pixel_spacing']),
+            'image_orientation': multi_value(instance['image_orientation_patient']),
+            'image_position': multi_value(instance['image_position_patient']),
+            'rows': instance['rows'],
+            'columns': instance['columns'],
+            'bits_allocated': instance['bits_allocated'],
+            'bits_stored': instance['bits_stored'],
+            'uploaded_at': datetime.utcnow()
+        }
+    
+    @staticmethod
+    def _refresh_study_counts(study_ids):
+        """Recompute series_count and instance_count of studies from their DicomFile rows."""
+        if not study_ids:
+            return
+        files = select(func.count(DicomFile.id)).where(DicomFile.study_id == Study.id)
+        series = select(func.count(func.distinct(DicomFile.series_instance_uid))).where(DicomFile.study_id == Study.id)
+        db.session.execute(
+            update(Study)
+            .where(Study.id.in_(study_ids))
+            .values(instance_count=files.scalar_subquery(), series_count=series.scalar_subquery())
+            .execution_options(synchronize_session=False)
+        )
+    
     @staticmethod
     def _parse_dicom_date(date_str):
         if not date_str:
@@ -115,7 +271,7 @@ class RadiologyService:
             return datetime.strptime(date_str, '%Y%m%d')
         except ValueError:
             return None
-
+    
     @staticmethod
     def get_study(study_id):
         return Study.query.get(study_id)
@@ -123,7 +279,35 @@ class RadiologyService:
     @staticmethod
     def get_study_images(study_id):
         return DicomFile.query.filter_by(study_id=study_id).order_by(DicomFile.instance_number).all()
-
+    
+    @staticmethod
+    def get_series_images(study_id, series_uid):
+        """
+        DicomFiles of one series in spatial order.
+        
+        Uses the stored ImagePositionPatient/ImageOrientationPatient when every
+        file has them (see DicomSeriesIndexer.sort_slices), else InstanceNumber.
+        """
+        def parse(value):
+            try:
+                return [float(v) for v in value.split('\\')] if value else None
+            except ValueError:
+                return None
+        
+        files = DicomFile.query.filter_by(study_id=study_id, series_instance_uid=series_uid).all()
+        series = {'instances': [
+            {
+                'dicom_file': dicom_file,
+                'image_orientation_patient': parse(dicom_file.image_orientation),
+                'image_position_patient': parse(dicom_file.image_position),
+                'instance_number': dicom_file.instance_number,
+                'slice_location': dicom_file.slice_location
+            }
+            for dicom_file in files
+        ]}
+        DicomSeriesIndexer.sort_slices(series)
+        return [instance['dicom_file'] for instance in series['instances']]
+    
     @staticmethod
     def get_metadata_only(file):
         """
@@ -143,7 +327,7 @@ class RadiologyService:
             if os.path.exists(temp_path):
                 os.remove(temp_path)
             raise e
-
+    
     @staticmethod
     def process_nifti_upload(file, patient_id=None, study_id=None):
         """
@@ -160,6 +344,8 @@ class RadiologyService:
         
         try:
             metadata = NiftiProcessor.read_nifti_metadata(file_path)
+            # Decompress now so the first slice request does not have to
+            NiftiProcessor.uncompressed_path(file_path)
             
             # If no study_id provided, create a new study (and patient if needed)
             if not study_id:
@@ -213,11 +399,18 @@ class RadiologyService:
             if os.path.exists(file_path):
                 os.remove(file_path)
             raise e
-
+    
     @staticmethod
-    def convert_study_to_nifti(study_id):
+    def convert_study_to_nifti(study_id, max_workers=None, executor=None, progress=None):
         """
         Convert all DICOM files in a study to NIfTI.
+        
+        Each series is converted in-process by DicomNiftiConverter straight from
+        its files into its own output path, with series converted in parallel
+        by a pool of max_workers processes (default: all cores), or by an
+        existing process pool. progress(series done, series total) is called
+        as series finish; an exception it raises cancels the conversion
+        (see DicomNiftiConverter.convert_many).
         """
         study = Study.query.get(study_id)
         if not study:
@@ -235,34 +428,31 @@ class RadiologyService:
                 series_dict[series_uid] = []
             series_dict[series_uid].append(df.file_path)
             
-        converted_files = []
-        
         # Create output directory
         nifti_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'nifti')
         os.makedirs(nifti_dir, exist_ok=True)
         
-        # Process each series
-        for series_uid, file_paths in series_dict.items():
-            # Create a temporary directory for this series' DICOM files
-            # dicom2nifti requires a directory input
-            temp_dicom_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'temp', f"dicom_{series_uid}")
-            os.makedirs(temp_dicom_dir, exist_ok=True)
-            
-            # Symlink or copy files to temp dir
-            for fp in file_paths:
-                try:
-                    os.symlink(fp, os.path.join(temp_dicom_dir, os.path.basename(fp)))
-                except OSError:
-                    # Fallback to copy if symlink fails (e.g. Windows)
-                    import shutil
-                    shutil.copy(fp, os.path.join(temp_dicom_dir, os.path.basename(fp)))
-            
-            try:
-                # Convert
-                output_file = NiftiProcessor.convert_dicom_to_nifti(temp_dicom_dir, nifti_dir)
+        # A unique output path per series, so concurrent conversions cannot pick up each other's files
+        jobs = [
+            (file_paths, os.path.join(nifti_dir, f"{uuid.uuid4()}_{secure_filename(series_uid)}.nii.gz"))
+            for series_uid, file_paths in series_dict.items()
+        ]
+        results = DicomNiftiConverter.convert_many(jobs, max_workers, executor, progress)
+        
+        converted_files = []
+        try:
+            for series_uid, result in zip(series_dict, results):
+                output_file = result['output_path']
+                if not output_file:
+                    logger.error(f"Conversion failed for series {series_uid}: {result['error']}")
+                    # Continue with other series
+                    continue
+                for warning in result['warnings']:
+                    logger.warning(f"Series {series_uid}: {warning}")
                 
                 # Create NiftiFile record
                 metadata = NiftiProcessor.read_nifti_metadata(output_file)
+                NiftiProcessor.uncompressed_path(output_file)
                 
                 nifti_file = NiftiFile(
                     study_id=study_id,
@@ -277,23 +467,21 @@ class RadiologyService:
                 
                 db.session.add(nifti_file)
                 converted_files.append(nifti_file)
-                
-            except Exception as e:
-                print(f"Conversion failed for series {series_uid}: {e}")
-                # Continue with other series
-                continue
-            finally:
-                # Cleanup temp dir
-                import shutil
-                if os.path.exists(temp_dicom_dir):
-                    shutil.rmtree(temp_dicom_dir)
-        
-        if not converted_files:
-            raise Exception("Failed to convert any series to NIfTI")
             
-        db.session.commit()
+            if not converted_files:
+                raise Exception("Failed to convert any series to NIfTI")
+                
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for result in results:
+                if result['output_path'] and os.path.exists(result['output_path']):
+                    # Also the uncompressed copies warmed above
+                    NiftiProcessor.remove_uncompressed_copy(result['output_path'])
+                    os.remove(result['output_path'])
+            raise
         return [f.to_dict() for f in converted_files]
-
+    
     @staticmethod
     def get_nifti_metadata_only(file):
         """
@@ -0,0 +1,148 @@
+"""
+FAISS index construction for the doctor notes vector store.
+
+Small corpora use an exact IndexFlatL2. Once the corpus crosses
+DOCTOR_NOTES_ANN_THRESHOLD vectors the store promotes itself to the
+approximate index named by DOCTOR_NOTES_INDEX_TYPE:
+
+- 'hnsw'  : IndexHNSWFlat (full vectors, best recall, no in-place removal)
+- 'ivfpq' : IndexIVFPQ (compressed vectors, trained on the corpus)
+- 'flat'  : never promote
+
+Every index is addressed by the notes' stable int64 vector IDs.
+"""
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPE = os.getenv('DOCTOR_NOTES_INDEX_TYPE', 'hnsw')
+ANN_THRESHOLD = int(os.getenv('DOCTOR_NOTES_ANN_THRESHOLD', '50000'))
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.getenv('DOCTOR_NOTES_HNSW_EF_SEARCH', '64'))
+
+IVFPQ_SUBQUANTIZERS = 48  # 384 dims / 48 = 8 dims per sub-quantizer
+IVFPQ_BITS = 8
+IVFPQ_NPROBE = int(os.getenv('DOCTOR_NOTES_IVF_NPROBE', '16'))
+IVFPQ_MAX_TRAINING_VECTORS = 200000
+
+
+def target_index_kind(ntotal, index_type=INDEX_TYPE):
+    """Index kind a corpus of `ntotal` vectors should use."""
+    if index_type == 'flat' or ntotal < ANN_THRESHOLD:
+        return 'flat'
+    return index_type
+
+
+def index_kind(index):
+    """Kind ('flat', 'hnsw' or 'ivfpq') of an index built by build_index()."""
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivfpq'
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+
+def is_id_mapped(index):
+    """Whether the index is addressed by vector ID rather than insertion order."""
+    return isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF))
+
+
+def supports_removal(index):
+    """HNSW graphs cannot drop vectors in place; they are rebuilt instead."""
+    return index_kind(index) != 'hnsw'
+
+
+def remove_vectors(index, vector_ids):
+    """Remove vectors by ID; returns the number removed."""
+    vector_ids = np.ascontiguousarray(vector_ids, dtype='int64')
+    # IDSelectorArray is the only selector the IVF hashtable direct map accepts
+    return index.remove_ids(faiss.IDSelectorArray(len(vector_ids), faiss.swig_ptr(vector_ids)))
+
+
+def configure_search(index):
+    """Apply the configured search-time parameters to an index."""
+    kind = index_kind(index)
+    if kind == 'hnsw':
+        faiss.downcast_index(index.index).hnsw.efSearch = HNSW_EF_SEARCH
+    elif kind == 'ivfpq':
+        index.nprobe = IVFPQ_NPROBE
+
+
+def search_parameters(index, selector):
+    """Search parameters restricting `index` to the IDs in `selector`."""
+    kind = index_kind(index)
+    if kind == 'hnsw':
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_EF_SEARCH)
+    if kind == 'ivfpq':
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVFPQ_NPROBE)
+    return faiss.SearchParameters(sel=selector)
+
+
+def build_index(kind, dimension, vectors=None, vector_ids=None):
+    """
+    Build an index of the given kind, optionally filled with vectors.
+
+    Args:
+        kind: 'flat', 'hnsw' or 'ivfpq'
+        dimension: Embedding dimension
+        vectors: float32 array (n, dimension); required to train 'ivfpq'
+        vector_ids: int64 array (n,) of stable vector IDs
+
+    Returns:
+        The FAISS index
+    """
+    if kind == 'flat':
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    elif kind == 'hnsw':
+        base = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(base)
+    elif kind == 'ivfpq':
+        if vectors is None or len(vectors) == 0:
+            raise ValueError('ivfpq index needs vectors to train on')
+        # Rule of thumb: ~4*sqrt(n) lists, with enough points per list to train
+        nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, IVFPQ_SUBQUANTIZERS, IVFPQ_BITS)
+        training = vectors
+        if len(training) > IVFPQ_MAX_TRAINING_VECTORS:
+            sample = np.random.default_rng(0).choice(len(training), IVFPQ_MAX_TRAINING_VECTORS, replace=False)
+            training = training[sample]
+        index.train(training)
+        # Allows reconstruct() and remove_ids() by vector ID
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    else:
+        raise ValueError(f'Unknown index type: {kind}')
+
+    configure_search(index)
+    if vectors is not None and len(vectors):
+        index.add_with_ids(vectors, np.asarray(vector_ids, dtype='int64'))
+    return index
+
+
+def estimate_recall(index, vectors, vector_ids, k=10, num_queries=100):
+    """
+    Estimate recall@k of `index` against exact search over `vectors`.
+
+    Queries are sampled from the indexed vectors themselves.
+
+    Returns:
+        Mean fraction of the exact top-k found by the index, in [0, 1]
+    """
+    if len(vectors) == 0:
+        return 1.0
+    k = min(k, len(vectors))
+    sample = np.random.default_rng(0).choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+    queries = vectors[sample]
+
+    _, exact = faiss.knn(queries, vectors, k)
+    exact_ids = np.asarray(vector_ids, dtype='int64')[exact]
+    _, approx_ids = index.search(queries, k)
+
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact_ids, approx_ids))
+    return hits / float(k * len(queries))
@@ -0,0 +1,240 @@
+"""
+Background post-processing of uploaded consultation videos.
+
+After an upload is registered, a job probes the recording's duration and
+dimensions, saves a JPEG poster frame and writes a small, low-frame-rate
+preview clip, then records them on the VideoConsultation row. Jobs run on
+a per-process thread pool so the upload request returns immediately;
+OpenCV releases the GIL while decoding and encoding.
+
+Poster and preview files are stored next to the videos, under
+PREVIEW_SUBFOLDER, and their names are recorded relative to the video
+folder.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from extensions import db
+from models.video_consultation import VideoConsultation
+
+VIDEO_PROCESSING_WORKERS = int(os.getenv('VIDEO_PROCESSING_WORKERS', '1'))
+
+PREVIEW_SUBFOLDER = 'previews'
+PREVIEW_WIDTH = 320  # Pixels; height keeps the aspect ratio
+PREVIEW_FPS = 10
+PREVIEW_MAX_SECONDS = 15  # Previews cover the start of the recording
+POSTER_AT_SECONDS = 1.0  # The first frames of a webcam recording are often dark
+POSTER_JPEG_QUALITY = 80
+
+# VP8/WebM plays in every browser; MPEG-4 Part 2 is the fallback for OpenCV builds without libvpx
+PREVIEW_CODECS = (('VP80', 'webm', 'video/webm'), ('mp4v', 'mp4', 'video/mp4'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def enqueue_video_processing(app, video_id, video_folder):
+    """
+    Process a newly registered video in the background.
+    
+    Args:
+        app: The Flask app, for the job's application context
+        video_id: VideoConsultation.video_id of a committed row
+        video_folder: Folder holding the video; previews go in a subfolder
+    
+    Returns:
+        The job's Future
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=VIDEO_PROCESSING_WORKERS,
+                thread_name_prefix='video-processing'
+            )
+    return _executor.submit(_run_job, app, video_id, video_folder)
+
+
+def _run_job(app, video_id, video_folder):
+    with app.app_context():
+        try:
+            process_video(video_id, video_folder)
+        except Exception as e:
+            print(f"Error processing video {video_id}: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def process_video(video_id, video_folder):
+    """
+    Probe a video and generate its poster and preview (needs an app context).
+    
+    The row is claimed by moving it from pending/failed to processing, so a
+    video queued twice is only processed once.
+    
+    Args:
+        video_id: VideoConsultation.video_id
+        video_folder: Folder holding the video
+    
+    Returns:
+        True if the video was processed, False if it failed or was not claimed
+    """
+    claimed = VideoConsultation.query.filter(
+        VideoConsultation.video_id == video_id,
+        db.or_(VideoConsultation.processing_status.in_(('pending', 'failed')),
+               VideoConsultation.processing_status.is_(None))
+    ).update({'processing_status': 'processing'}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return False
+    
+    video = VideoConsultation.query.filter_by(video_id=video_id).first()
+    output_folder = os.path.join(video_folder, PREVIEW_SUBFOLDER)
+    os.makedirs(output_folder, exist_ok=True)
+    
+    try:
+        result = _render_previews(os.path.join(video_folder, video.filename), output_folder, video_id)
+    except Exception as e:
+        print(f"DEBUG: Preview generation failed for video {video_id}: {str(e)}")
+        video.processing_status = 'failed'
+        db.session.commit()
+        return False
+    
+    # The video may have been deleted while it was being processed
+    if VideoConsultation.query.filter_by(video_id=video_id).first() is None:
+        _remove_outputs(video_folder, result['thumbnail_filename'], result['preview_filename'])
+        return False
+    
+    for field, value in result.items():
+        setattr(video, field, value)
+    video.processing_status = 'ready'
+    db.session.commit()
+    print(f"Processed video {video_id}: {result['duration']:.1f}s, {result['width']}x{result['height']}")
+    return True
+
+
+def remove_video_previews(video, video_folder):
+    """Delete a video's poster and preview files, if any."""
+    _remove_outputs(video_folder, video.thumbnail_filename, video.preview_filename)
+
+
+def _remove_outputs(video_folder, *filenames):
+    for filename in filenames:
+        if filename and os.path.exists(os.path.join(video_folder, filename)):
+            os.remove(os.path.join(video_folder, filename))
+
+
+def _render_previews(video_path, output_folder, video_id):
+    """
+    Read the video once, writing the poster and preview along the way.
+    
+    Returns:
+        Dictionary of the VideoConsultation fields to set
+    
+    Raises:
+        ValueError: If the file cannot be decoded
+    """
+    import cv2
+    
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError('Unsupported or corrupt video file')
+    
+    writer = None
+    poster = None
+    poster_final = False
+    preview_name = None
+    try:
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        # MediaRecorder webm files carry no duration, so it is then measured by reading to the end
+        header_duration = frame_count / fps if fps > 0 and frame_count > 0 else None
+        
+        preview_size = (PREVIEW_WIDTH, max(2, round(PREVIEW_WIDTH * height / width / 2) * 2)) if width else None
+        next_preview_at = 0.0
+        last_timestamp = 0.0
+        frames_read = 0
+        
+        while True:
+            preview_done = preview_name is not None and next_preview_at > PREVIEW_MAX_SECONDS
+            if preview_done and poster_final:
+                if header_duration is not None:
+                    break
+                # Only the timestamps are needed from here on
+                if not capture.grab():
+                    break
+                frames_read += 1
+                last_timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                continue
+            
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames_read += 1
+            timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if timestamp <= 0 and fps > 0:
+                timestamp = (frames_read - 1) / fps
+            last_timestamp = timestamp
+            
+            # Short videos use their last frame
+            if not poster_final:
+                poster = frame
+                poster_final = timestamp >= POSTER_AT_SECONDS
+            
+            if preview_size and timestamp >= next_preview_at and next_preview_at <= PREVIEW_MAX_SECONDS:
+                if writer is None:
+                    writer, preview_name = _open_preview_writer(output_folder, video_id, preview_size)
+                writer.write(cv2.resize(frame, preview_size, interpolation=cv2.INTER_AREA))
+                next_preview_at += 1.0 / PREVIEW_FPS
+        
+        if poster is None:
+            raise ValueError('Video has no decodable frames')
+        
+        if header_duration is not None:
+            duration = header_duration
+        else:
+            # The last frame is shown for one frame interval
+            duration = last_timestamp + (1.0 / fps if fps > 0 else 0.0)
+        
+        thumbnail_name = f"{video_id}_poster.jpg"
+        poster_frame = cv2.resize(poster, preview_size, interpolation=cv2.INTER_AREA) if preview_size else poster
+        if not cv2.imwrite(os.path.join(output_folder, thumbnail_name), poster_frame,
+                           [cv2.IMWRITE_JPEG_QUALITY, POSTER_JPEG_QUALITY]):
+            raise ValueError('Could not write poster image')
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+    
+    return {
+        'duration': round(duration, 2),
+        'width': width or poster.shape[1],
+        'height': height or poster.shape[0],
+        'thumbnail_filename': os.path.join(PREVIEW_SUBFOLDER, thumbnail_name),
+        'preview_filename': os.path.join(PREVIEW_SUBFOLDER, preview_name) if preview_name else None
+    }
+
+
+def _open_preview_writer(output_folder, video_id, size):
+    """Open a VideoWriter with the first codec this OpenCV build supports."""
+    import cv2
+    
+    for fourcc, extension, _ in PREVIEW_CODECS:
+        name = f"{video_id}_preview.{extension}"
+        writer = cv2.VideoWriter(os.path.join(output_folder, name), cv2.VideoWriter_fourcc(*fourcc), PREVIEW_FPS, size)
+        if writer.isOpened():
+            return writer, name
+        writer.release()
+    raise ValueError('No preview codec available in this OpenCV build')
+
+
+def preview_mimetype(filename):
+    """Content type of a preview file written by this module."""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    for _, codec_extension, mimetype in PREVIEW_CODECS:
+        if extension == codec_extension:
+            return mimetype
+    return 'application/octet-stream'
@@ -0,0 +1,181 @@
+"""
+Multi-process stress test for the doctor notes vector store.
+
+Starts several worker processes that open the same store (as gunicorn
+workers do) and concurrently add, update, delete and search notes while
+checkpoints and compactions run. Afterwards it checks that no write was
+lost: every surviving note has exactly one live row and one vector, and a
+freshly opened store agrees with every worker's in-memory view.
+
+Usage:
+    python stress_notes_store.py                          # 4 workers x 200 ops
+    python stress_notes_store.py --workers 8 --ops 500 --hash-embeddings
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Exercise checkpoints often unless told otherwise
+os.environ.setdefault('DOCTOR_NOTES_CHECKPOINT_EVERY', '50')
+
+import numpy as np
+
+import services.embedding_service as embedding_service
+from services.doctor_notes_vector_store import DoctorNotesVectorStore
+
+
+class HashEmbeddingModel:
+    """Deterministic pseudo-embeddings; the store's concurrency does not depend on embedding quality."""
+    
+    def encode(self, texts, batch_size=None, normalize_embeddings=False):
+        vectors = []
+        for text in texts:
+            seed = int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:16], 16)
+            vectors.append(np.random.default_rng(seed).standard_normal(embedding_service.EMBEDDING_DIMENSION))
+        return np.asarray(vectors, dtype='float32')
+
+
+def open_store(workdir):
+    return DoctorNotesVectorStore(
+        index_path=os.path.join(workdir, 'notes.index'),
+        db_path=os.path.join(workdir, 'notes.db')
+    )
+
+
+def worker(worker_id, workdir, ops, compact_every, hash_embeddings, finished, results):
+    if hash_embeddings:
+        embedding_service._model = HashEmbeddingModel()
+    store = open_store(workdir)
+    rng = random.Random(worker_id)
+    live = {}  # note_id -> content of the latest version
+    errors = []
+    searches = 0
+    
+    for op in range(ops):
+        try:
+            store.refresh()
+            action = rng.random()
+            if action < 0.5 or not live:
+                note_id = f'w{worker_id}-{op}'
+                content = f'worker {worker_id} note {op} about condition {rng.randint(0, 50)}'
+                store.add_note(content, {'id': note_id, 'user_id': worker_id})
+                live[note_id] = content
+            elif action < 0.6:
+                note_id = rng.choice(sorted(live))
+                content = f'worker {worker_id} revised note {op}'
+                store.update_note(note_id, content, {'user_id': worker_id})
+                live[note_id] = content
+            elif action < 0.7:
+                note_id = rng.choice(sorted(live))
+                store.delete_note(note_id)
+                del live[note_id]
+            else:
+                note_id = rng.choice(sorted(live))
+                hits = store.search_similar_notes(live[note_id], k=1, user_id=worker_id)
+                searches += 1
+                if not hits or hits[0]['id'] != note_id:
+                    errors.append(f'search for {note_id} returned {[h["id"] for h in hits]}')
+                # Unscoped searches run against other workers' writes too
+                store.search_similar_notes(f'condition {rng.randint(0, 50)}', k=5)
+            if compact_every and op and op % compact_every == 0 and worker_id == 0:
+                store.compact()
+        except Exception as e:
+            errors.append(f'op {op}: {type(e).__name__}: {e}')
+    
+    # Every worker's view must converge once all writes are done
+    finished.wait()
+    store.refresh()
+    results.put({
+        'worker_id': worker_id,
+        'live': live,
+        'errors': errors,
+        'searches': searches,
+        'index_size': store.index.ntotal - len(store._stale_vector_ids)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=200, help='Operations per worker')
+    parser.add_argument('--compact-every', type=int, default=75,
+                        help='Worker 0 compacts the store every N operations (0 to disable)')
+    parser.add_argument('--hash-embeddings', action='store_true',
+                        help='Use deterministic hash embeddings instead of loading the model')
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='notes-stress-')
+    try:
+        # Create the store files before the workers race to open them
+        open_store(workdir)
+        
+        results = multiprocessing.Queue()
+        finished = multiprocessing.Barrier(args.workers)
+        processes = [
+            multiprocessing.Process(
+                target=worker,
+                args=(i, workdir, args.ops, args.compact_every, args.hash_embeddings, finished, results)
+            )
+            for i in range(args.workers)
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+        
+        if args.hash_embeddings:
+            embedding_service._model = HashEmbeddingModel()
+        store = open_store(workdir)
+        failures = []
+        expected = {}
+        for report in reports:
+            expected.update(report['live'])
+            failures += [f"worker {report['worker_id']}: {error}" for error in report['errors']]
+        
+        rows = {}
+        for note in store.get_all_notes():
+            if not note['deleted']:
+                if note['id'] in rows:
+                    failures.append(f"note {note['id']} has several live versions")
+                rows[note['id']] = note
+        if set(rows) != set(expected):
+            failures.append(f'live notes differ: {len(set(expected) - set(rows))} missing, '
+                            f'{len(set(rows) - set(expected))} unexpected')
+        for note_id, content in expected.items():
+            if note_id in rows and rows[note_id]['content'] != content:
+                failures.append(f'note {note_id} has stale content')
+            if note_id in rows and not store._index_contains(rows[note_id]['vector_id']):
+                failures.append(f'note {note_id} has no vector')
+        
+        live_vectors = store.index.ntotal - len(store._stale_vector_ids)
+        if live_vectors != len(rows):
+            failures.append(f'index holds {live_vectors} live vectors for {len(rows)} notes')
+        for report in reports:
+            if report['index_size'] != live_vectors:
+                failures.append(f"worker {report['worker_id']} saw {report['index_size']} live vectors")
+        
+        total_ops = args.workers * args.ops
+        print(f"{args.workers} workers, {total_ops} operations in {elapsed:.1f}s "
+              f"({total_ops / elapsed:.0f} ops/s), {sum(r['searches'] for r in reports)} verified searches")
+        print(f"{len(rows)} live notes, store stats: {store.get_stats()}")
+        if failures:
+            print(f"FAILED ({len(failures)} problems):")
+            for failure in failures[:50]:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("OK")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import nibabel as nib
+import numpy as np
+import pydicom
+
+# Orientation of converted volumes, as dicom2nifti's reorient=True produced
+# (x from right to left, y from posterior to anterior, z from inferior to superior)
+OUTPUT_AXCODES = ('L', 'A', 'S')
+
+# Relative deviation from the median slice spacing reported as a gap in the series
+SPACING_TOLERANCE = 0.05
+
+
+def _convert_job(job: Tuple[List[str], str]) -> Dict[str, Any]:
+    """Convert one series (runs in worker processes); errors are returned, not raised"""
+    file_paths, output_path = job
+    try:
+        return DicomNiftiConverter.convert_series(file_paths, output_path)
+    except Exception as e:
+        return {'output_path': None, 'error': str(e)}
+
+
+class DicomNiftiConverter:
+    """Builds NIfTI volumes from DICOM series in-process"""
+    
+    @staticmethod
+    def convert_series(file_paths: List[str], output_path: str) -> Dict[str, Any]:
+        """
+        Convert one DICOM series to a NIfTI file.
+        
+        Slices are ordered by their position along the slice normal (not by
+        file order or InstanceNumber) and the affine is built from
+        ImageOrientationPatient, ImagePositionPatient and PixelSpacing, then
+        the volume is reoriented to LAS. Stored values are kept with
+        scl_slope/scl_inter when the whole series shares one rescale, else
+        they are rescaled to float32. The file is written under a temporary
+        name and renamed, so readers never see a partial file.
+        
+        Args:
+            file_paths: The series' DICOM files, in any order
+            output_path: .nii or .nii.gz path to write
+        
+        Returns:
+            {'output_path', 'shape', 'voxel_sizes', 'data_type', 'slice_count', 'warnings'}
+        """
+        if not file_paths:
+            raise ValueError('No DICOM files to convert')
+        slices = [pydicom.dcmread(path) for path in file_paths]
+        first = slices[0]
+        if int(getattr(first, 'SamplesPerPixel', 1)) != 1:
+            raise ValueError('Only grayscale series can be converted to NIfTI')
+        
+        row_direction, column_direction, normal = DicomNiftiConverter._orientation(first)
+        warnings = []
+        if all(getattr(ds, 'ImagePositionPatient', None) for ds in slices):
+            positions = np.array([[float(v) for v in ds.ImagePositionPatient] for ds in slices])
+            order = np.argsort(positions @ normal, kind='stable')
+        else:
+            warnings.append('ImagePositionPatient missing; slices ordered by InstanceNumber')
+            positions = None
+            order = np.argsort([int(getattr(ds, 'InstanceNumber', 0) or 0) for ds in slices], kind='stable')
+        slices = [slices[i] for i in order]
+        
+        slopes = {float(getattr(ds, 'RescaleSlope', 1) or 1) for ds in slices}
+        intercepts = {float(getattr(ds, 'RescaleIntercept', 0) or 0) for ds in slices}
+        uniform = len(slopes) == 1 and len(intercepts) == 1
+        
+        frames = []
+        for ds in slices:
+            pixels = ds.pixel_array
+            if pixels.shape[-2:] != (int(first.Rows), int(first.Columns)):
+                raise ValueError('All images of the series must have the same size')
+            if not uniform:
+                pixels = pixels.astype(np.float32) * np.float32(getattr(ds, 'RescaleSlope', 1) or 1) \
+                    + np.float32(getattr(ds, 'RescaleIntercept', 0) or 0)
+            frames.extend(pixels if pixels.ndim == 3 else [pixels])
+        # NIfTI voxel (i, j, k) is DICOM (column, row, slice)
+        voxels = np.stack(frames, axis=-1).transpose(1, 0, 2)
+        
+        row_spacing, column_spacing = (float(v) for v in getattr(first, 'PixelSpacing', None) or [1.0, 1.0])
+        origin = np.array([float(v) for v in getattr(first, 'ImagePositionPatient', None) or [0, 0, 0]])
+        if positions is not None and len(slices) > 1:
+            ordered = positions[order]
+            gaps = np.diff(ordered @ normal)
+            spacing = float(np.median(gaps))
+            if spacing <= 0:
+                raise ValueError('Slices of the series share a position')
+            if np.any(np.abs(gaps - spacing) > SPACING_TOLERANCE * spacing):
+                warnings.append(f'Slice spacing varies ({gaps.min():.3g} to {gaps.max():.3g} mm)')
+            # The step between slices, which also covers gantry tilt
+            slice_step = (ordered[-1] - ordered[0]) / (len(slices) - 1)
+            origin = ordered[0]
+        else:
+            spacing = float(getattr(first, 'SpacingBetweenSlices', None) or getattr(first, 'SliceThickness', None) or 1.0)
+            slice_step = normal * spacing
+        
+        # DICOM patient coordinates are LPS, NIfTI's are RAS
+        affine = np.eye(4)
+        affine[:3, 0] = row_direction * column_spacing
+        affine[:3, 1] = column_direction * row_spacing
+        affine[:3, 2] = slice_step
+        affine[:3, 3] = origin
+        affine[:2, :] *= -1
+        
+        image = nib.Nifti1Image(voxels, affine)
+        image = image.as_reoriented(nib.orientations.ornt_transform(
+            nib.orientations.io_orientation(affine), nib.orientations.axcodes2ornt(OUTPUT_AXCODES)
+        ))
+        image.header.set_xyzt_units('mm', 'sec')
+        if uniform:
+            image.header.set_slope_inter(slopes.pop(), intercepts.pop())
+        image.header['descrip'] = str(getattr(first, 'SeriesDescription', '') or '')[:79]
+        
+        extension = '.nii.gz' if output_path.endswith('.nii.gz') else '.nii'
+        tmp_path = f"{output_path[:-len(extension)]}.{os.getpid()}.partial{extension}"
+        try:
+            nib.save(image, tmp_path)
+            os.replace(tmp_path, output_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        return {
+            'output_path': output_path,
+            'shape': [int(n) for n in image.shape],
+            'voxel_sizes': [float(z) for z in image.header.get_zooms()],
+            'data_type': str(image.get_data_dtype()),
+            'slice_count': len(frames),
+            'warnings': warnings
+        }
+    
+    @staticmethod
+    def convert_many(jobs: List[Tuple[List[str], str]], max_workers: Optional[int] = None,
+                     executor: Optional[Executor] = None,
+                     progress: Optional[Callable[[int, int], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Convert several series, in a pool of max_workers processes (default: all cores).
+        
+        Args:
+            jobs: (file paths, output path) per series
+            max_workers: Worker processes, or None for os.cpu_count()
+            executor: An existing process pool to use instead of starting one
+            progress: Called with (series done, series total) as each series
+                finishes. If it raises, series not yet started are cancelled,
+                outputs already written are removed and the exception propagates.
+        
+        Returns:
+            convert_series() results in job order; a failed series gives
+            {'output_path': None, 'error': message}
+        """
+        workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+        if executor is None and workers <= 1:
+            results = []
+            try:
+                for job in jobs:
+                    results.append(_convert_job(job))
+                    if progress:
+                        progress(len(results), len(jobs))
+            except BaseException:
+                DicomNiftiConverter._remove_outputs(results)
+                raise
+            return results
+        
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [executor.submit(_convert_job, job) for job in jobs]
+            try:
+                for done, _ in enumerate(as_completed(futures), 1):
+                    if progress:
+                        progress(done, len(jobs))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                # Series already running cannot be interrupted; wait for them, then discard everything
+                DicomNiftiConverter._remove_outputs(f.result() for f in futures if not f.cancelled())
+                raise
+            return [future.result() for future in futures]
+        finally:
+            if own_executor:
+                executor.shutdown()
+    
+    @staticmethod
+    def _remove_outputs(results) -> None:
+        for result in results:
+            if result['output_path'] and os.path.exists(result['output_path']):
+                os.remove(result['output_path'])
+    
+    @staticmethod
+    def _orientation(ds) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Row direction, column direction and slice normal (LPS unit vectors)"""
+        orientation = getattr(ds, 'ImageOrientationPatient', None)
+        if not orientation or len(orientation) != 6:
+            orientation = [1, 0, 0, 0, 1, 0]
+        row_direction = np.array([float(v) for v in orientation[:3]])
+        column_direction = np.array([float(v) for v in orientation[3:]])
+        normal = np.cross(row_direction, column_direction)
+        return row_direction, column_direction, normal
@@ -1,19 +1,57 @@
 import pydicom
-import numpy as np
 from PIL import Image
-import io
 import base64
-import os
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Sequence
+from utils.render_cache import RenderCache, get_render_cache, encode_image, encode_array, IMAGE_MIMETYPES
+from utils.windowing import window_to_uint8
+
+# Elements larger than this (e.g. embedded overlays or private blobs) stay on disk until accessed
+HEADER_DEFER_SIZE = 16 * 1024
+
+# Tags read by read_dicom_metadata; SpecificCharacterSet is needed to decode the text values
+METADATA_TAGS = [
+    'SpecificCharacterSet',
+    'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex',
+    'StudyInstanceUID', 'StudyDate', 'StudyTime', 'StudyDescription', 'AccessionNumber',
+    'SeriesInstanceUID', 'SeriesNumber', 'SeriesDescription', 'Modality', 'BodyPartExamined',
+    'SOPInstanceUID', 'InstanceNumber', 'SliceLocation', 'SliceThickness',
+    'Rows', 'Columns', 'PixelSpacing', 'BitsAllocated', 'BitsStored',
+    'ImageOrientationPatient', 'ImagePositionPatient',
+    'WindowCenter', 'WindowWidth',
+    'Manufacturer', 'ManufacturerModelName', 'StationName',
+]
 
 class DicomProcessor:
     """Utility class for processing DICOM files"""
     
+    @staticmethod
+    def read_dicom_header(file_path: str, tags: Optional[Sequence[str]] = None) -> pydicom.Dataset:
+        """
+        Read a DICOM file's header without its pixel data.
+        
+        Parsing stops at the Pixel Data element, elements not in `tags` are
+        skipped over on disk, and large values are only read when accessed,
+        so a header read costs kilobytes whatever the image size.
+        
+        Args:
+            file_path: Path to the DICOM file
+            tags: Keywords of the elements to read, or None for every non-pixel element
+        
+        Returns:
+            The (partial) pydicom Dataset
+        """
+        return pydicom.dcmread(
+            file_path,
+            stop_before_pixels=True,
+            defer_size=HEADER_DEFER_SIZE,
+            specific_tags=list(tags) if tags is not None else None
+        )
+    
     @staticmethod
     def read_dicom_metadata(file_path: str) -> Dict[str, Any]:
         """Extract metadata from DICOM file"""
         try:
-            ds = pydicom.dcmread(file_path)
+            ds = DicomProcessor.read_dicom_header(file_path, METADATA_TAGS)
             
             metadata = {
                 # Patient information
@@ -68,82 +106,78 @@ class DicomProcessor:
     
     @staticmethod
     def dicom_to_image(file_path: str, window_center: Optional[float] = None, 
-                      window_width: Optional[float] = None) -> str:
-        """Convert DICOM to base64 encoded PNG image"""
+                      window_width: Optional[float] = None, frame: int = 0,
+                      image_format: str = 'png') -> str:
+        """Convert DICOM to base64 encoded PNG (or JPEG/WebP) image"""
+        data, mimetype = DicomProcessor.render_dicom(file_path, window_center, window_width, frame, image_format)
+        return f"data:{mimetype};base64,{base64.b64encode(data).decode()}"
+    
+    @staticmethod
+    def render_dicom(file_path: str, window_center: Optional[float] = None,
+                     window_width: Optional[float] = None, frame: int = 0,
+                     image_format: str = 'png') -> Tuple[bytes, str]:
+        """
+        Render a DICOM frame to an encoded image, through the render cache.
+        
+        Args:
+            file_path: Path to the DICOM file
+            window_center: Window center, or None to auto-normalize
+            window_width: Window width, or None to auto-normalize
+            frame: Frame of a multi-frame image
+            image_format: 'png', 'jpeg', 'webp', or 'raw' for the unwindowed pixel array (.npy)
+        
+        Returns:
+            (encoded image bytes, mimetype)
+        """
+        if image_format not in IMAGE_MIMETYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
         try:
-            ds = pydicom.dcmread(file_path)
-            
-            # Get pixel array
-            pixel_array = ds.pixel_array.astype(float)
-            
-            # Apply window/level if provided
-            if window_center is not None and window_width is not None:
-                pixel_array = DicomProcessor._apply_window_level(
-                    pixel_array, window_center, window_width
-                )
-            else:
-                # Auto-normalize
-                pixel_array = DicomProcessor._normalize_pixel_array(pixel_array)
-            
-            # Convert to 8-bit
-            pixel_array = (pixel_array * 255).astype(np.uint8)
-            
-            # Handle different image orientations
-            if len(pixel_array.shape) == 3:
-                # Multi-frame or color image
-                if pixel_array.shape[2] == 3:
-                    # RGB image
-                    image = Image.fromarray(pixel_array, 'RGB')
-                else:
-                    # Take first frame for multi-frame
-                    image = Image.fromarray(pixel_array[0], 'L')
-            else:
-                # Grayscale image
-                image = Image.fromarray(pixel_array, 'L')
-            
-            # Convert to base64
-            img_buffer = io.BytesIO()
-            image.save(img_buffer, format='PNG')
-            img_str = base64.b64encode(img_buffer.getvalue()).decode()
-            
-            return f"data:image/png;base64,{img_str}"
+            key = RenderCache.make_key(file_path, 'dicom', frame, window_center, window_width, image_format)
+            data = get_render_cache().get_or_render(
+                key,
+                lambda: DicomProcessor._render_dicom(file_path, window_center, window_width, frame, image_format)
+            )
+            return data, IMAGE_MIMETYPES[image_format]
             
+        except (FileNotFoundError, IndexError):
+            # A missing file or frame, which callers report differently from a rendering fault
+            raise
         except Exception as e:
             raise Exception(f"Error converting DICOM to image: {str(e)}")
     
     @staticmethod
-    def _normalize_pixel_array(pixel_array: np.ndarray) -> np.ndarray:
-        """Normalize pixel array to 0-1 range"""
-        min_val = pixel_array.min()
-        max_val = pixel_array.max()
+    def _render_dicom(file_path: str, window_center: Optional[float], window_width: Optional[float],
+                      frame: int, image_format: str) -> bytes:
+        """Read, window and encode one frame (uncached)"""
+        ds = pydicom.dcmread(file_path)
         
-        if max_val > min_val:
-            return (pixel_array - min_val) / (max_val - min_val)
-        else:
-            return np.zeros_like(pixel_array)
-    
-    @staticmethod
-    def _apply_window_level(pixel_array: np.ndarray, center: float, width: float) -> np.ndarray:
-        """Apply window/level transformation"""
-        min_val = center - width / 2
-        max_val = center + width / 2
+        # Get pixel array
+        pixel_array = ds.pixel_array
+        is_rgb = getattr(ds, 'SamplesPerPixel', 1) == 3
+        multi_frame = pixel_array.ndim == (4 if is_rgb else 3)
+        frames = pixel_array.shape[0] if multi_frame else 1
+        if not 0 <= frame < frames:
+            raise IndexError(f"Frame {frame} is out of range ({frames} frames)")
+        if multi_frame:
+            pixel_array = pixel_array[frame]
+        if image_format == 'raw':
+            # Stored values; the client applies rescale and windowing
+            return encode_array(pixel_array)
         
-        # Clip values to window range
-        windowed = np.clip(pixel_array, min_val, max_val)
+        # Rescale to modality units (e.g. HU) and window in one pass; auto-normalize without a window
+        pixel_array = window_to_uint8(
+            pixel_array, window_center, window_width,
+            getattr(ds, 'RescaleSlope', 1.0), getattr(ds, 'RescaleIntercept', 0.0)
+        )
+        image = Image.fromarray(pixel_array, 'RGB' if is_rgb else 'L')
         
-        # Normalize to 0-1
-        if max_val > min_val:
-            windowed = (windowed - min_val) / (max_val - min_val)
-        else:
-            windowed = np.zeros_like(windowed)
-        
-        return windowed
+        return encode_image(image, image_format)[0]
     
     @staticmethod
     def get_image_dimensions(file_path: str) -> Tuple[int, int]:
         """Get image dimensions from DICOM file"""
         try:
-            ds = pydicom.dcmread(file_path)
+            ds = DicomProcessor.read_dicom_header(file_path, ['Rows', 'Columns'])
             rows = getattr(ds, 'Rows', 0)
             columns = getattr(ds, 'Columns', 0)
             return (rows, columns)
@@ -152,39 +186,29 @@ class DicomProcessor:
     
     @staticmethod
     def validate_dicom_file(file_path: str) -> bool:
-        """Validate if file is a valid DICOM file"""
+        """Validate if file is a valid DICOM file (checks the header only)"""
         try:
-            pydicom.dcmread(file_path)
-            return True
+            ds = DicomProcessor.read_dicom_header(file_path, ['SOPClassUID'])
+            # Without a preamble, pydicom only rejects files whose first bytes don't parse
+            return 'SOPClassUID' in ds or 'TransferSyntaxUID' in ds.file_meta
         except Exception:
             return False
     
     @staticmethod
     def get_series_info(file_paths: list) -> Dict[str, list]:
-        """Group DICOM files by series"""
-        series_dict = {}
+        """Group DICOM files by series, each sorted spatially (see DicomSeriesIndexer)"""
+        from utils.dicom_series_indexer import DicomSeriesIndexer
         
-        for file_path in file_paths:
-            try:
-                ds = pydicom.dcmread(file_path)
-                series_uid = str(getattr(ds, 'SeriesInstanceUID', 'unknown'))
-                
-                if series_uid not in series_dict:
-                    series_dict[series_uid] = []
-                
-                series_dict[series_uid].append({
-                    'file_path': file_path,
-                    'instance_number': getattr(ds, 'InstanceNumber', 0),
-                    'slice_location': getattr(ds, 'SliceLocation', 0)
-                })
-                
-            except Exception:
-                continue
-        
-        # Sort each series by instance number or slice location
-        for series_uid in series_dict:
-            series_dict[series_uid].sort(
-                key=lambda x: (x['instance_number'], x['slice_location'])
-            )
+        series_dict = {}
+        for study in DicomSeriesIndexer.index_files(list(file_paths))['studies']:
+            for series in study['series']:
+                series_dict.setdefault(series['series_instance_uid'] or 'unknown', []).extend(
+                    {
+                        'file_path': instance['file_path'],
+                        'instance_number': instance['instance_number'] or 0,
+                        'slice_location': instance['slice_location'] or 0
+                    }
+                    for instance in series['instances']
+                )
         
-        return series_dict
\ No newline at end of file
+        return series_dict
@@ -0,0 +1,192 @@
+import os
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from utils.dicom_processor import DicomProcessor
+
+# Below this many files, reading serially beats starting a process pool
+PARALLEL_MIN_FILES = 64
+# Files handed to a worker process at a time
+READ_CHUNK_SIZE = 32
+
+STUDY_FIELDS = ['study_instance_uid', 'patient_id', 'patient_name', 'patient_birth_date', 'patient_sex',
+                'study_date', 'study_time', 'study_description', 'accession_number']
+SERIES_FIELDS = ['series_instance_uid', 'series_number', 'series_description', 'modality', 'body_part_examined']
+
+
+def _plain(value):
+    """Convert pydicom values (MultiValue, DSfloat, IS, PersonName) to JSON-friendly Python types."""
+    if value is None or isinstance(value, (str, bool)):
+        return value
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        return [_plain(v) for v in value]
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return str(value)
+
+
+def _read_header(file_path: str) -> Optional[Dict[str, Any]]:
+    """Header metadata of one file in plain types, or None if it is not DICOM (runs in worker processes)."""
+    try:
+        metadata = DicomProcessor.read_dicom_metadata(file_path)
+    except Exception:
+        return None
+    if not metadata.get('sop_instance_uid'):
+        return None
+    instance = {key: _plain(value) for key, value in metadata.items()}
+    instance['file_path'] = file_path
+    return instance
+
+
+class DicomSeriesIndexer:
+    """Builds a study -> series -> instance tree from a directory or ZIP of DICOM files"""
+    
+    @staticmethod
+    def index(source: str, extract_dir: Optional[str] = None, max_workers: Optional[int] = None,
+              executor: Optional[Executor] = None) -> Dict[str, Any]:
+        """
+        Index every DICOM file in a directory (recursively) or ZIP archive.
+        
+        Headers are read without pixel data, in a pool of max_workers processes
+        (default: all cores) or an existing process pool. Slices of each series are ordered by their
+        position along the slice normal, which is correct even when
+        InstanceNumber does not follow anatomy.
+        
+        Args:
+            source: Directory or .zip file
+            extract_dir: Where to extract a ZIP; required for ZIP sources
+            max_workers: Worker processes, or None for os.cpu_count()
+            executor: An existing process pool to use instead of starting one
+        
+        Returns:
+            {'studies': [...], 'file_count': int, 'skipped': [paths of non-DICOM files]}
+        """
+        if zipfile.is_zipfile(source):
+            if not extract_dir:
+                raise ValueError('extract_dir is required to index a ZIP archive')
+            file_paths = DicomSeriesIndexer.extract_zip(source, extract_dir)
+        elif os.path.isdir(source):
+            file_paths = DicomSeriesIndexer.list_files(source)
+        else:
+            raise ValueError(f'{source} is neither a directory nor a ZIP archive')
+        
+        return DicomSeriesIndexer.index_files(file_paths, max_workers, executor)
+    
+    @staticmethod
+    def index_files(file_paths: List[str], max_workers: Optional[int] = None,
+                    executor: Optional[Executor] = None) -> Dict[str, Any]:
+        """Index a list of files; see index()"""
+        headers = DicomSeriesIndexer.read_headers(file_paths, max_workers, executor)
+        
+        studies = {}
+        skipped = []
+        for file_path, instance in zip(file_paths, headers):
+            if instance is None:
+                skipped.append(file_path)
+                continue
+            study_uid = instance['study_instance_uid'] or 'unknown'
+            series_uid = instance['series_instance_uid'] or 'unknown'
+            study = studies.get(study_uid)
+            if study is None:
+                study = studies[study_uid] = {field: instance[field] for field in STUDY_FIELDS}
+                study['series'] = {}
+            series = study['series'].get(series_uid)
+            if series is None:
+                series = study['series'][series_uid] = {field: instance[field] for field in SERIES_FIELDS}
+                series['instances'] = []
+            series['instances'].append(instance)
+        
+        for study in studies.values():
+            series_list = sorted(study['series'].values(),
+                                 key=lambda s: (s['series_number'] is None, s['series_number'] or 0))
+            for series in series_list:
+                DicomSeriesIndexer.sort_slices(series)
+            study['series'] = series_list
+            study['series_count'] = len(series_list)
+            study['instance_count'] = sum(s['instance_count'] for s in series_list)
+        
+        return {
+            'studies': list(studies.values()),
+            'file_count': len(file_paths),
+            'skipped': skipped
+        }
+    
+    @staticmethod
+    def read_headers(file_paths: List[str], max_workers: Optional[int] = None,
+                     executor: Optional[Executor] = None) -> List[Optional[Dict[str, Any]]]:
+        """Header metadata for each path (None for non-DICOM files), in input order"""
+        workers = max_workers or os.cpu_count() or 1
+        if (executor is None and workers == 1) or len(file_paths) < PARALLEL_MIN_FILES:
+            return [_read_header(path) for path in file_paths]
+        if executor is not None:
+            return list(executor.map(_read_header, file_paths, chunksize=READ_CHUNK_SIZE))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_read_header, file_paths, chunksize=READ_CHUNK_SIZE))
+    
+    @staticmethod
+    def sort_slices(series: Dict[str, Any]) -> None:
+        """
+        Order a series' instances spatially and record their positions.
+        
+        Each slice's ImagePositionPatient is projected on the normal of the
+        first slice's ImageOrientationPatient (row x column direction). Series
+        without usable geometry fall back to InstanceNumber, then SliceLocation.
+        Sets slice_position on each instance, and instance_count and
+        slice_spacing (median distance between slices, or None) on the series.
+        """
+        instances = series['instances']
+        orientation = next((i['image_orientation_patient'] for i in instances
+                            if i['image_orientation_patient'] and len(i['image_orientation_patient']) == 6), None)
+        has_positions = all(i['image_position_patient'] and len(i['image_position_patient']) == 3 for i in instances)
+        
+        if orientation and has_positions:
+            normal = np.cross(np.array(orientation[:3], dtype=float), np.array(orientation[3:], dtype=float))
+            positions = np.array([i['image_position_patient'] for i in instances], dtype=float) @ normal
+            for instance, position in zip(instances, positions):
+                instance['slice_position'] = float(position)
+            instances.sort(key=lambda i: (i['slice_position'], i['instance_number'] or 0))
+            gaps = np.diff([i['slice_position'] for i in instances])
+            series['slice_spacing'] = float(np.median(gaps)) if len(gaps) else None
+        else:
+            for instance in instances:
+                instance['slice_position'] = instance['slice_location']
+            instances.sort(key=lambda i: (i['instance_number'] is None, i['instance_number'] or 0,
+                                          i['slice_location'] or 0))
+            series['slice_spacing'] = None
+        
+        series['instance_count'] = len(instances)
+    
+    @staticmethod
+    def list_files(directory: str) -> List[str]:
+        """All regular files under a directory, in a stable order"""
+        file_paths = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            file_paths.extend(os.path.join(root, name) for name in sorted(files) if not name.startswith('.'))
+        return file_paths
+    
+    @staticmethod
+    def extract_zip(zip_path: str, extract_dir: str) -> List[str]:
+        """
+        Extract a ZIP's files into extract_dir, refusing paths that escape it.
+        
+        Returns:
+            The extracted file paths
+        """
+        root = os.path.realpath(extract_dir)
+        os.makedirs(root, exist_ok=True)
+        file_paths = []
+        with zipfile.ZipFile(zip_path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or os.path.basename(member.filename).startswith('.'):
+                    continue
+                target = os.path.realpath(os.path.join(root, member.filename))
+                if not target.startswith(root + os.sep):
+                    raise ValueError(f'Unsafe path in ZIP archive: {member.filename}')
+                file_paths.append(archive.extract(member, root))
+        return file_paths
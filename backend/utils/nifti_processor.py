@@ -1,11 +1,28 @@
 import nibabel as nib
 import numpy as np
 from PIL import Image
-import io
 import base64
+import gzip
+import hashlib
+import logging
 import os
-import dicom2nifti
-from typing import Dict, Any, Optional, Tuple, List
+import shutil
+import threading
+import uuid
+from typing import Dict, Any, Optional, Tuple
+from utils.render_cache import RenderCache, get_render_cache, encode_image, encode_array, IMAGE_MIMETYPES
+from utils.dicom_nifti_converter import DicomNiftiConverter
+from utils.dicom_series_indexer import DicomSeriesIndexer
+from utils.windowing import window_to_uint8
+
+logger = logging.getLogger(__name__)
+
+# Uncompressed copies of .nii.gz files, so a slice can be read without decompressing the volume
+NIFTI_CACHE_DIR = os.getenv('NIFTI_CACHE_DIR', os.path.join('uploads', 'nifti_cache'))
+NIFTI_CACHE_BYTES = int(os.getenv('NIFTI_CACHE_BYTES', str(10 * 1024 * 1024 * 1024)))
+
+_nifti_cache_lock = threading.Lock()  # Guards _nifti_decompressing and pruning
+_nifti_decompressing = {}  # cached path -> lock held while it is decompressed, so it is done once
 
 class NiftiProcessor:
     """Utility class for processing NIfTI files and converting DICOM to NIfTI"""
@@ -22,9 +39,9 @@ class NiftiProcessor:
                 'voxel_sizes': [float(z) for z in header.get_zooms()],
                 'data_type': str(header.get_data_dtype()),
                 'affine': header.get_best_affine().tolist(),
-                'description': str(header.get('descrip', b'').decode('utf-8', 'ignore').strip()),
+                'description': NiftiProcessor._header_text(header, 'descrip'),
                 'intent_code': int(header.get('intent_code', 0)),
-                'intent_name': str(header.get('intent_name', b'').decode('utf-8', 'ignore').strip()),
+                'intent_name': NiftiProcessor._header_text(header, 'intent_name'),
                 'slice_duration': float(header.get('slice_duration', 0.0)),
                 'time_units': int(header.get('xyzt_units', 0) & 0x38), # Mask for time units
                 'spatial_units': int(header.get('xyzt_units', 0) & 0x07), # Mask for spatial units
@@ -34,61 +51,242 @@ class NiftiProcessor:
             
             return metadata
             
+        except FileNotFoundError:
+            raise
         except Exception as e:
             raise Exception(f"Error reading NIfTI metadata: {str(e)}")
     
+    @staticmethod
+    def _header_text(header, field: str) -> str:
+        """A text field of the header (nibabel returns these as 0-d byte arrays)"""
+        value = np.asarray(header.get(field, b'')).item()
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'ignore')
+        return str(value).strip()
+    
     @staticmethod
     def nifti_to_image(file_path: str, slice_index: Optional[int] = None, 
                       axis: int = 2, window_center: Optional[float] = None, 
-                      window_width: Optional[float] = None) -> str:
+                      window_width: Optional[float] = None, image_format: str = 'png') -> str:
         """
-        Convert NIfTI slice to base64 encoded PNG image
+        Convert NIfTI slice to base64 encoded PNG (or JPEG/WebP) image
         axis: 0=sagittal, 1=coronal, 2=axial
         """
+        data, mimetype = NiftiProcessor.render_nifti_slice(
+            file_path, slice_index, axis, window_center, window_width, image_format
+        )
+        return f"data:{mimetype};base64,{base64.b64encode(data).decode()}"
+    
+    @staticmethod
+    def render_nifti_slice(file_path: str, slice_index: Optional[int] = None,
+                           axis: int = 2, window_center: Optional[float] = None,
+                           window_width: Optional[float] = None, image_format: str = 'png') -> Tuple[bytes, str]:
+        """
+        Render a NIfTI slice to an encoded image, through the render cache.
+        
+        Args:
+            file_path: Path to the NIfTI file
+            slice_index: Slice along the axis, or None for the middle slice
+            axis: 0=sagittal, 1=coronal, 2=axial
+            window_center: Window center, or None to auto-normalize
+            window_width: Window width, or None to auto-normalize
+            image_format: 'png', 'jpeg', 'webp', or 'raw' for the unwindowed pixel array (.npy)
+        
+        Returns:
+            (encoded image bytes, mimetype)
+        """
+        if image_format not in IMAGE_MIMETYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
         try:
-            img = nib.load(file_path)
-            data = img.get_fdata()
-            
-            # Handle 4D data (time series) - take first volume
-            if len(data.shape) > 3:
-                data = data[..., 0]
-                
-            # Select slice
-            if axis == 0:
-                if slice_index is None: slice_index = data.shape[0] // 2
-                slice_data = data[slice_index, :, :]
-                # Rotate for display
-                slice_data = np.rot90(slice_data)
-            elif axis == 1:
-                if slice_index is None: slice_index = data.shape[1] // 2
-                slice_data = data[:, slice_index, :]
-                slice_data = np.rot90(slice_data)
-            else: # axis == 2 (axial)
-                if slice_index is None: slice_index = data.shape[2] // 2
-                slice_data = data[:, :, slice_index]
-                slice_data = np.rot90(slice_data)
-            
-            # Normalize and window
-            if window_center is not None and window_width is not None:
-                slice_data = NiftiProcessor._apply_window_level(slice_data, window_center, window_width)
-            else:
-                slice_data = NiftiProcessor._normalize_pixel_array(slice_data)
-            
-            # Convert to 8-bit
-            slice_data = (slice_data * 255).astype(np.uint8)
-            
-            image = Image.fromarray(slice_data, 'L')
-            
-            # Convert to base64
-            img_buffer = io.BytesIO()
-            image.save(img_buffer, format='PNG')
-            img_str = base64.b64encode(img_buffer.getvalue()).decode()
-            
-            return f"data:image/png;base64,{img_str}"
+            key = RenderCache.make_key(file_path, 'nifti', slice_index, axis, window_center, window_width, image_format)
+            data = get_render_cache().get_or_render(
+                key,
+                lambda: NiftiProcessor._render_nifti_slice(
+                    file_path, slice_index, axis, window_center, window_width, image_format
+                )
+            )
+            return data, IMAGE_MIMETYPES[image_format]
             
+        except (FileNotFoundError, IndexError):
+            # A missing file or slice, which callers report differently from a rendering fault
+            raise
         except Exception as e:
             raise Exception(f"Error converting NIfTI to image: {str(e)}")
     
+    @staticmethod
+    def _render_nifti_slice(file_path: str, slice_index: Optional[int], axis: int,
+                            window_center: Optional[float], window_width: Optional[float],
+                            image_format: str) -> bytes:
+        """Read, window and encode one slice (uncached)"""
+        img = NiftiProcessor.load_nifti(file_path)
+        slice_data = NiftiProcessor.read_slice(img, slice_index, axis)
+        
+        if image_format == 'raw':
+            # Scaled voxel values, in the stored dtype when the file has no scaling
+            if slice_data.dtype != img.get_data_dtype():
+                slice_data = slice_data.astype(np.float32)
+            return encode_array(slice_data)
+        
+        # Normalize and window (read_slice has already applied scl_slope/scl_inter)
+        slice_data = window_to_uint8(slice_data, window_center, window_width)
+        
+        image = Image.fromarray(slice_data, 'L')
+        
+        return encode_image(image, image_format)[0]
+    
+    @staticmethod
+    def load_nifti(file_path: str):
+        """
+        Open a NIfTI image for slice access without reading its voxel data.
+        
+        Gzipped files are opened through their uncompressed copy (see
+        uncompressed_path), uncompressed ones are memory-mapped.
+        
+        Args:
+            file_path: Path to a .nii or .nii.gz file
+        
+        Returns:
+            nibabel image whose dataobj reads only the voxels that are indexed
+        """
+        return nib.load(NiftiProcessor.uncompressed_path(file_path), mmap='r')
+    
+    @staticmethod
+    def read_slice(img, slice_index: Optional[int] = None, axis: int = 2) -> np.ndarray:
+        """
+        Read one 2D slice of an image, rotated for display.
+        
+        Uncompressed files are indexed through a memory map, so only the pages
+        holding the slice are read whatever the axis; compressed files go
+        through the array proxy. Values are in the stored dtype unless the
+        file has scl_slope/scl_inter scaling (then float32, as get_fdata
+        would give). 4D data uses the first volume.
+        
+        Args:
+            img: nibabel image, e.g. from load_nifti()
+            slice_index: Slice along the axis, or None for the middle slice
+            axis: 0=sagittal, 1=coronal, 2=axial
+        
+        Returns:
+            2D array
+        """
+        shape = img.shape
+        if len(shape) < 3:
+            return np.rot90(np.asanyarray(img.dataobj))
+        if slice_index is None:
+            slice_index = shape[axis] // 2
+        if not 0 <= slice_index < shape[axis]:
+            raise IndexError(f"Slice {slice_index} is out of range for axis {axis} ({shape[axis]} slices)")
+        
+        slicer = [slice(None)] * 3 + [0] * (len(shape) - 3)
+        slicer[axis] = slice_index
+        slicer = tuple(slicer)
+        
+        proxy = img.dataobj
+        file_name = img.get_filename() or ''
+        if not nib.is_proxy(proxy) or file_name.endswith('.gz'):
+            return np.rot90(np.asanyarray(proxy[slicer]))
+        
+        slice_data = np.array(proxy.get_unscaled()[slicer])
+        if proxy.slope != 1 or proxy.inter != 0:
+            slice_data = slice_data.astype(np.float32)
+            slice_data *= np.float32(proxy.slope)
+            slice_data += np.float32(proxy.inter)
+        return np.rot90(slice_data)
+    
+    @staticmethod
+    def uncompressed_path(file_path: str) -> str:
+        """
+        Path of an uncompressed copy of a .nii.gz file, creating it on first use.
+        
+        Copies live in NIFTI_CACHE_DIR, named after the source's path, size and
+        modification time so a replaced file gets a new copy. Least recently
+        used copies are removed once the directory exceeds NIFTI_CACHE_BYTES.
+        Other files are returned unchanged. Only requests for the same file wait
+        while it is decompressed; cached copies are returned without locking.
+        
+        Args:
+            file_path: Path to a NIfTI file
+        
+        Returns:
+            Path to read the file from
+        """
+        if not file_path.endswith('.gz'):
+            return file_path
+        cached_path = NiftiProcessor._cached_copy_path(file_path)
+        
+        if NiftiProcessor._touch(cached_path):
+            return cached_path
+        
+        with _nifti_cache_lock:
+            path_lock = _nifti_decompressing.setdefault(cached_path, threading.Lock())
+        with path_lock:
+            try:
+                # Another request may have finished it while we waited
+                if NiftiProcessor._touch(cached_path):
+                    return cached_path
+                os.makedirs(NIFTI_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    with gzip.open(file_path, 'rb') as source, open(tmp_path, 'wb') as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+                    os.replace(tmp_path, cached_path)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+            finally:
+                with _nifti_cache_lock:
+                    _nifti_decompressing.pop(cached_path, None)
+        logger.debug(f"Decompressed {file_path} to {cached_path}")
+        with _nifti_cache_lock:
+            NiftiProcessor._prune_nifti_cache(keep=cached_path)
+        return cached_path
+    
+    @staticmethod
+    def remove_uncompressed_copy(file_path: str) -> None:
+        """Remove the cached uncompressed copy of a .nii.gz file, if any; call before removing the file itself"""
+        if not file_path.endswith('.gz') or not os.path.exists(file_path):
+            return
+        try:
+            os.remove(NiftiProcessor._cached_copy_path(file_path))
+        except FileNotFoundError:
+            pass
+    
+    @staticmethod
+    def _cached_copy_path(file_path: str) -> str:
+        """Cache path of a .nii.gz file's uncompressed copy, named after its path, size and modification time"""
+        stat = os.stat(file_path)
+        identity = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+        return os.path.join(NIFTI_CACHE_DIR, hashlib.sha1(repr(identity).encode('utf-8')).hexdigest() + '.nii')
+    
+    @staticmethod
+    def _touch(cached_path: str) -> bool:
+        """Mark a cached copy as recently used; False if it does not exist (or was just pruned)"""
+        try:
+            os.utime(cached_path)
+            return True
+        except FileNotFoundError:
+            return False
+    
+    @staticmethod
+    def _prune_nifti_cache(keep: str) -> None:
+        """Remove least recently used copies until the cache is under NIFTI_CACHE_BYTES"""
+        entries = []
+        for name in os.listdir(NIFTI_CACHE_DIR):
+            path = os.path.join(NIFTI_CACHE_DIR, name)
+            if name.endswith('.nii') and path != keep:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = os.path.getsize(keep) + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= NIFTI_CACHE_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    
     @staticmethod
     def convert_dicom_to_nifti(dicom_directory: str, output_folder: str) -> str:
         """
@@ -98,45 +296,18 @@ class NiftiProcessor:
         try:
             os.makedirs(output_folder, exist_ok=True)
             
-            # dicom2nifti converts the whole directory
-            dicom2nifti.convert_directory(dicom_directory, output_folder, compression=True, reorient=True)
+            index = DicomSeriesIndexer.index(dicom_directory)
+            series_list = [series for study in index['studies'] for series in study['series']]
+            if not series_list:
+                raise Exception("No DICOM series found")
             
-            # Find the generated file (it usually has a random name or based on series)
-            generated_files = [f for f in os.listdir(output_folder) if f.endswith('.nii.gz') or f.endswith('.nii')]
-            
-            if not generated_files:
-                raise Exception("No NIfTI file generated")
-                
-            # Return the first generated file (assuming one series per directory)
-            return os.path.join(output_folder, generated_files[0])
+            # Convert the first series (assuming one series per directory) to a path of its own
+            series = series_list[0]
+            output_path = os.path.join(
+                output_folder, f"{uuid.uuid4()}_{series['series_instance_uid'] or 'unknown'}.nii.gz"
+            )
+            DicomNiftiConverter.convert_series([i['file_path'] for i in series['instances']], output_path)
+            return output_path
             
         except Exception as e:
             raise Exception(f"Error converting DICOM to NIfTI: {str(e)}")
-
-    @staticmethod
-    def _normalize_pixel_array(pixel_array: np.ndarray) -> np.ndarray:
-        """Normalize pixel array to 0-1 range"""
-        min_val = np.nanmin(pixel_array)
-        max_val = np.nanmax(pixel_array)
-        
-        if max_val > min_val:
-            return (pixel_array - min_val) / (max_val - min_val)
-        else:
-            return np.zeros_like(pixel_array)
-    
-    @staticmethod
-    def _apply_window_level(pixel_array: np.ndarray, center: float, width: float) -> np.ndarray:
-        """Apply window/level transformation"""
-        min_val = center - width / 2
-        max_val = center + width / 2
-        
-        # Clip values to window range
-        windowed = np.clip(pixel_array, min_val, max_val)
-        
-        # Normalize to 0-1
-        if max_val > min_val:
-            windowed = (windowed - min_val) / (max_val - min_val)
-        else:
-            windowed = np.zeros_like(windowed)
-        
-        return windowed
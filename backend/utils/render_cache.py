@@ -0,0 +1,268 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Size bounds of the two cache tiers
+RENDER_CACHE_MEMORY_BYTES = int(os.getenv('RENDER_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+RENDER_CACHE_DISK_BYTES = int(os.getenv('RENDER_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR', os.path.join('uploads', 'render_cache'))
+
+# Part of every key; bump it when rendering output changes so old cached images are not served
+RENDER_VERSION = 2
+
+# Disk eviction trims to this fraction of the bound, so it does not run on every write
+DISK_EVICTION_TARGET = 0.9
+
+
+class RenderCache:
+    """
+    Size-bounded LRU cache of rendered images, in memory and on disk.
+    
+    Keys are derived from the source file's identity (path, size and
+    modification time, so a rewritten file is never served stale) and the
+    render parameters. Memory holds the most recently used images; disk
+    holds more, survives restarts and is shared by worker processes. Disk
+    entries are written atomically, and their mtime is their LRU timestamp.
+    """
+    
+    def __init__(self, cache_dir: Optional[str] = RENDER_CACHE_DIR,
+                 memory_bytes: int = RENDER_CACHE_MEMORY_BYTES,
+                 disk_bytes: int = RENDER_CACHE_DISK_BYTES):
+        self.cache_dir = cache_dir if disk_bytes > 0 else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # key -> bytes, least recently used first
+        self._memory_size = 0
+        self._disk_size = None  # Measured on first disk write
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                       'memory_evictions': 0, 'disk_evictions': 0, 'render_seconds': 0.0}
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(file_path: str, *params: Any) -> str:
+        """
+        Cache key for a rendering of a file.
+        
+        Args:
+            file_path: Source image file
+            params: Render parameters (frame or slice, axis, window, format, ...)
+        
+        Returns:
+            Hex digest identifying the file version and parameters
+        """
+        stat = os.stat(file_path)
+        identity = (RENDER_VERSION, os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns) + params
+        return hashlib.sha1(repr(identity).encode('utf-8')).hexdigest()
+    
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """
+        Return the cached image for a key, rendering and caching it on a miss.
+        
+        Args:
+            key: From make_key()
+            render: Produces the encoded image bytes
+        
+        Returns:
+            The encoded image bytes
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return data
+        
+        data = self._read_disk(key)
+        if data is not None:
+            with self._lock:
+                self._stats['disk_hits'] += 1
+            self._remember(key, data)
+            return data
+        
+        started = time.perf_counter()
+        data = render()
+        with self._lock:
+            self._stats['misses'] += 1
+            self._stats['render_seconds'] += time.perf_counter() - started
+        self._remember(key, data)
+        self._write_disk(key, data)
+        return data
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_size
+        stats['disk_bytes'] = self._disk_size
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else None
+        return stats
+    
+    def clear(self) -> None:
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                self._remove_file(os.path.join(self.cache_dir, name))
+            self._disk_size = 0
+    
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+                self._stats['memory_evictions'] += 1
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+    
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+            return data
+        except OSError:
+            return None
+    
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if not self.cache_dir or len(data) > self.disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"DEBUG: Render cache write failed: {str(e)}")
+            self._remove_file(tmp_path)
+            return
+        
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_size += len(data)
+            over_limit = self._disk_size > self.disk_bytes
+        if over_limit:
+            self._evict_disk()
+    
+    def _scan_disk(self) -> list:
+        """(path, size, mtime) of every finished entry"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+    
+    def _evict_disk(self) -> None:
+        """Delete least recently used files until the tier is under DISK_EVICTION_TARGET of its bound"""
+        # Rescanning also picks up entries written by other processes
+        entries = sorted(self._scan_disk(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_bytes * DISK_EVICTION_TARGET
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            if self._remove_file(path):
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._disk_size = total
+            self._stats['disk_evictions'] += evicted
+    
+    @staticmethod
+    def _remove_file(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """The process-wide render cache"""
+    global _render_cache
+    with _render_cache_lock:
+        if _render_cache is None:
+            _render_cache = RenderCache()
+        return _render_cache
+
+
+# Output formats of the renderers; 'raw' is the unwindowed pixel array in .npy form
+IMAGE_MIMETYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'raw': 'application/x-npy'
+}
+
+
+def encode_image(image, image_format: str) -> Tuple[bytes, str]:
+    """
+    Encode a PIL image for the viewer.
+    
+    Args:
+        image: PIL Image
+        image_format: 'png', 'jpeg' or 'webp'
+    
+    Returns:
+        (encoded bytes, mimetype)
+    """
+    buffer = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(buffer, format='JPEG', quality=90)
+    elif image_format == 'webp':
+        image.save(buffer, format='WEBP', lossless=True)
+    elif image_format == 'png':
+        image.save(buffer, format='PNG')
+    else:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return buffer.getvalue(), IMAGE_MIMETYPES[image_format]
+
+
+def encode_array(array) -> bytes:
+    """Serialize a pixel array (.npy format, which keeps its dtype and shape)"""
+    import numpy as np
+    
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_array(data: bytes):
+    """Inverse of encode_array()"""
+    import numpy as np
+    
+    return np.load(io.BytesIO(data), allow_pickle=False)
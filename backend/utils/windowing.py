@@ -0,0 +1,103 @@
+"""
+Window/level rendering of DICOM and NIfTI pixel data to 8-bit images.
+
+Output value for a stored value v (the same linear window the viewers have
+always used, now in rescaled units):
+
+    x = v * slope + intercept
+    out = floor(255 * (clip(x, lo, hi) - lo) / (hi - lo)),  lo/hi = center -/+ width / 2
+
+8- and 16-bit integer data (CT, MR, X-ray) goes through a lookup table with
+one entry per possible stored value, so rescale and window are a single
+np.take into the uint8 output and no full-size temporaries are allocated.
+The tables are cached per (dtype, rescale, window). Other dtypes (NIfTI
+float or 32-bit data) take a float32 path that works in place on one copy.
+With no window given, the window spans the data's min..max.
+"""
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+# Integer dtypes small enough for a full lookup table (at most 65536 entries)
+LUT_DTYPES = (np.uint8, np.int8, np.uint16, np.int16)
+
+
+def window_to_uint8(pixels: np.ndarray, window_center: Optional[float] = None,
+                    window_width: Optional[float] = None, slope: float = 1.0,
+                    intercept: float = 0.0) -> np.ndarray:
+    """
+    Apply rescale and window/level, returning a new uint8 array of the same shape.
+    
+    Args:
+        pixels: Stored pixel values (any shape, e.g. a slice or an RGB image)
+        window_center: Window center in rescaled units, or None to span min..max
+        window_width: Window width in rescaled units, or None to span min..max
+        slope: RescaleSlope (DICOM) or scl_slope
+        intercept: RescaleIntercept (DICOM) or scl_inter
+    
+    Returns:
+        uint8 array
+    """
+    slope = float(slope if slope is not None else 1.0)
+    intercept = float(intercept if intercept is not None else 0.0)
+    
+    if window_center is None or window_width is None:
+        if pixels.size == 0:
+            return np.zeros(pixels.shape, dtype=np.uint8)
+        low, high = np.nanmin(pixels), np.nanmax(pixels)
+        if np.isnan(low):
+            return np.zeros(pixels.shape, dtype=np.uint8)
+        # Rescale is linear, so the rescaled range comes from the stored one
+        low, high = sorted((float(low) * slope + intercept, float(high) * slope + intercept))
+    else:
+        low = float(window_center) - float(window_width) / 2
+        high = float(window_center) + float(window_width) / 2
+    
+    if pixels.dtype.type in LUT_DTYPES:
+        lut = _window_lut(pixels.dtype.str, slope, intercept, low, high)
+        if pixels.dtype.kind == 'i':
+            # Index the table by the unsigned bit pattern; it is laid out to match
+            pixels = pixels.view(pixels.dtype.str.replace('i', 'u'))
+        return np.take(lut, pixels)
+    
+    return _window_float32(pixels, slope, intercept, low, high)
+
+
+@lru_cache(maxsize=64)
+def _window_lut(dtype_str: str, slope: float, intercept: float, low: float, high: float) -> np.ndarray:
+    """
+    uint8 output for every stored value of an 8/16-bit integer dtype.
+    
+    Entry i is the output for the value whose unsigned bit pattern is i, so
+    signed data is looked up through an unsigned view without an offset.
+    """
+    dtype = np.dtype(dtype_str)
+    unsigned = np.dtype(dtype_str.replace('i', 'u'))
+    values = np.arange(2 ** (8 * dtype.itemsize), dtype=np.int64).astype(unsigned).view(dtype)
+    lut = _scale(values.astype(np.float64) * slope + intercept, low, high)
+    lut.flags.writeable = False
+    return lut
+
+
+def _window_float32(pixels: np.ndarray, slope: float, intercept: float, low: float, high: float) -> np.ndarray:
+    """Window on a single float32 working copy, modified in place."""
+    work = pixels.astype(np.float32, copy=True)
+    if slope != 1.0:
+        work *= np.float32(slope)
+    if intercept != 0.0:
+        work += np.float32(intercept)
+    np.nan_to_num(work, copy=False, nan=low)
+    return _scale(work, low, high)
+
+
+def _scale(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Map [low, high] to 0..255 in place and return the uint8 result."""
+    if not high > low:
+        return np.zeros(values.shape, dtype=np.uint8)
+    np.clip(values, low, high, out=values)
+    values -= values.dtype.type(low)
+    # Divide then multiply, as the float64 implementation did, so results match it exactly
+    values /= values.dtype.type(high - low)
+    values *= values.dtype.type(255)
+    return values.astype(np.uint8)